@@ -0,0 +1,64 @@
+import json
+import threading
+import click
+
+
+def register_commands(app):
+    """Register maintenance commands with the ``flask`` CLI"""
+
+    @app.cli.command('bench-room-directory')
+    @click.option('--sizes', default='10,100,1000', help='Comma-separated room counts to seed')
+    def bench_room_directory(sizes):
+        """Compare query counts of the room directory as the number of rooms grows"""
+        from src.services.room_directory import benchmark_directory
+        results = benchmark_directory(tuple(int(size) for size in sizes.split(',')))
+        for result in results:
+            click.echo(json.dumps(result))
+
+    @app.cli.command('reconcile-member-counts')
+    @click.option('--room-id', type=int, default=None, help='Only check this room')
+    def reconcile_member_counts_command(room_id):
+        """Repair StudyRoom.active_member_count drift from the memberships table"""
+        from src.services.room_capacity import reconcile_member_counts
+        repaired = reconcile_member_counts(room_id)
+        for drifted_id, old, new in repaired:
+            click.echo(f"room {drifted_id}: {old} -> {new}")
+        click.echo(f"Repaired {len(repaired)} rooms")
+
+    @app.cli.command('backfill-study-rollups')
+    @click.option('--batch-size', default=500, help='Sessions per committed batch')
+    def backfill_study_rollups(batch_size):
+        """Rebuild the daily study-time rollups from StudySession"""
+        from src.services.study_rollups import backfill_rollups
+        click.echo(f"Rolled up {backfill_rollups(batch_size)} sessions")
+
+    @app.cli.command('sweep-stale-sessions')
+    @click.option('--chunk-size', default=500, help='Sessions closed per committed chunk')
+    def sweep_stale_sessions_command(chunk_size):
+        """Close study sessions whose members stopped sending heartbeats"""
+        from src.services.session_sweeper import sweep_stale_sessions
+        click.echo(f"Closed {sweep_stale_sessions(chunk_size)} abandoned sessions")
+
+    @app.cli.command('compact-whiteboards')
+    @click.option('--min-ops', default=1, help='Only compact boards with at least this many pending ops')
+    def compact_whiteboards_command(min_ops):
+        """Fold whiteboard op logs into their snapshots"""
+        from src.services.whiteboard_ops import compact_whiteboards
+        click.echo(f"Folded {compact_whiteboards(min_ops)} whiteboard ops")
+
+    @app.cli.command('thin-whiteboard-history')
+    @click.option('--retention', default=None, help='Retention tiers, e.g. "1h:all,7d:1h,*:1d"')
+    def thin_whiteboard_history_command(retention):
+        """Apply the whiteboard history retention policy"""
+        from src.services.whiteboard_history import thin_history, HISTORY_RETENTION
+        click.echo(f"Deleted {thin_history(retention or HISTORY_RETENTION)} history entries")
+
+    @app.cli.command('run-worker')
+    def run_worker_command():
+        """Resume unfinished AI jobs and sweep stale sessions; run as a single process next to the web workers"""
+        from src.services.ai_jobs import ai_job_runner
+        from src.services.session_sweeper import session_sweeper
+        click.echo(f"Resumed {ai_job_runner.resume_incomplete()} unfinished AI jobs")
+        session_sweeper.start(app)
+        # Lanes and the sweeper run on background threads; stay up until stopped
+        threading.Event().wait()
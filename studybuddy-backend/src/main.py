@@ -11,14 +11,17 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from werkzeug.exceptions import HTTPException
 from src.extensions import db
+from src.commands import register_commands
 from src.models import (
     User, StudyRoom, Document, 
     StudyRoom, RoomMembership, StudySession,
     AIConversation, AIMessage, Flashcard, PracticeTest,
-    Document, DocumentShare,
+    AIGenerationFlight, AIGenerationJob, AIGenerationJobItem,
+    Document, DocumentShare, DocumentSummary,
     PaymentRecord, SubscriptionPlan, WebhookLog,
     ProfileSettings, LMSIntegration, UserActivity,
-    WhiteboardSession, WhiteboardHistory, RoomDocument, CollaborationEvent
+    WhiteboardSession, WhiteboardOp, WhiteboardHistory, RoomDocument, CollaborationEvent,
+    CacheVersion, UserStudyDaily, RoomStudyDaily, RoomStudyDailyUser
 )
 from src.routes.user import user_bp
 from src.routes.auth import auth_bp
@@ -29,6 +32,7 @@ from src.routes.payment import payment_bp
 from src.routes.external_services import external_bp
 from src.routes.profile import profile_bp
 from src.routes.whiteboard import whiteboard_bp
+from src.routes.analytics import analytics_bp
 
 def create_app():
     app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
@@ -149,6 +153,7 @@ def create_app():
     app.register_blueprint(external_bp, url_prefix='/api/external')
     app.register_blueprint(profile_bp, url_prefix='/api/profile')
     app.register_blueprint(whiteboard_bp, url_prefix='/api')
+    app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
 
     # Database configuration
     database_dir = os.path.join(os.path.dirname(__file__), 'database')
@@ -160,6 +165,7 @@ def create_app():
         'pool_recycle': 300,
     }
     db.init_app(app)
+    register_commands(app)
 
     # Create upload directory
     upload_dir = os.path.join(os.path.dirname(__file__), 'uploads')
@@ -169,6 +175,14 @@ def create_app():
     # Initialize database
     with app.app_context():
         db.create_all()
+        from src.services.room_capacity import ensure_member_count_column
+        ensure_member_count_column()
+        from src.services.whiteboard_ops import ensure_whiteboard_columns
+        ensure_whiteboard_columns()
+        from src.services.message_search import init_message_search
+        init_message_search()
+        from src.services.session_sweeper import ensure_open_session_index
+        ensure_open_session_index()
 
     # Health check endpoint
     @app.route('/api/health')
@@ -177,10 +191,15 @@ def create_app():
             # Test database connection
             from sqlalchemy import text
             db.session.execute(text('SELECT 1'))
+            from src.services.resilience import llm_breakers, llm_retry_budget
             return jsonify({
                 'status': 'healthy',
                 'timestamp': datetime.utcnow().isoformat(),
-                'version': '1.0.0'
+                'version': '1.0.0',
+                'llm': {
+                    'circuit_breakers': llm_breakers.snapshot(),
+                    'retry_budget': llm_retry_budget.to_dict()
+                }
             })
         except Exception as e:
             app.logger.error(f"Health check failed: {e}")
@@ -189,6 +208,16 @@ def create_app():
                 'error': str(e)
             }), 500
 
+    # Per-worker metrics endpoint
+    @app.route('/api/metrics')
+    def metrics_endpoint():
+        from src.services.metrics import metrics
+        return jsonify({
+            'worker_pid': os.getpid(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'metrics': metrics.snapshot()
+        })
+
     @app.route('/', defaults={'path': ''})
     @app.route('/<path:path>')
     def serve(path):
@@ -222,5 +251,13 @@ if __name__ == '__main__':
         format='%(asctime)s %(levelname)s %(name)s %(message)s'
     )
     
+    # The dev server is a single process; run the worker's jobs in the reloader's child only
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from src.services.ai_jobs import ai_job_runner
+        from src.services.session_sweeper import session_sweeper
+        with app.app_context():
+            ai_job_runner.resume_incomplete()
+        session_sweeper.start(app)
+
     app.run(host='0.0.0.0', port=5000, debug=True)
 
@@ -4,11 +4,16 @@ from src.extensions import db
 # These imports must come *after* db is defined
 from .user import User
 from .study_room import StudyRoom, RoomMembership, StudySession
-from .ai_tutor import AIConversation, AIMessage, Flashcard, PracticeTest
-from .document import Document, DocumentShare
+from .ai_tutor import (
+    AIConversation, AIMessage, Flashcard, PracticeTest,
+    AIGenerationFlight, AIGenerationJob, AIGenerationJobItem
+)
+from .document import Document, DocumentShare, DocumentSummary
 from .payment import PaymentRecord, SubscriptionPlan, WebhookLog
 from .profile import ProfileSettings, LMSIntegration, UserActivity
-from .whiteboard import WhiteboardSession, WhiteboardHistory, RoomDocument, CollaborationEvent
+from .whiteboard import WhiteboardSession, WhiteboardOp, WhiteboardHistory, RoomDocument, CollaborationEvent
+from .cache import CacheVersion
+from .analytics import UserStudyDaily, RoomStudyDaily, RoomStudyDailyUser
 
 # Now, any file that needs the database can do:
 # from src.models import db, User, StudyRoom, ...
\ No newline at end of file
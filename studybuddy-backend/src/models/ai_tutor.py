@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import json
 from src.extensions import db
 # db = SQLAlchemy()
 
@@ -104,3 +105,98 @@ class PracticeTest(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+
+class AIGenerationFlight(db.Model):
+    """Shared in-flight marker for coalescing identical AI generation calls across workers"""
+    __tablename__ = "ai_generation_flights"
+
+    id = db.Column(db.Integer, primary_key=True)
+    flight_key = db.Column(db.String(64), unique=True, nullable=False)  # sha256 of (task, model, input, params)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, completed, failed
+    result = db.Column(db.Text)  # JSON string of the shared generation result
+    owner = db.Column(db.String(64))  # pid/thread of the worker making the upstream call
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'flight_key': self.flight_key,
+            'status': self.status,
+            'owner': self.owner,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+class AIGenerationJob(db.Model):
+    """Batch flashcard/practice-test generation over many documents"""
+    __tablename__ = "ai_generation_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, partial, failed, cancelled
+    model = db.Column(db.String(50), default='auto')
+    task_types = db.Column(db.Text)  # JSON list: flashcards, practice_test
+    params = db.Column(db.Text)  # JSON dict: count, question_count
+    concurrency = db.Column(db.Integer, default=2)
+    total_items = db.Column(db.Integer, default=0)
+    finished_items = db.Column(db.Integer, default=0)  # completed + failed; also the finish sequence
+    failed_items = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+    items = db.relationship('AIGenerationJobItem', backref='job', lazy=True, cascade='all, delete-orphan')
+
+    def get_task_types(self):
+        return json.loads(self.task_types) if self.task_types else []
+
+    def get_params(self):
+        return json.loads(self.params) if self.params else {}
+
+    def is_finished(self):
+        return self.status in ['completed', 'partial', 'failed', 'cancelled']
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'status': self.status,
+            'model': self.model,
+            'task_types': self.get_task_types(),
+            'params': self.get_params(),
+            'concurrency': self.concurrency,
+            'total_items': self.total_items,
+            'finished_items': self.finished_items,
+            'failed_items': self.failed_items,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+class AIGenerationJobItem(db.Model):
+    """One (document, task) unit of a batch job; committed as soon as it finishes"""
+    __tablename__ = "ai_generation_job_items"
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('ai_generation_jobs.id'), nullable=False, index=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False)
+    task_type = db.Column(db.String(20), nullable=False)  # flashcards, practice_test
+    status = db.Column(db.String(20), default='pending')  # pending, running, completed, failed
+    result = db.Column(db.Text)  # JSON: created flashcards / practice test
+    error = db.Column(db.String(255))
+    finish_seq = db.Column(db.Integer)  # Order in which items finished, used as the stream cursor
+    claimed_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_id': self.job_id,
+            'document_id': self.document_id,
+            'task_type': self.task_type,
+            'status': self.status,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'finish_seq': self.finish_seq,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
@@ -0,0 +1,50 @@
+from datetime import datetime
+from src.extensions import db
+
+class UserStudyDaily(db.Model):
+    """Study time per user per day (UTC), rolled up as sessions end"""
+    __tablename__ = "user_study_daily"
+    __table_args__ = (db.UniqueConstraint('user_id', 'day', name='uq_user_study_daily'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False)
+    minutes = db.Column(db.Integer, nullable=False, default=0)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'minutes': self.minutes,
+            'sessions': self.sessions
+        }
+
+class RoomStudyDaily(db.Model):
+    """Study time per room per day (UTC), rolled up as sessions end"""
+    __tablename__ = "room_study_daily"
+    __table_args__ = (db.UniqueConstraint('room_id', 'day', name='uq_room_study_daily'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('study_room.id'), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False)
+    minutes = db.Column(db.Integer, nullable=False, default=0)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    distinct_users = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'minutes': self.minutes,
+            'sessions': self.sessions,
+            'distinct_users': self.distinct_users
+        }
+
+class RoomStudyDailyUser(db.Model):
+    """Users already counted in RoomStudyDaily.distinct_users for a room and day"""
+    __tablename__ = "room_study_daily_users"
+
+    room_id = db.Column(db.Integer, db.ForeignKey('study_room.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
@@ -0,0 +1,10 @@
+from datetime import datetime
+from src.extensions import db
+
+class CacheVersion(db.Model):
+    """Shared version counter for a cached dataset; bumping it invalidates every worker's copy"""
+    __tablename__ = "cache_versions"
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
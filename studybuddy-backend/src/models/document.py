@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import os
+import json
 from src.extensions import db 
 
 class Document(db.Model):
@@ -96,3 +97,48 @@ class DocumentShare(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+
+class DocumentSummary(db.Model):
+    """Cached summary keyed by (content hash, model, prompt version, scope)"""
+    __tablename__ = "document_summaries"
+
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)  # sha256 of the summarized text
+    model = db.Column(db.String(50), nullable=False)
+    prompt_version = db.Column(db.String(20), nullable=False)
+    scope = db.Column(db.String(20), nullable=False)  # range, document
+    page_start = db.Column(db.Integer)
+    page_end = db.Column(db.Integer)
+    status = db.Column(db.String(20), default='pending')  # pending, completed, failed
+    summary = db.Column(db.Text)
+    sections = db.Column(db.Text)  # JSON list of page-range summaries (document scope only)
+    error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('content_hash', 'model', 'prompt_version', 'scope', name='unique_document_summary'),
+    )
+
+    def get_sections(self):
+        """Get page-range summaries as a list"""
+        try:
+            return json.loads(self.sections) if self.sections else []
+        except json.JSONDecodeError:
+            return []
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'content_hash': self.content_hash,
+            'model': self.model,
+            'prompt_version': self.prompt_version,
+            'scope': self.scope,
+            'page_start': self.page_start,
+            'page_end': self.page_end,
+            'status': self.status,
+            'summary': self.summary,
+            'sections': self.get_sections(),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -2,8 +2,12 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import uuid
 from src.extensions import db
+from src.utils.signed_urls import sign_url
 # db = SQLAlchemy()
 
+# Signed thumbnail URLs only grant access to the thumbnail of their room
+THUMBNAIL_URL_PURPOSE = 'whiteboard_thumbnail'
+
 class StudyRoom(db.Model):
     __tablename__ = "study_room"
     
@@ -15,10 +19,12 @@ class StudyRoom(db.Model):
     subject = db.Column(db.String(50))
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     max_participants = db.Column(db.Integer, default=10)
+    active_member_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Maintained with joins/leaves
     is_private = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
     meeting_url = db.Column(db.String(255))  # Google Meet/Zoom URL
     whiteboard_data = db.Column(db.Text)  # JSON string for whiteboard state
+    stroke_tolerance = db.Column(db.Float)  # RDP tolerance (px) for new strokes; None = default
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -39,11 +45,16 @@ class StudyRoom(db.Model):
         return [membership.user for membership in self.memberships if membership.is_active]
 
     def get_member_count(self):
-        return len([m for m in self.memberships if m.is_active])
+        return self.active_member_count or 0
 
     def can_join(self):
+        # Advisory only; room_capacity.claim_seat is the atomic check
         return self.is_active and self.get_member_count() < self.max_participants
 
+    def thumbnail_url(self):
+        """Signed, so room lists can use it as an <img> src without an Authorization header"""
+        return sign_url(f"/api/rooms/{self.id}/whiteboard/thumbnail", THUMBNAIL_URL_PURPOSE, self.id)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -57,6 +68,7 @@ class StudyRoom(db.Model):
             'is_active': self.is_active,
             'meeting_url': self.meeting_url,
             'member_count': self.get_member_count(),
+            'thumbnail_url': self.thumbnail_url(),
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
@@ -85,6 +97,8 @@ class RoomMembership(db.Model):
 
 class StudySession(db.Model):
     __tablename__ = "study_session"
+    # Open-session lookups (end_time IS NULL) per user and room
+    __table_args__ = (db.Index('ix_study_session_open', 'user_id', 'room_id', 'end_time'),)
     
     
     id = db.Column(db.Integer, primary_key=True)
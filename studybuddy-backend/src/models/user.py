@@ -47,6 +47,9 @@ class User(db.Model):
         }
         return jwt.encode(payload, os.environ.get('SECRET_KEY', 'default-secret'), algorithm='HS256')
 
+    def has_active_premium(self):
+        return bool(self.is_premium) and (not self.premium_expires or self.premium_expires > datetime.utcnow())
+
     def is_account_locked(self):
         if self.locked_until and self.locked_until > datetime.utcnow():
             return True
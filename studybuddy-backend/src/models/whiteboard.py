@@ -1,16 +1,47 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import json
+from sqlalchemy import update, func
+from sqlalchemy.orm.attributes import set_committed_value
 from src.extensions import db
+from src.utils.stroke_codec import encode_board, encode_stroke
+
+# Element collection each whiteboard op type appends to
+OP_COLLECTIONS = {'stroke': 'strokes', 'shape': 'shapes', 'text': 'text_elements'}
+
+# Op removing elements by id: {"ids": [...]}
+ERASE_OP = 'erase'
+
+def empty_board():
+    return {
+        'strokes': [],
+        'shapes': [],
+        'text_elements': [],
+        'background_color': '#ffffff',
+        'canvas_size': {'width': 800, 'height': 600}
+    }
+
+def apply_op(data, op_type, payload):
+    """Apply one whiteboard op to a materialized board in place"""
+    if op_type == ERASE_OP:
+        erased = set(payload.get('ids') or ())
+        for collection in OP_COLLECTIONS.values():
+            if data.get(collection):
+                data[collection] = [e for e in data[collection] if e.get('id') not in erased]
+        return
+    data.setdefault(OP_COLLECTIONS[op_type], []).append(payload)
 
 class WhiteboardSession(db.Model):
     __tablename__ = "whiteboard_sessions"
     
     id = db.Column(db.Integer, primary_key=True)
     room_id = db.Column(db.Integer, db.ForeignKey('study_room.id'), nullable=False)
-    session_data = db.Column(db.Text)  # JSON string of whiteboard drawing data
+    session_data = db.Column(db.Text)  # JSON snapshot of the board as of snapshot_version
     last_modified_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     version = db.Column(db.Integer, default=1)
+    snapshot_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Ops above this are not in session_data yet
+    reset_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Version of the last full replacement
+    snapshot_element_count = db.Column(db.Integer)  # Elements in session_data; None if unknown (older rows)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -19,103 +50,184 @@ class WhiteboardSession(db.Model):
     room = db.relationship('StudyRoom', backref='whiteboard_sessions', lazy=True)
     last_modifier = db.relationship('User', backref='whiteboard_modifications', lazy=True)
     
-    def get_session_data(self):
-        """Get session data as dictionary"""
+    def get_snapshot_data(self):
+        """Get the materialized snapshot, without ops appended since"""
         try:
-            return json.loads(self.session_data) if self.session_data else {
-                'strokes': [],
-                'shapes': [],
-                'text_elements': [],
-                'background_color': '#ffffff',
-                'canvas_size': {'width': 800, 'height': 600}
-            }
+            return json.loads(self.session_data) if self.session_data else empty_board()
         except json.JSONDecodeError:
-            return {
-                'strokes': [],
-                'shapes': [],
-                'text_elements': [],
-                'background_color': '#ffffff',
-                'canvas_size': {'width': 800, 'height': 600}
-            }
+            return empty_board()
+    
+    def has_pending_ops(self):
+        return self.id is not None and (self.version or 1) > (self.snapshot_version or 1)
+    
+    def pending_ops(self):
+        """Ops appended after the snapshot, oldest first"""
+        if not self.has_pending_ops():
+            return []
+        return WhiteboardOp.query.filter(
+            WhiteboardOp.session_id == self.id,
+            WhiteboardOp.seq > self.snapshot_version
+        ).order_by(WhiteboardOp.seq).all()
+    
+    def get_session_data(self):
+        """Get the current board: the snapshot plus the op tail"""
+        data = self.get_snapshot_data()
+        for op in self.pending_ops():
+            apply_op(data, op.op_type, op.get_payload())
+        return data
     
     def set_session_data(self, data_dict):
-        """Set session data from dictionary"""
-        self.session_data = json.dumps(data_dict) if data_dict else None
-        self.version += 1
-        self.updated_at = datetime.utcnow()
+        """Replace the whole board; the new snapshot supersedes any pending ops.
+
+        For a stored board the version is bumped in SQL like ``append_op``, so
+        a replacement never reuses the seq of an op appended concurrently.
+        """
+        if isinstance(data_dict, dict):
+            encode_board(data_dict)  # Strokes are stored encoded
+        values = {
+            'session_data': json.dumps(data_dict) if data_dict else None,
+            'snapshot_element_count': self.count_elements(data_dict) if isinstance(data_dict, dict) else None,
+            'updated_at': datetime.utcnow()
+        }
+        if self.id is None:
+            # Not inserted yet, so nobody else can be writing to it
+            for key, value in values.items():
+                setattr(self, key, value)
+            self.version = (self.version or 1) + 1
+            self.snapshot_version = self.version
+            self.reset_version = self.version
+            return
+
+        table = WhiteboardSession.__table__
+        new_version = func.coalesce(table.c.version, 1) + 1
+        version = db.session.execute(
+            update(table)
+            .where(table.c.id == self.id)
+            .values(version=new_version, snapshot_version=new_version, reset_version=new_version, **values)
+            .returning(table.c.version)
+        ).scalar_one()
+        for key, value in dict(values, version=version, snapshot_version=version, reset_version=version).items():
+            set_committed_value(self, key, value)
+    
+    def append_op(self, op_type, payload, user_id):
+        """Append a drawing op without touching the snapshot (O(1) in board size).
+
+        The version bump is a single UPDATE ... RETURNING, so concurrent writers
+        get distinct, gap-free sequence numbers. Call on a flushed session.
+        """
+        if op_type == 'stroke':
+            encode_stroke(payload)  # Strokes are stored encoded
+        table = WhiteboardSession.__table__
+        now = datetime.utcnow()
+        version = db.session.execute(
+            update(table)
+            .where(table.c.id == self.id)
+            .values(version=func.coalesce(table.c.version, 1) + 1, last_modified_by=user_id, updated_at=now)
+            .returning(table.c.version)
+        ).scalar_one()
+        set_committed_value(self, 'version', version)
+        set_committed_value(self, 'last_modified_by', user_id)
+        set_committed_value(self, 'updated_at', now)
+        
+        payload['id'] = f"{op_type}_{version}"
+        payload['created_by'] = user_id
+        payload['created_at'] = now.isoformat()
+        op = WhiteboardOp(session_id=self.id, seq=version, op_type=op_type, user_id=user_id, created_at=now)
+        op.set_payload(payload)
+        db.session.add(op)
+        return op
     
     def add_stroke(self, stroke_data, user_id):
         """Add a new stroke to the whiteboard"""
-        data = self.get_session_data()
-        stroke_data['id'] = f"stroke_{len(data['strokes'])}_{int(datetime.utcnow().timestamp())}"
-        stroke_data['created_by'] = user_id
-        stroke_data['created_at'] = datetime.utcnow().isoformat()
-        data['strokes'].append(stroke_data)
-        self.set_session_data(data)
-        self.last_modified_by = user_id
+        return self.append_op('stroke', stroke_data, user_id)
     
     def add_shape(self, shape_data, user_id):
         """Add a new shape to the whiteboard"""
-        data = self.get_session_data()
-        shape_data['id'] = f"shape_{len(data['shapes'])}_{int(datetime.utcnow().timestamp())}"
-        shape_data['created_by'] = user_id
-        shape_data['created_at'] = datetime.utcnow().isoformat()
-        data['shapes'].append(shape_data)
-        self.set_session_data(data)
-        self.last_modified_by = user_id
+        return self.append_op('shape', shape_data, user_id)
     
     def add_text(self, text_data, user_id):
         """Add text element to the whiteboard"""
-        data = self.get_session_data()
-        text_data['id'] = f"text_{len(data['text_elements'])}_{int(datetime.utcnow().timestamp())}"
-        text_data['created_by'] = user_id
-        text_data['created_at'] = datetime.utcnow().isoformat()
-        data['text_elements'].append(text_data)
-        self.set_session_data(data)
-        self.last_modified_by = user_id
+        return self.append_op('text', text_data, user_id)
     
     def clear_whiteboard(self, user_id):
         """Clear all whiteboard content"""
-        data = {
-            'strokes': [],
-            'shapes': [],
-            'text_elements': [],
-            'background_color': '#ffffff',
-            'canvas_size': {'width': 800, 'height': 600}
-        }
-        self.set_session_data(data)
+        self.set_session_data(empty_board())
         self.last_modified_by = user_id
     
+    @staticmethod
+    def count_elements(data):
+        return sum(len(data.get(collection) or []) for collection in OP_COLLECTIONS.values())
+    
     def get_element_count(self):
-        """Get total count of elements on whiteboard"""
-        data = self.get_session_data()
-        return len(data['strokes']) + len(data['shapes']) + len(data['text_elements'])
+        """Get total count of elements on whiteboard (without parsing it if nothing is pending)"""
+        if self.snapshot_element_count is not None and not self.has_pending_ops():
+            return self.snapshot_element_count
+        return self.count_elements(self.get_session_data())
     
-    def to_dict(self, include_data=True):
-        """Convert to dictionary"""
+    def to_dict(self, include_data=True, data=None, element_count=None):
+        """Convert to dictionary; ``data`` and ``element_count`` save materializing the board"""
+        if data is None and include_data:
+            data = self.get_session_data()
+        if element_count is None:
+            element_count = self.count_elements(data) if data is not None else self.get_element_count()
         result = {
             'id': self.id,
             'room_id': self.room_id,
             'last_modified_by': self.last_modified_by,
             'version': self.version,
             'is_active': self.is_active,
-            'element_count': self.get_element_count(),
+            'element_count': element_count,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
         
         if include_data:
-            result['session_data'] = self.get_session_data()
+            result['session_data'] = data
         
         return result
 
+class WhiteboardOp(db.Model):
+    """One appended drawing operation; ``seq`` is the board version it produced"""
+    __tablename__ = "whiteboard_ops"
+    __table_args__ = (db.UniqueConstraint('session_id', 'seq', name='uq_whiteboard_op_seq'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('whiteboard_sessions.id'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    op_type = db.Column(db.String(20), nullable=False)  # stroke, shape, text, erase
+    payload = db.Column(db.Text, nullable=False)  # JSON element (erase: the ids removed)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def get_payload(self):
+        try:
+            return json.loads(self.payload) if self.payload else {}
+        except json.JSONDecodeError:
+            return {}
+    
+    def set_payload(self, payload_dict):
+        self.payload = json.dumps(payload_dict)
+    
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'session_id': self.session_id,
+            'type': self.op_type,
+            'user_id': self.user_id,
+            'data': self.get_payload(),
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 class WhiteboardHistory(db.Model):
+    """A past board version: a full keyframe, or a compressed delta from the previous entry"""
     __tablename__ = "whiteboard_history"
     
     id = db.Column(db.Integer, primary_key=True)
     whiteboard_session_id = db.Column(db.Integer, db.ForeignKey('whiteboard_sessions.id'), nullable=False)
     version = db.Column(db.Integer, nullable=False)
-    session_data = db.Column(db.Text)  # Snapshot of whiteboard at this version
+    session_data = db.Column(db.Text)  # Full board at this version (keyframes only)
+    is_keyframe = db.Column(db.Boolean, nullable=False, default=True, server_default='1')
+    delta_data = db.Column(db.LargeBinary)  # zlib-compressed JSON delta from the previous entry
     modified_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     change_description = db.Column(db.String(255))  # Brief description of changes
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -125,22 +237,26 @@ class WhiteboardHistory(db.Model):
     modifier = db.relationship('User', backref='whiteboard_history', lazy=True)
     
     def get_session_data(self):
-        """Get session data as dictionary"""
+        """Get the keyframe board as a dictionary ({} for delta entries)"""
         try:
             return json.loads(self.session_data) if self.session_data else {}
         except json.JSONDecodeError:
             return {}
     
-    def to_dict(self):
-        return {
+    def to_dict(self, session_data=None):
+        """Convert to dictionary; pass the rebuilt board to include it"""
+        result = {
             'id': self.id,
             'whiteboard_session_id': self.whiteboard_session_id,
             'version': self.version,
             'modified_by': self.modified_by,
             'change_description': self.change_description,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'session_data': self.get_session_data()
+            'is_keyframe': self.is_keyframe,
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
+        if session_data is not None:
+            result['session_data'] = session_data
+        return result
 
 class RoomDocument(db.Model):
     __tablename__ = "room_documents"
@@ -1,48 +1,38 @@
 import uuid
 import json
 import os
-from flask import Blueprint, request, jsonify, current_app
+import time
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from src.extensions import db
-from src.models.ai_tutor import AIConversation, AIMessage, Flashcard, PracticeTest
+from src.models.ai_tutor import (
+    AIConversation, AIMessage, Flashcard, PracticeTest,
+    AIGenerationJob, AIGenerationJobItem
+)
+from src.models.document import Document
 from src.routes.auth import token_required
-
-# OpenAI integration
-try:
-    import openai
-    openai.api_key = os.environ.get('OPENAI_API_KEY')
-    openai.api_base = os.environ.get('OPENAI_API_BASE', 'https://api.openai.com/v1')
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+from src.services.ai_client import (
+    OPENAI_AVAILABLE, AVAILABLE_MODELS, AUTO_MODEL,
+    is_valid_model, chat_completion,
+    generate_flashcards_content, generate_practice_test_content
+)
+from src.services.ai_jobs import ai_job_runner, JOB_TASK_TYPES, MAX_JOB_DOCUMENTS, MAX_JOB_CONCURRENCY
+from src.services.llm_scheduler import llm_admission, admit_request, AdmissionRejected
+from src.services.message_search import search_messages
+from src.services.single_flight import ai_single_flight, make_flight_key, normalize_text
+from src.services.stream_slots import stream_slots, streams_busy_response
 
 ai_bp = Blueprint("ai", __name__)
 
-# Available AI models
-AVAILABLE_MODELS = {
-    'gpt-3.5-turbo': {
-        'name': 'GPT-3.5 Turbo',
-        'description': 'Fast and efficient for most tasks',
-        'max_tokens': 4096,
-        'cost_tier': 'low'
-    },
-    'gpt-4': {
-        'name': 'GPT-4',
-        'description': 'Most capable model for complex reasoning',
-        'max_tokens': 8192,
-        'cost_tier': 'high'
-    },
-    'gpt-4-turbo': {
-        'name': 'GPT-4 Turbo',
-        'description': 'Latest GPT-4 with improved performance',
-        'max_tokens': 128000,
-        'cost_tier': 'medium'
-    }
-}
+JOB_STREAM_POLL_SECONDS = 1.0
+JOB_STREAM_MAX_SECONDS = 300
 
-def get_ai_response(message, model='gpt-3.5-turbo', conversation_history=None):
-    """Get AI response using specified model"""
+def get_ai_response(user, message, model='gpt-3.5-turbo', conversation_history=None, task='qa'):
+    """Get AI response using specified model; returns (content, model_used).
+
+    The upstream call is admitted under ``user``'s tier; AdmissionRejected propagates.
+    """
     if not OPENAI_AVAILABLE:
-        return f"AI response to: {message} (OpenAI not available)"
+        return f"AI response to: {message} (OpenAI not available)", model
     
     try:
         # Build conversation context
@@ -68,18 +58,14 @@ def get_ai_response(message, model='gpt-3.5-turbo', conversation_history=None):
         })
         
         # Make API call
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=messages,
-            max_tokens=AVAILABLE_MODELS.get(model, {}).get('max_tokens', 4096) // 2,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content
+        with admit_request(user, task, ''.join(m['content'] or '' for m in messages)):
+            return chat_completion(messages, model, task=task)
         
+    except AdmissionRejected:
+        raise
     except Exception as e:
         current_app.logger.error(f"OpenAI API error: {str(e)}")
-        return f"I apologize, but I'm having trouble processing your request right now. Please try again later."
+        return f"I apologize, but I'm having trouble processing your request right now. Please try again later.", model
 
 # ---------- Model Management ----------
 
@@ -90,6 +76,11 @@ def get_available_models(current_user):
     return jsonify({
         "models": AVAILABLE_MODELS,
         "default_model": "gpt-3.5-turbo",
+        "auto_model": {
+            "id": AUTO_MODEL,
+            "name": "Auto",
+            "description": "Picks a model by prompt size, task and current latency"
+        },
         "openai_available": OPENAI_AVAILABLE
     }), 200
 
@@ -104,7 +95,7 @@ def create_conversation(current_user):
     model = data.get("model", "gpt-3.5-turbo")
 
     # Validate model
-    if model not in AVAILABLE_MODELS:
+    if not is_valid_model(model):
         return jsonify({"error": "Invalid model specified"}), 400
 
     conversation = AIConversation(
@@ -177,6 +168,7 @@ def get_conversation_messages(current_user, conversation_id):
 
 @ai_bp.route("/conversations/<int:conversation_id>/messages", methods=["POST"])
 @token_required
+@llm_admission
 def add_message(current_user, conversation_id):
     data = request.get_json()
     user_message = data.get("content")
@@ -207,17 +199,20 @@ def add_message(current_user, conversation_id):
     db.session.flush()
 
     # Get AI response using the conversation's model
-    ai_response = get_ai_response(
+    ai_response, model_used = get_ai_response(
+        current_user,
         user_message,
         model=conversation.model or 'gpt-3.5-turbo',
-        conversation_history=history
+        conversation_history=history,
+        task=conversation.conversation_type
     )
     
     # Save AI response
     ai_msg = AIMessage(
         conversation_id=conversation_id,
         role="assistant",
-        content=ai_response
+        content=ai_response,
+        message_metadata=json.dumps({"model": model_used})
     )
     db.session.add(ai_msg)
     db.session.commit()
@@ -231,10 +226,35 @@ def add_message(current_user, conversation_id):
         "ai_message": {
             "id": ai_msg.id,
             "content": ai_msg.content,
+            "model": model_used,
             "created_at": ai_msg.created_at.isoformat()
         }
     }), 201
 
+@ai_bp.route("/messages/search", methods=["GET"])
+@token_required
+def search_conversation_messages(current_user):
+    """Full-text search across the user's AI tutor messages"""
+    query = (request.args.get("q") or "").strip()
+    if not query:
+        return jsonify({"error": "Search query is required"}), 400
+    
+    limit = max(1, min(request.args.get("limit", 20, type=int), 50))
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    
+    try:
+        results = search_messages(current_user.id, query, limit=limit, offset=offset)
+    except Exception as e:
+        current_app.logger.error(f"Message search error: {str(e)}")
+        return jsonify({"error": "Search failed"}), 500
+    
+    return jsonify({
+        "query": query,
+        "results": results,
+        "limit": limit,
+        "offset": offset
+    }), 200
+
 @ai_bp.route("/conversations/<int:conversation_id>/model", methods=["PUT"])
 @token_required
 def update_conversation_model(current_user, conversation_id):
@@ -242,7 +262,7 @@ def update_conversation_model(current_user, conversation_id):
     data = request.get_json()
     new_model = data.get("model")
     
-    if not new_model or new_model not in AVAILABLE_MODELS:
+    if not new_model or not is_valid_model(new_model):
         return jsonify({"error": "Invalid model specified"}), 400
     
     conversation = AIConversation.query.filter_by(
@@ -268,6 +288,7 @@ def update_conversation_model(current_user, conversation_id):
 
 @ai_bp.route("/chat", methods=["POST"])
 @token_required
+@llm_admission
 def quick_chat(current_user):
     """Quick chat without creating a conversation"""
     data = request.get_json()
@@ -277,16 +298,16 @@ def quick_chat(current_user):
     if not message or not message.strip():
         return jsonify({"error": "Message is required"}), 400
     
-    if model not in AVAILABLE_MODELS:
+    if not is_valid_model(model):
         return jsonify({"error": "Invalid model specified"}), 400
     
     # Get AI response
-    ai_response = get_ai_response(message, model=model)
+    ai_response, model_used = get_ai_response(current_user, message, model=model)
     
     return jsonify({
         "message": message,
         "response": ai_response,
-        "model": model
+        "model": model_used
     }), 200
 
 # ---------- Flashcards ----------
@@ -336,6 +357,7 @@ def create_flashcard(current_user):
 
 @ai_bp.route("/generate-flashcards", methods=["POST"])
 @token_required
+@llm_admission
 def generate_flashcards(current_user):
     data = request.get_json()
     text = data.get("text", "")
@@ -345,38 +367,21 @@ def generate_flashcards(current_user):
     if not text.strip():
         return jsonify({"error": "Text content is required"}), 400
     
-    if model not in AVAILABLE_MODELS:
+    if not is_valid_model(model):
         return jsonify({"error": "Invalid model specified"}), 400
 
     # Generate flashcards using AI
     if OPENAI_AVAILABLE:
         try:
-            prompt = f"""
-            Create {count} educational flashcards from the following text. Format as JSON array with objects containing 'question', 'answer', 'difficulty' (easy/medium/hard), and 'category' fields.
-            
-            Text: {text[:2000]}  # Limit text length
-            
-            Return only the JSON array, no additional text.
-            """
-            
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are an educational content creator. Generate high-quality flashcards that test understanding, not just memorization."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=2000,
-                temperature=0.7
-            )
-            
-            # Parse AI response
-            ai_content = response.choices[0].message.content.strip()
-            if ai_content.startswith('```json'):
-                ai_content = ai_content[7:-3]
-            elif ai_content.startswith('```'):
-                ai_content = ai_content[3:-3]
-            
-            generated_flashcards = json.loads(ai_content)
+            text = normalize_text(text)[:2000]  # Limit text length
+            flight_key = make_flight_key('flashcards', model, text, count=count)
+
+            def generate():
+                # Only the leader goes upstream, so only it is admitted and charged
+                with admit_request(current_user, 'flashcard', text):
+                    return generate_flashcards_content(text, count, model)
+
+            generated_flashcards = ai_single_flight.do(flight_key, generate)
             
             # Add IDs and save to database
             saved_flashcards = []
@@ -401,6 +406,8 @@ def generate_flashcards(current_user):
             db.session.commit()
             return jsonify({"flashcards": saved_flashcards}), 200
             
+        except AdmissionRejected:
+            raise
         except Exception as e:
             current_app.logger.error(f"Flashcard generation error: {str(e)}")
             # Fall back to stub generation
@@ -459,6 +466,7 @@ def create_practice_test(current_user):
 
 @ai_bp.route("/generate-practice-test", methods=["POST"])
 @token_required
+@llm_admission
 def generate_practice_test(current_user):
     data = request.get_json()
     text = data.get("text", "")
@@ -468,39 +476,21 @@ def generate_practice_test(current_user):
     if not text.strip():
         return jsonify({"error": "Text content is required"}), 400
     
-    if model not in AVAILABLE_MODELS:
+    if not is_valid_model(model):
         return jsonify({"error": "Invalid model specified"}), 400
 
     # Generate practice test using AI
     if OPENAI_AVAILABLE:
         try:
-            prompt = f"""
-            Create a practice test with {question_count} multiple choice questions from the following text.
-            Format as JSON with 'title' and 'questions' array. Each question should have 'question', 'options' (array of 4 choices), 'correct_answer' (the correct option), and 'explanation'.
-            
-            Text: {text[:2000]}
-            
-            Return only the JSON object, no additional text.
-            """
-            
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are an educational assessment creator. Generate high-quality multiple choice questions that test comprehension and application."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=3000,
-                temperature=0.7
-            )
-            
-            # Parse AI response
-            ai_content = response.choices[0].message.content.strip()
-            if ai_content.startswith('```json'):
-                ai_content = ai_content[7:-3]
-            elif ai_content.startswith('```'):
-                ai_content = ai_content[3:-3]
-            
-            generated_test = json.loads(ai_content)
+            text = normalize_text(text)[:2000]
+            flight_key = make_flight_key('practice_test', model, text, question_count=question_count)
+
+            def generate():
+                # Only the leader goes upstream, so only it is admitted and charged
+                with admit_request(current_user, 'practice_test', text):
+                    return generate_practice_test_content(text, question_count, model)
+
+            generated_test = ai_single_flight.do(flight_key, generate)
             
             # Save to database
             test = PracticeTest(
@@ -514,6 +504,8 @@ def generate_practice_test(current_user):
             
             return jsonify({"practice_test": test.to_dict()}), 200
             
+        except AdmissionRejected:
+            raise
         except Exception as e:
             current_app.logger.error(f"Practice test generation error: {str(e)}")
             # Fall back to stub generation
@@ -542,3 +534,126 @@ def generate_practice_test(current_user):
     db.session.commit()
 
     return jsonify({"practice_test": test.to_dict()}), 200
+
+# ---------- Batch Generation Jobs ----------
+
+@ai_bp.route("/jobs", methods=["POST"])
+@token_required
+def create_generation_job(current_user):
+    """Queue flashcard/practice-test generation for many documents"""
+    try:
+        data = request.get_json() or {}
+        document_ids = data.get("document_ids") or []
+        tasks = data.get("tasks") or ["flashcards"]
+        model = data.get("model", AUTO_MODEL)
+
+        if not isinstance(document_ids, list) or not document_ids:
+            return jsonify({"error": "document_ids is required"}), 400
+        if len(document_ids) > MAX_JOB_DOCUMENTS:
+            return jsonify({"error": f"At most {MAX_JOB_DOCUMENTS} documents per job"}), 400
+        if not tasks or any(t not in JOB_TASK_TYPES for t in tasks):
+            return jsonify({"error": f"tasks must be a subset of {JOB_TASK_TYPES}"}), 400
+        if not is_valid_model(model):
+            return jsonify({"error": "Invalid model specified"}), 400
+        try:
+            count = max(1, min(int(data.get("count", 5)), 20))
+            question_count = max(1, min(int(data.get("question_count", 5)), 20))
+            concurrency = max(1, min(int(data.get("concurrency", 2)), MAX_JOB_CONCURRENCY))
+        except (TypeError, ValueError):
+            return jsonify({"error": "count, question_count and concurrency must be integers"}), 400
+
+        document_ids = list(dict.fromkeys(document_ids))
+        documents = Document.query.filter(Document.id.in_(document_ids)).all()
+        accessible = {d.id for d in documents if d.uploader_id == current_user.id or d.is_public}
+        missing = [doc_id for doc_id in document_ids if doc_id not in accessible]
+        if missing:
+            return jsonify({"error": "Documents not found or access denied", "document_ids": missing}), 404
+
+        job = AIGenerationJob(
+            user_id=current_user.id,
+            model=model,
+            task_types=json.dumps(tasks),
+            params=json.dumps({"count": count, "question_count": question_count}),
+            concurrency=concurrency,
+            total_items=len(document_ids) * len(tasks)
+        )
+        db.session.add(job)
+        db.session.flush()
+        for doc_id in document_ids:
+            for task_type in tasks:
+                db.session.add(AIGenerationJobItem(job_id=job.id, document_id=doc_id, task_type=task_type))
+        db.session.commit()
+
+        ai_job_runner.start(job)
+        return jsonify({"job": job.to_dict()}), 202
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Create generation job error: {str(e)}")
+        return jsonify({"error": "Failed to create generation job"}), 500
+
+def _finished_job_items(job_id, after):
+    return AIGenerationJobItem.query.filter(
+        AIGenerationJobItem.job_id == job_id,
+        AIGenerationJobItem.finish_seq > after
+    ).order_by(AIGenerationJobItem.finish_seq).all()
+
+@ai_bp.route("/jobs/<int:job_id>", methods=["GET"])
+@token_required
+def get_generation_job(current_user, job_id):
+    """Get job progress plus the items finished after the ``after`` cursor"""
+    job = AIGenerationJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    after = request.args.get("after", 0, type=int)
+    items = _finished_job_items(job.id, after)
+    return jsonify({
+        "job": job.to_dict(),
+        "items": [item.to_dict() for item in items],
+        "cursor": items[-1].finish_seq if items else after
+    }), 200
+
+@ai_bp.route("/jobs/<int:job_id>/stream", methods=["GET"])
+@token_required
+def stream_generation_job(current_user, job_id):
+    """Server-sent events: one ``item`` event per finished item, then ``done``.
+
+    Streams end after JOB_STREAM_MAX_SECONDS and the client reconnects; they
+    share the per-worker stream cap with room streams (503 beyond it).
+    """
+    job = AIGenerationJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    release_slot = stream_slots.acquire()
+    if release_slot is None:
+        return streams_busy_response()
+
+    # Reconnecting clients resume after the last event they saw
+    after = request.headers.get("Last-Event-ID", type=int) or request.args.get("after", 0, type=int)
+
+    def events(cursor):
+        started = time.monotonic()
+        while time.monotonic() - started < JOB_STREAM_MAX_SECONDS:
+            db.session.expire_all()
+            current = db.session.get(AIGenerationJob, job_id)
+            if current is None:
+                yield f"event: end\ndata: {json.dumps({'reason': 'job_not_found'})}\n\n"
+                return
+            for item in _finished_job_items(job_id, cursor):
+                cursor = item.finish_seq
+                yield f"id: {cursor}\nevent: item\ndata: {json.dumps(item.to_dict())}\n\n"
+            if current.is_finished() and cursor >= current.finished_items:
+                yield f"event: done\ndata: {json.dumps(current.to_dict())}\n\n"
+                return
+            db.session.close()  # Don't hold a connection between polls
+            yield ": keep-alive\n\n"
+            time.sleep(JOB_STREAM_POLL_SECONDS)
+
+    response = Response(
+        stream_with_context(events(after)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(release_slot)
+    return response
@@ -0,0 +1,108 @@
+from flask import Blueprint, request, jsonify, current_app
+from datetime import datetime, timedelta
+from src.models.study_room import StudyRoom
+from src.routes.auth import token_required
+from src.services.study_rollups import user_study_series, room_study_series
+from src.services.membership_cache import membership_cache
+from src.services.leaderboards import leaderboards, LEADERBOARD_METRICS, LEADERBOARD_SCOPES
+
+analytics_bp = Blueprint('analytics', __name__)
+
+# Free accounts see the last week; longer history is the premium "Advanced analytics" feature
+FREE_ANALYTICS_DAYS = 7
+PREMIUM_ANALYTICS_DAYS = 365
+
+def _analytics_window(user):
+    """Get (days, since, limited) for the requested window, capped by the user's plan"""
+    max_days = PREMIUM_ANALYTICS_DAYS if user.has_active_premium() else FREE_ANALYTICS_DAYS
+    requested = max(1, request.args.get('days', 30, type=int))
+    days = min(requested, max_days)
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    return days, since, requested > days
+
+def _summarize(series, days, since, limited):
+    return {
+        'days': days,
+        'since': since.isoformat(),
+        'limited_by_plan': limited,
+        'totals': {
+            'minutes': sum(day['minutes'] for day in series),
+            'sessions': sum(day['sessions'] for day in series),
+            'active_days': len(series)
+        },
+        'series': series
+    }
+
+@analytics_bp.route('/me', methods=['GET'])
+@token_required
+def get_my_analytics(current_user):
+    """Get the user's daily study time"""
+    try:
+        days, since, limited = _analytics_window(current_user)
+        return jsonify(_summarize(user_study_series(current_user.id, since), days, since, limited)), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting user analytics: {e}")
+        return jsonify({'error': 'Failed to get analytics'}), 500
+
+@analytics_bp.route('/rooms/<int:room_id>', methods=['GET'])
+@token_required
+def get_room_analytics(current_user, room_id):
+    """Get a room's daily study time and distinct studying members"""
+    try:
+        room = StudyRoom.query.get(room_id)
+        if not room:
+            return jsonify({'error': 'Room not found'}), 404
+        
+        if membership_cache.get_role(room_id, current_user.id) is None:
+            return jsonify({'error': 'Access denied. You are not a member of this room.'}), 403
+        
+        days, since, limited = _analytics_window(current_user)
+        result = _summarize(room_study_series(room_id, since), days, since, limited)
+        result['room_id'] = room_id
+        return jsonify(result), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting room analytics: {e}")
+        return jsonify({'error': 'Failed to get room analytics'}), 500
+
+@analytics_bp.route('/leaderboard', methods=['GET'])
+@token_required
+def get_leaderboard(current_user):
+    """Get a leaderboard with the user's own rank.
+
+    Query params: metric (study_time, streak), scope (global, room, subject),
+    room_id or subject for the scoped boards, and limit.
+    """
+    try:
+        metric = request.args.get('metric', 'study_time')
+        scope = request.args.get('scope', 'global')
+        limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+        
+        if metric not in LEADERBOARD_METRICS:
+            return jsonify({'error': f'metric must be one of {LEADERBOARD_METRICS}'}), 400
+        if scope not in LEADERBOARD_SCOPES:
+            return jsonify({'error': f'scope must be one of {LEADERBOARD_SCOPES}'}), 400
+        if metric == 'streak' and scope != 'global':
+            return jsonify({'error': 'Streak leaderboards are global only'}), 400
+        
+        key = None
+        if scope == 'room':
+            key = request.args.get('room_id', type=int)
+            room = StudyRoom.query.get(key) if key else None
+            if not room:
+                return jsonify({'error': 'Room not found'}), 404
+            if room.is_private and membership_cache.get_role(key, current_user.id) is None:
+                return jsonify({'error': 'Access denied. You are not a member of this room.'}), 403
+        elif scope == 'subject':
+            key = (request.args.get('subject') or '').strip().lower()
+            if not key:
+                return jsonify({'error': 'subject is required'}), 400
+        
+        result = leaderboards.get(metric, scope, key, user_id=current_user.id, limit=limit)
+        result.update({'metric': metric, 'scope': scope, 'key': key})
+        return jsonify(result), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting leaderboard: {e}")
+        return jsonify({'error': 'Failed to get leaderboard'}), 500
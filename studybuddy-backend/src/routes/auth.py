@@ -1,10 +1,12 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 import jwt
 import re
 from datetime import datetime, timedelta
 from src.models.user import User, db
+from src.services.leaderboards import leaderboards
+from src.services.membership_cache import membership_cache
 from src.utils.validation import (
     validate_email, validate_password, validate_username, validate_name,
     sanitize_input, validate_json_input
@@ -53,6 +55,25 @@ def token_required(f):
     
     return decorated
 
+def room_member_required(roles=None, error=None):
+    """Decorator to require an active membership of the route's room_id.
+
+    Apply below @token_required. Roles come from the per-worker membership
+    cache; the caller's role is available to the view as ``g.room_role``.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            role = membership_cache.get_role(kwargs['room_id'], current_user.id)
+            if role is None:
+                return jsonify({'error': error or 'Access denied. You are not a member of this room.'}), 403
+            if roles and role not in roles:
+                return jsonify({'error': error or 'Access denied. Your role does not allow this action.'}), 403
+            g.room_role = role
+            return f(current_user, *args, **kwargs)
+        return decorated
+    return decorator
+
 @auth_bp.route('/register', methods=['POST'])
 @validate_json_input(
     required_fields=['username', 'email', 'password', 'first_name', 'last_name'],
@@ -172,6 +193,7 @@ def login():
         # Update streak/last activity
         if hasattr(user, "update_streak"):
             user.update_streak()
+            leaderboards.record_streak(user)
 
         # Generate token safely
         try:
@@ -9,6 +9,10 @@ import jwt
 from src.models.user import User, db
 from src.models.document import Document, DocumentShare
 from src.routes.auth import token_required, sanitize_input
+from src.services.ai_client import is_valid_model
+from src.services.document_summary import (
+    document_summarizer, needs_generation, DEFAULT_SUMMARY_MODEL, PROMPT_VERSION
+)
 
 document_bp = Blueprint('document', __name__)
 
@@ -172,6 +176,10 @@ def upload_document(current_user):
         
         db.session.commit()
         
+        # Summarization stage runs in the background once the text is stored
+        if document.extracted_text:
+            document_summarizer.schedule(document)
+        
         return jsonify({
             'message': 'Document uploaded successfully',
             'document': document.to_dict()
@@ -219,6 +227,55 @@ def get_document(current_user, document_id):
     except Exception as e:
         return jsonify({'error': 'Failed to fetch document'}), 500
 
+@document_bp.route('/<int:document_id>/summary', methods=['GET'])
+@token_required
+def get_document_summary(current_user, document_id):
+    """Get the cached document summary, generating it in the background if needed"""
+    try:
+        document = Document.query.filter_by(
+            id=document_id,
+            uploader_id=current_user.id
+        ).first()
+        
+        if not document:
+            return jsonify({'error': 'Document not found'}), 404
+        
+        if not document.extracted_text:
+            return jsonify({'error': 'No extracted text available for this document'}), 400
+        
+        model = request.args.get('model', DEFAULT_SUMMARY_MODEL)
+        if not is_valid_model(model):
+            return jsonify({'error': 'Invalid model specified'}), 400
+        
+        current, stale = document_summarizer.get_summary(document, model)
+        
+        # Also retries a pending row whose worker died before finishing it
+        if needs_generation(current):
+            document_summarizer.schedule(document, model)
+        
+        summary = current if current and current.status == 'completed' else stale
+        if not summary:
+            return jsonify({
+                'document_id': document.id,
+                'status': current.status if current else 'pending',
+                'prompt_version': PROMPT_VERSION
+            }), 202
+        
+        return jsonify({
+            'document_id': document.id,
+            'status': 'completed',
+            'stale': summary is stale,
+            'model': summary.model,
+            'prompt_version': summary.prompt_version,
+            'summary': summary.summary,
+            'sections': summary.get_sections(),
+            'generated_at': summary.updated_at.isoformat() if summary.updated_at else None
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting document summary: {e}")
+        return jsonify({'error': 'Failed to get document summary'}), 500
+
 @document_bp.route('/<int:document_id>/download', methods=['GET'])
 @token_required
 def download_document(current_user, document_id):
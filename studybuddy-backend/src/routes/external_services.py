@@ -7,6 +7,7 @@ import uuid
 from src.models.user import User, db
 from src.models.study_room import StudyRoom
 from src.routes.auth import token_required, sanitize_input
+from src.services.membership_cache import membership_cache
 
 external_bp = Blueprint('external', __name__)
 
@@ -42,13 +43,7 @@ def create_meeting(current_user):
         
         # Check if user is owner or member
         if room.owner_id != current_user.id:
-            from src.models.study_room import RoomMembership
-            membership = RoomMembership.query.filter_by(
-                user_id=current_user.id,
-                room_id=room_id,
-                is_active=True
-            ).first()
-            if not membership:
+            if membership_cache.get_role(room_id, current_user.id) is None:
                 return jsonify({'error': 'Access denied'}), 403
         
         # Generate meeting based on platform
@@ -137,13 +132,7 @@ def get_meeting_info(current_user, room_id):
         
         # Check access
         if room.owner_id != current_user.id:
-            from src.models.study_room import RoomMembership
-            membership = RoomMembership.query.filter_by(
-                user_id=current_user.id,
-                room_id=room_id,
-                is_active=True
-            ).first()
-            if not membership:
+            if membership_cache.get_role(room_id, current_user.id) is None:
                 return jsonify({'error': 'Access denied'}), 403
         
         if not room.meeting_url:
@@ -255,14 +244,7 @@ def save_whiteboard(current_user):
             return jsonify({'error': 'Room not found'}), 404
         
         # Check access
-        from src.models.study_room import RoomMembership
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
+        if membership_cache.get_role(room_id, current_user.id) is None:
             return jsonify({'error': 'Access denied'}), 403
         
         # Save whiteboard data
@@ -285,14 +267,7 @@ def get_whiteboard(current_user, room_id):
             return jsonify({'error': 'Room not found'}), 404
         
         # Check access
-        from src.models.study_room import RoomMembership
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
+        if membership_cache.get_role(room_id, current_user.id) is None:
             return jsonify({'error': 'Access denied'}), 403
         
         whiteboard_data = json.loads(room.whiteboard_data) if room.whiteboard_data else {}
@@ -1,38 +1,101 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
 from datetime import datetime
+from sqlalchemy import update, func
 from src.models.user import User, db
 from src.models.study_room import StudyRoom, RoomMembership, StudySession
-from src.routes.auth import token_required, sanitize_input
+from src.models.whiteboard import CollaborationEvent
+from src.routes.auth import token_required, room_member_required, sanitize_input
+from src.services.presence import presence
+from src.services.membership_cache import membership_cache
+from src.utils.stroke_codec import wants_encoded_strokes
+from src.utils.stroke_simplify import parse_tolerance
+from src.services.room_snapshot import (
+    room_members, snapshot_state, snapshot_etag, build_snapshot,
+    SNAPSHOT_SECTIONS, DEFAULT_EVENT_LIMIT, MAX_EVENT_LIMIT
+)
+from src.services.room_capacity import claim_seat, release_seat, set_membership_active
+from src.services.study_rollups import rollup_sessions
+from src.services.leaderboards import leaderboards
+from src.services.room_directory import (
+    query_room_directory, DIRECTORY_SCOPES, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE,
+    get_directory_version, bump_directory_version, directory_etag, public_directory_cache
+)
 import json
 
 room_bp = Blueprint('room', __name__)
 
+def log_membership_event(room_id, user_id, event_type):
+    """Record a join/leave as a collaboration event (pushed to room streams on commit)"""
+    event = CollaborationEvent(room_id=room_id, user_id=user_id, event_type=event_type)
+    event.set_event_data({'at': datetime.utcnow().isoformat()})
+    db.session.add(event)
+
 @room_bp.route('/rooms', methods=['GET'])
 @token_required
 def get_rooms(current_user):
-    """Get all public rooms and user's private rooms"""
+    """Get public rooms and the user's own/joined rooms, newest first.
+
+    Query params: scope (all, public, owned, member), subject, has_free_seats,
+    limit and cursor (``next_cursor`` from the previous page). Without limit or
+    cursor every room is returned in one response. For ``all`` the
+    user's private rooms come first (on the first page only), followed by a page
+    of the shared public directory; ``my_roles`` maps room id to the user's role.
+    """
     try:
-        # Get public rooms
-        public_rooms = StudyRoom.query.filter_by(is_private=False, is_active=True).all()
-        
-        # Get user's owned rooms
-        owned_rooms = StudyRoom.query.filter_by(owner_id=current_user.id, is_active=True).all()
-        
-        # Get rooms user is a member of
-        member_rooms = db.session.query(StudyRoom).join(RoomMembership).filter(
-            RoomMembership.user_id == current_user.id,
-            RoomMembership.is_active == True,
-            StudyRoom.is_active == True
-        ).all()
-        
-        # Combine and deduplicate rooms
-        all_rooms = list({room.id: room for room in (public_rooms + owned_rooms + member_rooms)}.values())
-        
-        return jsonify({
-            'rooms': [room.to_dict() for room in all_rooms]
-        }), 200
+        scope = request.args.get('scope', 'all')
+        if scope not in DIRECTORY_SCOPES:
+            return jsonify({'error': f'scope must be one of {DIRECTORY_SCOPES}'}), 400
+
+        subject = request.args.get('subject')
+        has_free_seats = request.args.get('has_free_seats', '').lower() in ('1', 'true', 'yes')
+        paginated = 'limit' in request.args or 'cursor' in request.args
+        limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE)) \
+            if paginated else None
+        cursor = request.args.get('cursor', type=int)
+
+        if scope in ('owned', 'member'):
+            rooms, next_cursor = query_room_directory(
+                current_user.id, scope=scope, subject=subject,
+                has_free_seats=has_free_seats, limit=limit, cursor=cursor
+            )
+            return jsonify({'rooms': rooms, 'next_cursor': next_cursor}), 200
+
+        # Every change to rooms or memberships bumps the version, so it identifies the response
+        version = get_directory_version()
+        etag = directory_etag(version, current_user.id, scope, subject, has_free_seats, limit, cursor)
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+        public_json, next_cursor = public_directory_cache.get_page(
+            version, subject=subject, has_free_seats=has_free_seats, limit=limit, cursor=cursor
+        )
+
+        personal, _ = query_room_directory(
+            current_user.id, scope='personal', subject=subject,
+            has_free_seats=has_free_seats, limit=MAX_PAGE_SIZE if paginated else None
+        )
+        my_roles = {room['id']: room['my_role'] for room in personal}
+        private_json = b''
+        if scope == 'all' and cursor is None:
+            private_json = b','.join(
+                json.dumps(room).encode('utf-8') for room in personal if room['is_private']
+            )
+
+        rooms_json = b','.join(part for part in (private_json, public_json) if part)
+        body = b''.join([
+            b'{"rooms":[', rooms_json,
+            b'],"my_roles":', json.dumps(my_roles).encode('utf-8'),
+            b',"next_cursor":', json.dumps(next_cursor).encode('utf-8'), b'}'
+        ])
+        response = current_app.response_class(body, status=200, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
         
     except Exception as e:
+        current_app.logger.error(f"Get rooms error: {str(e)}")
         return jsonify({'error': 'Failed to fetch rooms'}), 500
 
 @room_bp.route('/rooms', methods=['POST'])
@@ -51,6 +114,11 @@ def create_room(current_user):
         if not data.get('name'):
             return jsonify({'error': 'Room name is required'}), 400
         
+        try:
+            stroke_tolerance = parse_tolerance(data.get('stroke_tolerance'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Create room
         room = StudyRoom(
             name=data['name'],
@@ -58,7 +126,9 @@ def create_room(current_user):
             subject=data.get('subject', ''),
             owner_id=current_user.id,
             max_participants=data.get('max_participants', 10),
-            is_private=data.get('is_private', False)
+            is_private=data.get('is_private', False),
+            stroke_tolerance=stroke_tolerance,
+            active_member_count=1  # The owner's membership below
         )
         
         db.session.add(room)
@@ -72,6 +142,7 @@ def create_room(current_user):
         )
         
         db.session.add(membership)
+        bump_directory_version()
         db.session.commit()
         
         return jsonify({
@@ -92,12 +163,7 @@ def get_room(current_user, room_id):
         
         # Check if user has access to this room
         if room.is_private and room.owner_id != current_user.id:
-            membership = RoomMembership.query.filter_by(
-                user_id=current_user.id,
-                room_id=room_id,
-                is_active=True
-            ).first()
-            if not membership:
+            if membership_cache.get_role(room_id, current_user.id) is None:
                 return jsonify({'error': 'Access denied'}), 403
         
         # Get room members
@@ -120,6 +186,73 @@ def get_room(current_user, room_id):
     except Exception as e:
         return jsonify({'error': 'Failed to fetch room'}), 500
 
+@room_bp.route('/rooms/<int:room_id>/snapshot', methods=['GET'])
+@token_required
+@room_member_required()
+def get_room_snapshot(current_user, room_id):
+    """Get everything the room page needs in one round trip.
+
+    Query params: include (comma-separated subset of room, members, whiteboard,
+    documents, events; default all) and events_limit. Responses carry an ETag
+    over the room's change markers, so an unchanged revisit costs one query and
+    returns 304.
+    """
+    try:
+        include = request.args.get('include')
+        sections = SNAPSHOT_SECTIONS
+        if include:
+            requested = {section.strip() for section in include.split(',') if section.strip()}
+            unknown = requested - set(SNAPSHOT_SECTIONS)
+            if unknown:
+                return jsonify({'error': f'include must be a subset of {SNAPSHOT_SECTIONS}'}), 400
+            sections = [section for section in SNAPSHOT_SECTIONS if section in requested]
+        events_limit = max(1, min(request.args.get('events_limit', DEFAULT_EVENT_LIMIT, type=int), MAX_EVENT_LIMIT))
+        
+        room, markers = snapshot_state(room_id)
+        if not room:
+            return jsonify({'error': 'Room not found'}), 404
+        
+        online = presence.online_members(room_id) if 'members' in sections else {}
+        encoded = wants_encoded_strokes()
+        etag = snapshot_etag(current_user.id, g.room_role, sections, events_limit, markers, online, encoded)
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        
+        response = jsonify(build_snapshot(room, g.room_role, sections, events_limit, online, encoded))
+        response.set_etag(etag)
+        response.vary.add('X-Stroke-Encoding')
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting room snapshot: {e}")
+        return jsonify({'error': 'Failed to get room snapshot'}), 500
+
+@room_bp.route('/rooms/<int:room_id>', methods=['DELETE'])
+@token_required
+def deactivate_room(current_user, room_id):
+    """Deactivate a study room (owner only)"""
+    try:
+        room = StudyRoom.query.get_or_404(room_id)
+        
+        if room.owner_id != current_user.id:
+            return jsonify({'error': 'Access denied. Only the room owner can deactivate the room.'}), 403
+        
+        if not room.is_active:
+            return jsonify({'error': 'Room is already inactive'}), 400
+        
+        room.is_active = False
+        bump_directory_version()
+        db.session.commit()
+        
+        return jsonify({'message': 'Room deactivated successfully'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to deactivate room'}), 500
+
 @room_bp.route('/rooms/<int:room_id>/join', methods=['POST'])
 @token_required
 def join_room(current_user, room_id):
@@ -139,10 +272,10 @@ def join_room(current_user, room_id):
         if existing_membership:
             if existing_membership.is_active:
                 return jsonify({'error': 'Already a member of this room'}), 400
-            else:
-                # Reactivate membership
-                existing_membership.is_active = True
-                existing_membership.joined_at = datetime.utcnow()
+            # Reactivate membership; a racing rejoin may have beaten us to it
+            if not set_membership_active(existing_membership, True, joined_at=datetime.utcnow()):
+                db.session.rollback()
+                return jsonify({'error': 'Already a member of this room'}), 400
         else:
             # Create new membership
             membership = RoomMembership(
@@ -152,6 +285,13 @@ def join_room(current_user, room_id):
             )
             db.session.add(membership)
         
+        # Atomic capacity gate; can_join() above is only a fast pre-check
+        if not claim_seat(room_id):
+            db.session.rollback()
+            return jsonify({'error': 'Room is full or inactive'}), 400
+        
+        log_membership_event(room_id, current_user.id, 'member_join')
+        bump_directory_version()
         db.session.commit()
         
         return jsonify({
@@ -180,8 +320,15 @@ def leave_room(current_user, room_id):
         if membership.role == 'owner':
             return jsonify({'error': 'Room owner cannot leave. Transfer ownership first.'}), 400
         
-        membership.is_active = False
+        # Only the request that deactivates the membership gives the seat back
+        if not set_membership_active(membership, False):
+            db.session.rollback()
+            return jsonify({'error': 'Not a member of this room'}), 400
+        release_seat(room_id)
+        log_membership_event(room_id, current_user.id, 'member_leave')
+        bump_directory_version()
         db.session.commit()
+        presence.remove(room_id, current_user.id)
         
         return jsonify({'message': 'Successfully left room'}), 200
         
@@ -217,8 +364,9 @@ def join_room_by_code(current_user):
             return jsonify({'error': 'Already a member of this room'}), 400
         
         if existing_membership:
-            existing_membership.is_active = True
-            existing_membership.joined_at = datetime.utcnow()
+            if not set_membership_active(existing_membership, True, joined_at=datetime.utcnow()):
+                db.session.rollback()
+                return jsonify({'error': 'Already a member of this room'}), 400
         else:
             membership = RoomMembership(
                 user_id=current_user.id,
@@ -227,6 +375,13 @@ def join_room_by_code(current_user):
             )
             db.session.add(membership)
         
+        # Atomic capacity gate; can_join() above is only a fast pre-check
+        if not claim_seat(room.id):
+            db.session.rollback()
+            return jsonify({'error': 'Room is full or inactive'}), 400
+        
+        log_membership_event(room.id, current_user.id, 'member_join')
+        bump_directory_version()
         db.session.commit()
         
         return jsonify({
@@ -238,78 +393,14 @@ def join_room_by_code(current_user):
         db.session.rollback()
         return jsonify({'error': 'Failed to join room'}), 500
 
-@room_bp.route('/rooms/<int:room_id>/whiteboard', methods=['GET'])
-@token_required
-def get_whiteboard(current_user, room_id):
-    """Get whiteboard data"""
-    try:
-        room = StudyRoom.query.get_or_404(room_id)
-        
-        # Check membership
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        whiteboard_data = json.loads(room.whiteboard_data) if room.whiteboard_data else {}
-        
-        return jsonify({'whiteboard_data': whiteboard_data}), 200
-        
-    except Exception as e:
-        return jsonify({'error': 'Failed to fetch whiteboard'}), 500
-
-@room_bp.route('/rooms/<int:room_id>/whiteboard', methods=['POST'])
-@token_required
-def update_whiteboard(current_user, room_id):
-    """Update whiteboard data"""
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'error': 'No data provided'}), 400
-        
-        room = StudyRoom.query.get_or_404(room_id)
-        
-        # Check membership
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
-            return jsonify({'error': 'Access denied'}), 403
-        
-        # Update whiteboard data
-        room.whiteboard_data = json.dumps(data.get('whiteboard_data', {}))
-        db.session.commit()
-        
-        return jsonify({'message': 'Whiteboard updated successfully'}), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': 'Failed to update whiteboard'}), 500
-
 @room_bp.route('/rooms/<int:room_id>/sessions', methods=['POST'])
 @token_required
+@room_member_required(error='Access denied')
 def start_study_session(current_user, room_id):
     """Start a study session"""
     try:
         room = StudyRoom.query.get_or_404(room_id)
         
-        # Check membership
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
-            return jsonify({'error': 'Access denied'}), 403
-        
         # Check if user already has an active session
         active_session = StudySession.query.filter_by(
             user_id=current_user.id,
@@ -355,14 +446,32 @@ def end_study_session(current_user, room_id, session_id):
         if session.end_time:
             return jsonify({'error': 'Session already ended'}), 400
         
-        # End session
-        session.end_time = datetime.utcnow()
-        session.duration_minutes = int((session.end_time - session.start_time).total_seconds() / 60)
-        
+        # End session; conditional so a racing /end or sweep can't credit it twice
+        end_time = datetime.utcnow()
+        duration_minutes = int((end_time - session.start_time).total_seconds() / 60)
+        session_table = StudySession.__table__
+        result = db.session.execute(
+            update(session_table)
+            .where(session_table.c.id == session.id, session_table.c.end_time.is_(None))
+            .values(end_time=end_time, duration_minutes=duration_minutes)
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            return jsonify({'error': 'Session already ended'}), 400
+
         # Update user's total study time
-        current_user.total_study_time += session.duration_minutes
-        
-        db.session.commit()
+        user_table = User.__table__
+        db.session.execute(
+            update(user_table)
+            .where(user_table.c.id == current_user.id)
+            .values(total_study_time=func.coalesce(user_table.c.total_study_time, 0) + duration_minutes)
+        )
+
+        # Daily analytics rollups, in the same transaction
+        rollup_sessions([session.id])
+
+        db.session.commit()  # Expires session and current_user, so both reload below
+        leaderboards.record_study(current_user, session.room, session.duration_minutes)
         
         return jsonify({
             'message': 'Study session ended',
@@ -387,35 +496,10 @@ def get_room_members(current_user, room_id):
         
         # Check if room is private and user is not a member
         if room.is_private:
-            membership = RoomMembership.query.filter_by(
-                user_id=current_user.id,
-                room_id=room_id,
-                is_active=True
-            ).first()
-            
-            if not membership:
+            if membership_cache.get_role(room_id, current_user.id) is None:
                 return jsonify({'error': 'Access denied. You are not a member of this private room.'}), 403
         
-        # Get active members
-        members = db.session.query(RoomMembership, User)\
-                            .join(User, RoomMembership.user_id == User.id)\
-                            .filter(RoomMembership.room_id == room_id, RoomMembership.is_active == True)\
-                            .order_by(RoomMembership.joined_at).all()
-        
-        members_data = []
-        for membership, user in members:
-            member_data = {
-                'id': user.id,
-                'username': user.username,
-                'first_name': user.first_name,
-                'last_name': user.last_name,
-                'avatar_url': user.avatar_url,
-                'role': membership.role,
-                'joined_at': membership.joined_at.isoformat() if membership.joined_at else None,
-                'last_seen': membership.last_seen.isoformat() if membership.last_seen else None,
-                'is_online': (datetime.utcnow() - membership.last_seen).seconds < 300 if membership.last_seen else False  # Online if seen within 5 minutes
-            }
-            members_data.append(member_data)
+        members_data = room_members(room_id, presence.online_members(room_id))
         
         return jsonify({
             'room_id': room_id,
@@ -429,44 +513,25 @@ def get_room_members(current_user, room_id):
 
 @room_bp.route('/rooms/<int:room_id>/presence', methods=['POST'])
 @token_required
+@room_member_required(error='You are not a member of this room')
 def update_presence(current_user, room_id):
     """Update user's presence in a room"""
     try:
-        # Check if user is a member
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
-            return jsonify({'error': 'You are not a member of this room'}), 403
-        
-        # Update last seen
-        membership.last_seen = datetime.utcnow()
-        db.session.commit()
+        # Held in memory; last_seen is written to the database in periodic batches
+        presence.heartbeat(room_id, current_user.id)
         
         return jsonify({'message': 'Presence updated successfully'}), 200
         
     except Exception as e:
-        db.session.rollback()
         return jsonify({'error': 'Failed to update presence'}), 500
 
 @room_bp.route('/rooms/<int:room_id>/kick/<int:user_id>', methods=['POST'])
 @token_required
+@room_member_required(roles=['owner', 'moderator'],
+                      error='Access denied. Only room owners and moderators can kick members.')
 def kick_member(current_user, room_id, user_id):
     """Kick a member from the room (owner/moderator only)"""
     try:
-        # Check if current user has permission
-        current_membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not current_membership or current_membership.role not in ['owner', 'moderator']:
-            return jsonify({'error': 'Access denied. Only room owners and moderators can kick members.'}), 403
-        
         # Get the member to kick
         target_membership = RoomMembership.query.filter_by(
             user_id=user_id,
@@ -482,13 +547,17 @@ def kick_member(current_user, room_id, user_id):
             return jsonify({'error': 'Cannot kick the room owner'}), 400
         
         # Moderators can only kick regular members
-        if current_membership.role == 'moderator' and target_membership.role == 'moderator':
+        if g.room_role == 'moderator' and target_membership.role == 'moderator':
             return jsonify({'error': 'Moderators cannot kick other moderators'}), 403
         
         # Deactivate membership
-        target_membership.is_active = False
-        target_membership.last_seen = datetime.utcnow()
+        if not set_membership_active(target_membership, False, last_seen=datetime.utcnow()):
+            db.session.rollback()
+            return jsonify({'error': 'User is not a member of this room'}), 404
+        release_seat(room_id)
+        bump_directory_version()
         db.session.commit()
+        presence.remove(room_id, user_id)
         
         # Log collaboration event
         from src.models.whiteboard import CollaborationEvent
@@ -536,6 +605,7 @@ def promote_member(current_user, room_id, user_id):
         
         # Promote to moderator
         target_membership.role = 'moderator'
+        bump_directory_version()
         db.session.commit()
         
         # Log collaboration event
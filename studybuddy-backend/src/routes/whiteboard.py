@@ -1,28 +1,128 @@
-from flask import Blueprint, request, jsonify, current_app
-from datetime import datetime
+from flask import Blueprint, request, jsonify, current_app, g, Response, stream_with_context
+from datetime import datetime, timedelta
+from sqlalchemy import func
+import copy
 import json
+import math
+import time
 from src.models.user import User, db
-from src.models.study_room import StudyRoom, RoomMembership
-from src.models.whiteboard import WhiteboardSession, WhiteboardHistory, RoomDocument, CollaborationEvent
+from src.models.study_room import StudyRoom, THUMBNAIL_URL_PURPOSE
+from src.models.whiteboard import WhiteboardSession, WhiteboardHistory, RoomDocument, CollaborationEvent, ERASE_OP
 from src.models.document import Document
-from src.routes.auth import token_required, sanitize_input
+from src.routes.auth import token_required, room_member_required, sanitize_input
+from src.services.presence import presence
+from src.services.room_events import room_broker, room_channel, publish_room_message
+from src.services.room_snapshot import room_documents, recent_events
+from src.utils.stroke_codec import (
+    STROKE_CODEC, StrokeCodecError, wants_encoded_strokes, decode_board, decode_stroke
+)
+from src.services.whiteboard_history import record_history, history_boards, board_at_version
+from src.services.whiteboard_ops import (
+    WHITEBOARD_OP_TYPES, ops_since, lock_version, lock_board, needs_compaction, compact_session,
+    simplify_stroke_ops, room_stroke_tolerance
+)
+from src.services.whiteboard_index import whiteboard_indexes
+from src.services.whiteboard_json import board_json
+from src.services.whiteboard_export import (
+    EXPORT_FORMATS, PNG_AVAILABLE, THUMBNAIL_SIZE, MAX_EXPORT_SIZE, export_state, export_etag, export_board
+)
+from src.services.membership_cache import membership_cache
+from src.services.stream_slots import stream_slots, streams_busy_response
+from src.utils.spatial_index import parse_bbox
+from src.utils.stroke_simplify import parse_tolerance
+from src.utils.signed_urls import verify_signature
 
 whiteboard_bp = Blueprint('whiteboard', __name__)
 
+# Room event streams: reconnect hint, keep-alive/catch-up tick, lifetime and resume page size
+STREAM_RETRY_MS = 3000
+STREAM_TICK_SECONDS = 15
+STREAM_MAX_SECONDS = 300
+STREAM_RESUME_BATCH = 200
+
+# Events committed out of id order within this window still reach open streams
+STREAM_EVENT_LOOKBACK = timedelta(seconds=60)
+
+MAX_OPS_PER_REQUEST = 100
+
+def _present_board(board, encoded):
+    """Boards are stored with encoded strokes; decode unless the client negotiated them"""
+    return board if encoded else decode_board(board)
+
+def _present_op(op_data, encoded):
+    if not encoded and op_data['type'] == 'stroke':
+        decode_stroke(op_data['data'])
+    return op_data
+
+def _codec_headers(encoded):
+    headers = {'Vary': 'X-Stroke-Encoding'}
+    if encoded:
+        headers['X-Stroke-Encoding'] = STROKE_CODEC
+    return headers
+
+def _splice_json(obj, key, raw):
+    """``obj`` as JSON bytes with ``raw`` (already JSON bytes) added under ``key``; obj must be non-empty"""
+    return b''.join([json.dumps(obj).encode('utf-8')[:-1], b',', json.dumps(key).encode('utf-8'), b':', raw, b'}'])
+
+def _all_finite(value):
+    """Whether every number in a JSON value is finite (request JSON may carry NaN/Infinity)"""
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, dict):
+        return all(_all_finite(item) for item in value.values())
+    if isinstance(value, list):
+        return all(_all_finite(item) for item in value)
+    return True
+
+def _valid_erase_ids(ids):
+    return isinstance(ids, list) and all(isinstance(element_id, str) for element_id in ids)
+
+def _request_region(data):
+    """Region from ``{"bbox": [x0, y0, x1, y1]}`` or ``{"x", "y", "radius"}``; raises ValueError"""
+    if 'bbox' in data:
+        return parse_bbox(data['bbox'])
+    x, y, radius = (data.get(key) for key in ('x', 'y', 'radius'))
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (x, y, radius)) or radius < 0:
+        raise ValueError("Provide bbox, or x, y and a non-negative radius")
+    return parse_bbox([x - radius, y - radius, x + radius, y + radius])
+
+def _version_conflict(room_id):
+    """409 telling the client to resync from the current version"""
+    current = db.session.query(WhiteboardSession.version)\
+                        .filter_by(room_id=room_id, is_active=True).scalar()
+    return jsonify({
+        'error': 'Whiteboard changed since base_version; fetch the latest version and retry',
+        'version': current
+    }), 409
+
+def _compact_after_commit(room_id, whiteboard_session):
+    """Fold the op log if it is due; the ops are already committed, so a failure is only logged"""
+    try:
+        if needs_compaction(whiteboard_session):
+            compact_session(whiteboard_session.id)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error compacting whiteboard for room {room_id}: {e}")
+
 @whiteboard_bp.route('/rooms/<int:room_id>/whiteboard', methods=['GET'])
 @token_required
+@room_member_required()
 def get_whiteboard_session(current_user, room_id):
-    """Get whiteboard session for a room"""
+    """Get whiteboard session for a room.
+
+    With ``?since_version=N`` the response carries only the ops after version N
+    (``delta: true``) when the op log can bring the client up to date;
+    otherwise, or without the parameter, it carries the full board. With
+    ``?bbox=x0,y0,x1,y1`` a full board only carries the elements in that
+    viewport (and those without known bounds).
+    """
     try:
-        # Check if user is a member of the room
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
-            return jsonify({'error': 'Access denied. You are not a member of this room.'}), 403
+        bbox = request.args.get('bbox')
+        if bbox is not None:
+            try:
+                bbox = parse_bbox(bbox)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
         # Get or create whiteboard session
         whiteboard_session = WhiteboardSession.query.filter_by(
@@ -35,15 +135,46 @@ def get_whiteboard_session(current_user, room_id):
             db.session.add(whiteboard_session)
             db.session.commit()
         
-        return jsonify({
-            'whiteboard_session': whiteboard_session.to_dict(include_data=True),
+        result = {
             'room_id': room_id,
+            'version': whiteboard_session.version,
             'user_permissions': {
                 'can_draw': True,
-                'can_clear': membership.role in ['owner', 'moderator'],
+                'can_clear': g.room_role in ['owner', 'moderator'],
                 'can_save': True
             }
-        }), 200
+        }
+        
+        encoded = wants_encoded_strokes()
+        since_version = request.args.get('since_version', type=int)
+        ops = ops_since(whiteboard_session, since_version) if since_version is not None else None
+        if ops is not None:
+            result.update({
+                'delta': True,
+                'since_version': since_version,
+                'ops': [_present_op(op.to_dict(), encoded) for op in ops]
+            })
+        elif bbox is not None:
+            board, element_count = whiteboard_indexes.viewport(whiteboard_session, bbox)
+            if not encoded:
+                board = decode_board(copy.deepcopy(board))  # Elements are shared with the index
+            # element_count is the whole board's, not just the viewport's
+            session_dict = whiteboard_session.to_dict(data=board, element_count=element_count)
+            result.update({
+                'delta': False,
+                'bbox': list(bbox),
+                'whiteboard_session': session_dict
+            })
+        else:
+            # The board JSON is spliced in as stored (or as cached for this version)
+            board, element_count = board_json(whiteboard_session, encoded)
+            session_dict = whiteboard_session.to_dict(include_data=False, element_count=element_count)
+            result['delta'] = False
+            body = _splice_json(result, 'whiteboard_session', _splice_json(session_dict, 'session_data', board))
+            return current_app.response_class(body, status=200, mimetype='application/json',
+                                              headers=_codec_headers(encoded))
+        
+        return jsonify(result), 200, _codec_headers(encoded)
         
     except Exception as e:
         current_app.logger.error(f"Error getting whiteboard session: {e}")
@@ -51,22 +182,24 @@ def get_whiteboard_session(current_user, room_id):
 
 @whiteboard_bp.route('/rooms/<int:room_id>/whiteboard', methods=['PUT'])
 @token_required
+@room_member_required()
 def update_whiteboard_session(current_user, room_id):
-    """Update whiteboard session data"""
+    """Replace the whole whiteboard.
+
+    With ``base_version`` the replacement only applies if nobody changed the
+    board since that version; otherwise it is rejected with 409 and the
+    current version, so concurrent editors never silently overwrite each other.
+    """
     try:
         data = request.get_json()
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
-        # Check if user is a member of the room
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
-            return jsonify({'error': 'Access denied. You are not a member of this room.'}), 403
+        base_version = data.get('base_version')
+        if base_version is not None and not isinstance(base_version, int):
+            return jsonify({'error': 'base_version must be an integer'}), 400
+        if not _all_finite(data.get('session_data')):
+            return jsonify({'error': 'Whiteboard data must not contain NaN or Infinity'}), 400
         
         # Get whiteboard session
         whiteboard_session = WhiteboardSession.query.filter_by(
@@ -77,20 +210,25 @@ def update_whiteboard_session(current_user, room_id):
         if not whiteboard_session:
             whiteboard_session = WhiteboardSession(room_id=room_id)
             db.session.add(whiteboard_session)
+        elif base_version is not None:
+            if not lock_version(whiteboard_session, base_version):
+                db.session.rollback()
+                return _version_conflict(room_id)
+        else:
+            # The history entry below is a delta against the chain tail; lock first
+            lock_board(whiteboard_session)
         
         # Update session data
         session_data = data.get('session_data')
         if session_data:
             # Save current version to history before updating
-            if whiteboard_session.session_data:
-                history = WhiteboardHistory(
-                    whiteboard_session_id=whiteboard_session.id,
-                    version=whiteboard_session.version,
-                    session_data=whiteboard_session.session_data,
-                    modified_by=whiteboard_session.last_modified_by or current_user.id,
-                    change_description=f"Version {whiteboard_session.version}"
+            if whiteboard_session.session_data or whiteboard_session.has_pending_ops():
+                record_history(
+                    whiteboard_session,
+                    whiteboard_session.get_session_data(),
+                    whiteboard_session.last_modified_by or current_user.id,
+                    f"Version {whiteboard_session.version}"
                 )
-                db.session.add(history)
             
             whiteboard_session.set_session_data(session_data)
             whiteboard_session.last_modified_by = current_user.id
@@ -111,31 +249,192 @@ def update_whiteboard_session(current_user, room_id):
         db.session.add(event)
         db.session.commit()
         
+        # The client already has the board it sent; reply with metadata only
         return jsonify({
             'message': 'Whiteboard updated successfully',
-            'whiteboard_session': whiteboard_session.to_dict(include_data=True)
+            'whiteboard_session': whiteboard_session.to_dict(include_data=False),
+            'version': whiteboard_session.version
         }), 200
         
+    except StrokeCodecError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error updating whiteboard session: {e}")
         return jsonify({'error': 'Failed to update whiteboard session'}), 500
 
-@whiteboard_bp.route('/rooms/<int:room_id>/whiteboard/clear', methods=['POST'])
+@whiteboard_bp.route('/rooms/<int:room_id>/whiteboard', methods=['POST'])
+@whiteboard_bp.route('/rooms/<int:room_id>/whiteboard/ops', methods=['POST'])
 @token_required
-def clear_whiteboard(current_user, room_id):
-    """Clear whiteboard content"""
+@room_member_required()
+def append_whiteboard_ops(current_user, room_id):
+    """Append strokes, shapes and text to the whiteboard.
+
+    Body: ``{"ops": [{"type": "stroke", "data": {...}}, ...], "base_version": N}``
+    (or a single op as ``{"type": ..., "data": ...}``). Stroke points are
+    simplified with the room's stroke tolerance unless the op sets
+    ``"keep_original": true``. Ops are appended to the
+    op log without rewriting the board; each gets the board version it produced
+    as ``seq``. Appends commute, so ops based on an older version are rebased
+    onto the current board and ``missed_ops`` returns what the client hadn't
+    seen. If the board was replaced after ``base_version`` (or the client is too
+    far behind to catch up from ops) the request is rejected with 409.
+    """
     try:
-        # Check if user has permission to clear whiteboard
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        ops = data.get('ops') if 'ops' in data else [data]
+        if not isinstance(ops, list) or not ops:
+            return jsonify({'error': 'ops must be a non-empty list'}), 400
+        if len(ops) > MAX_OPS_PER_REQUEST:
+            return jsonify({'error': f'At most {MAX_OPS_PER_REQUEST} ops per request'}), 400
+        for op in ops:
+            if not isinstance(op, dict) or op.get('type') not in WHITEBOARD_OP_TYPES:
+                return jsonify({'error': f'Each op needs a type in {WHITEBOARD_OP_TYPES}'}), 400
+            if not isinstance(op.get('data'), dict):
+                return jsonify({'error': 'Each op needs a data object'}), 400
+            if not _all_finite(op['data']):
+                return jsonify({'error': 'Op data must not contain NaN or Infinity'}), 400
+            if op['type'] == ERASE_OP and not _valid_erase_ids(op['data'].get('ids')):
+                return jsonify({'error': 'Erase ops need data.ids, a list of element ids'}), 400
+        
+        simplify_stroke_ops(room_id, ops)
+        
+        whiteboard_session = WhiteboardSession.query.filter_by(
             room_id=room_id,
             is_active=True
         ).first()
         
-        if not membership or membership.role not in ['owner', 'moderator']:
-            return jsonify({'error': 'Access denied. Only room owners and moderators can clear the whiteboard.'}), 403
+        base_version = data.get('base_version')
+        if base_version is not None and not isinstance(base_version, int):
+            return jsonify({'error': 'base_version must be an integer'}), 400
         
+        if not whiteboard_session:
+            whiteboard_session = WhiteboardSession(room_id=room_id)
+            db.session.add(whiteboard_session)
+            db.session.flush()
+        
+        appended = [
+            whiteboard_session.append_op(op['type'], op['data'], current_user.id)
+            for op in ops
+        ]
+        
+        missed_ops = []
+        if base_version is not None:
+            # Appending took the row lock, so the tail below is stable until commit
+            own_seqs = {op.seq for op in appended}
+            db.session.refresh(whiteboard_session, ['reset_version'])
+            tail = ops_since(whiteboard_session, base_version)
+            if tail is None:
+                db.session.rollback()
+                return _version_conflict(room_id)
+            missed_ops = [op for op in tail if op.seq not in own_seqs]
+        db.session.commit()
+        
+        # Published as stored; each stream decodes for its own client
+        for op in appended:
+            publish_room_message(room_id, {'type': 'whiteboard_op', 'op': op.to_dict()})
+        
+        encoded = wants_encoded_strokes()
+        ops_data = [_present_op(op.to_dict(), encoded) for op in appended]
+        missed_data = [_present_op(op.to_dict(), encoded) for op in missed_ops]
+        
+        _compact_after_commit(room_id, whiteboard_session)
+        
+        return jsonify({
+            'ops': ops_data,
+            'missed_ops': missed_data,
+            'version': ops_data[-1]['seq']
+        }), 201, _codec_headers(encoded)
+        
+    except StrokeCodecError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error appending whiteboard ops: {e}")
+        return jsonify({'error': 'Failed to append whiteboard ops'}), 500
+
+@whiteboard_bp.route('/rooms/<int:room_id>/whiteboard/hit-test', methods=['POST'])
+@token_required
+@room_member_required()
+def hit_test_whiteboard(current_user, room_id):
+    """Ids of the elements touching a region, topmost first.
+
+    Body: ``{"bbox": [x0, y0, x1, y1]}`` or ``{"x": .., "y": .., "radius": ..}``.
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        try:
+            region = _request_region(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        whiteboard_session = WhiteboardSession.query.filter_by(room_id=room_id, is_active=True).first()
+        ids = whiteboard_indexes.hit_test(whiteboard_session, region) if whiteboard_session else []
+        
+        return jsonify({
+            'ids': ids,
+            'version': whiteboard_session.version if whiteboard_session else None
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Error hit-testing whiteboard: {e}")
+        return jsonify({'error': 'Failed to hit-test whiteboard'}), 500
+
+@whiteboard_bp.route('/rooms/<int:room_id>/whiteboard/erase', methods=['POST'])
+@token_required
+@room_member_required()
+def erase_whiteboard_region(current_user, room_id):
+    """Erase every element touching a region (same body as hit-test).
+
+    Appends one erase op listing the ids removed; nothing is appended if the
+    region is empty.
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        try:
+            region = _request_region(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        whiteboard_session = WhiteboardSession.query.filter_by(room_id=room_id, is_active=True).first()
+        ids = whiteboard_indexes.hit_test(whiteboard_session, region) if whiteboard_session else []
+        if not ids:
+            return jsonify({
+                'op': None,
+                'version': whiteboard_session.version if whiteboard_session else None
+            }), 200
+        
+        op = whiteboard_session.append_op(ERASE_OP, {'ids': ids}, current_user.id)
+        db.session.commit()
+        
+        op_data = op.to_dict()
+        publish_room_message(room_id, {'type': 'whiteboard_op', 'op': op_data})
+        
+        _compact_after_commit(room_id, whiteboard_session)
+        
+        return jsonify({'op': op_data, 'version': op_data['seq']}), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error erasing whiteboard region: {e}")
+        return jsonify({'error': 'Failed to erase whiteboard region'}), 500
+
+@whiteboard_bp.route('/rooms/<int:room_id>/whiteboard/clear', methods=['POST'])
+@token_required
+@room_member_required(roles=['owner', 'moderator'],
+                      error='Access denied. Only room owners and moderators can clear the whiteboard.')
+def clear_whiteboard(current_user, room_id):
+    """Clear whiteboard content"""
+    try:
         # Get whiteboard session
         whiteboard_session = WhiteboardSession.query.filter_by(
             room_id=room_id,
@@ -143,16 +442,16 @@ def clear_whiteboard(current_user, room_id):
         ).first()
         
         if whiteboard_session:
+            lock_board(whiteboard_session)
+            
             # Save current version to history before clearing
-            if whiteboard_session.session_data:
-                history = WhiteboardHistory(
-                    whiteboard_session_id=whiteboard_session.id,
-                    version=whiteboard_session.version,
-                    session_data=whiteboard_session.session_data,
-                    modified_by=whiteboard_session.last_modified_by or current_user.id,
-                    change_description=f"Before clearing - Version {whiteboard_session.version}"
+            if whiteboard_session.session_data or whiteboard_session.has_pending_ops():
+                record_history(
+                    whiteboard_session,
+                    whiteboard_session.get_session_data(),
+                    whiteboard_session.last_modified_by or current_user.id,
+                    f"Before clearing - Version {whiteboard_session.version}"
                 )
-                db.session.add(history)
             
             whiteboard_session.clear_whiteboard(current_user.id)
             db.session.commit()
@@ -177,21 +476,129 @@ def clear_whiteboard(current_user, room_id):
         current_app.logger.error(f"Error clearing whiteboard: {e}")
         return jsonify({'error': 'Failed to clear whiteboard'}), 500
 
+@whiteboard_bp.route('/rooms/<int:room_id>/whiteboard/settings', methods=['GET'])
+@token_required
+@room_member_required()
+def get_whiteboard_settings(current_user, room_id):
+    """Get the room's whiteboard settings"""
+    try:
+        return jsonify({'stroke_tolerance': room_stroke_tolerance(room_id)}), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting whiteboard settings: {e}")
+        return jsonify({'error': 'Failed to get whiteboard settings'}), 500
+
+@whiteboard_bp.route('/rooms/<int:room_id>/whiteboard/settings', methods=['PUT'])
+@token_required
+@room_member_required(roles=['owner', 'moderator'],
+                      error='Access denied. Only room owners and moderators can change whiteboard settings.')
+def update_whiteboard_settings(current_user, room_id):
+    """Update the room's whiteboard settings.
+
+    Body: ``{"stroke_tolerance": px}``; 0 stores strokes as sent, null restores
+    the default. Applies to strokes added from now on.
+    """
+    try:
+        data = request.get_json()
+        if not data or 'stroke_tolerance' not in data:
+            return jsonify({'error': 'stroke_tolerance is required'}), 400
+        try:
+            tolerance = parse_tolerance(data['stroke_tolerance'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        room = db.session.get(StudyRoom, room_id)
+        room.stroke_tolerance = tolerance
+        db.session.commit()
+        
+        return jsonify({'stroke_tolerance': room_stroke_tolerance(room_id)}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error updating whiteboard settings: {e}")
+        return jsonify({'error': 'Failed to update whiteboard settings'}), 500
+
+def _board_image(room_id, fmt, size, filename=None):
+    """Rendered board response with an ETag on the board version; 304 if the client has it"""
+    session_id, version = export_state(room_id)
+    if request.if_none_match.contains(export_etag(session_id, version, fmt, size)):
+        response = current_app.response_class(status=304)
+        response.set_etag(export_etag(session_id, version, fmt, size))
+        return response
+    
+    body, version = export_board(session_id, fmt, size)
+    response = current_app.response_class(body, status=200, mimetype=EXPORT_FORMATS[fmt])
+    response.set_etag(export_etag(session_id, version, fmt, size))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'"
+    if filename:
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+@whiteboard_bp.route('/rooms/<int:room_id>/whiteboard/export', methods=['GET'])
+@token_required
+@room_member_required()
+def export_whiteboard(current_user, room_id):
+    """Render the whiteboard as an image.
+
+    Query params: format (svg, png; png needs cairosvg), size (output width in
+    px; default board scale) and download (serve as an attachment).
+    """
+    try:
+        fmt = request.args.get('format', 'svg')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': f'format must be one of {list(EXPORT_FORMATS)}'}), 400
+        if fmt == 'png' and not PNG_AVAILABLE:
+            return jsonify({'error': 'PNG export is not available on this server'}), 501
+        size = request.args.get('size', type=int)
+        if size is not None and not 1 <= size <= MAX_EXPORT_SIZE:
+            return jsonify({'error': f'size must be between 1 and {MAX_EXPORT_SIZE}'}), 400
+        
+        filename = f"whiteboard-room-{room_id}" if request.args.get('download') else None
+        return _board_image(room_id, fmt, size, filename)
+        
+    except Exception as e:
+        current_app.logger.error(f"Error exporting whiteboard: {e}")
+        return jsonify({'error': 'Failed to export whiteboard'}), 500
+
+@whiteboard_bp.route('/rooms/<int:room_id>/whiteboard/thumbnail', methods=['GET'])
+def get_whiteboard_thumbnail(room_id):
+    """Small render of the whiteboard for room lists (PNG if available, else SVG).
+
+    Loads through the room's signed ``thumbnail_url`` (``e`` and ``sig`` query
+    params, only handed to users who can see the room) so it works as an
+    <img> src. With a token instead, it is visible to members, and to anyone
+    for active public rooms.
+    """
+    try:
+        if request.args.get('sig') is None:
+            return _user_thumbnail(room_id)
+        if not verify_signature(THUMBNAIL_URL_PURPOSE, room_id, request.args.get('e'), request.args.get('sig')):
+            return jsonify({'error': 'Invalid or expired thumbnail link'}), 403
+        return _thumbnail(room_id)
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting whiteboard thumbnail: {e}")
+        return jsonify({'error': 'Failed to get whiteboard thumbnail'}), 500
+
+@token_required
+def _user_thumbnail(current_user, room_id):
+    if membership_cache.get_role(room_id, current_user.id) is None:
+        room = db.session.query(StudyRoom.is_private, StudyRoom.is_active).filter_by(id=room_id).first()
+        if room is None or room.is_private or not room.is_active:
+            return jsonify({'error': 'Access denied. You are not a member of this room.'}), 403
+    return _thumbnail(room_id)
+
+def _thumbnail(room_id):
+    return _board_image(room_id, 'png' if PNG_AVAILABLE else 'svg', THUMBNAIL_SIZE)
+
 @whiteboard_bp.route('/rooms/<int:room_id>/whiteboard/history', methods=['GET'])
 @token_required
+@room_member_required()
 def get_whiteboard_history(current_user, room_id):
     """Get whiteboard version history"""
     try:
-        # Check if user is a member of the room
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
-            return jsonify({'error': 'Access denied. You are not a member of this room.'}), 403
-        
         # Get whiteboard session
         whiteboard_session = WhiteboardSession.query.filter_by(
             room_id=room_id,
@@ -206,60 +613,54 @@ def get_whiteboard_history(current_user, room_id):
         limit = min(limit, 50)  # Cap at 50 records
         
         history = WhiteboardHistory.query.filter_by(whiteboard_session_id=whiteboard_session.id)\
-                                        .order_by(WhiteboardHistory.created_at.desc())\
+                                        .order_by(WhiteboardHistory.id.desc())\
                                         .limit(limit).all()
         
+        # Boards are rebuilt from keyframes and deltas, so only on request
+        include_data = request.args.get('include_data', '').lower() in ('1', 'true', 'yes')
+        boards = history_boards(whiteboard_session.id, history) if include_data else {}
+        encoded = wants_encoded_strokes()
+        for board in boards.values():
+            _present_board(board, encoded)
+        
         return jsonify({
-            'history': [h.to_dict() for h in history],
+            'history': [h.to_dict(boards.get(h.id)) for h in history],
             'current_version': whiteboard_session.version
-        }), 200
+        }), 200, _codec_headers(encoded)
         
     except Exception as e:
         current_app.logger.error(f"Error getting whiteboard history: {e}")
         return jsonify({'error': 'Failed to get whiteboard history'}), 500
 
-@whiteboard_bp.route('/rooms/<int:room_id>/documents', methods=['GET'])
+@whiteboard_bp.route('/rooms/<int:room_id>/whiteboard/history/<int:version>', methods=['GET'])
 @token_required
-def get_room_documents(current_user, room_id):
-    """Get documents shared in a room"""
+@room_member_required()
+def get_whiteboard_version(current_user, room_id, version):
+    """Get the board as it was at a past version"""
     try:
-        # Check if user is a member of the room
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
+        whiteboard_session = WhiteboardSession.query.filter_by(
             room_id=room_id,
             is_active=True
         ).first()
         
-        if not membership:
-            return jsonify({'error': 'Access denied. You are not a member of this room.'}), 403
+        entry, board = board_at_version(whiteboard_session.id, version) if whiteboard_session else (None, None)
+        if not entry:
+            return jsonify({'error': 'Version not found in history'}), 404
         
-        # Get shared documents
-        room_documents = db.session.query(RoomDocument, Document, User)\
-                                  .join(Document, RoomDocument.document_id == Document.id)\
-                                  .join(User, RoomDocument.shared_by == User.id)\
-                                  .filter(RoomDocument.room_id == room_id, RoomDocument.is_active == True)\
-                                  .order_by(RoomDocument.shared_at.desc()).all()
-        
-        documents_data = []
-        for room_doc, document, sharer in room_documents:
-            doc_data = document.to_dict()
-            doc_data.update({
-                'room_document_id': room_doc.id,
-                'shared_by': {
-                    'id': sharer.id,
-                    'username': sharer.username,
-                    'first_name': sharer.first_name,
-                    'last_name': sharer.last_name
-                },
-                'permissions': room_doc.permissions,
-                'shared_at': room_doc.shared_at.isoformat() if room_doc.shared_at else None,
-                'can_read': room_doc.can_read(),
-                'can_write': room_doc.can_write(),
-                'can_admin': room_doc.can_admin()
-            })
-            documents_data.append(doc_data)
+        encoded = wants_encoded_strokes()
+        return jsonify({'history': entry.to_dict(_present_board(board, encoded))}), 200, _codec_headers(encoded)
         
-        return jsonify({'documents': documents_data}), 200
+    except Exception as e:
+        current_app.logger.error(f"Error getting whiteboard version: {e}")
+        return jsonify({'error': 'Failed to get whiteboard version'}), 500
+
+@whiteboard_bp.route('/rooms/<int:room_id>/documents', methods=['GET'])
+@token_required
+@room_member_required()
+def get_room_documents(current_user, room_id):
+    """Get documents shared in a room"""
+    try:
+        return jsonify({'documents': room_documents(room_id)}), 200
         
     except Exception as e:
         current_app.logger.error(f"Error getting room documents: {e}")
@@ -267,6 +668,7 @@ def get_room_documents(current_user, room_id):
 
 @whiteboard_bp.route('/rooms/<int:room_id>/documents/share', methods=['POST'])
 @token_required
+@room_member_required()
 def share_document_in_room(current_user, room_id):
     """Share a document in a room"""
     try:
@@ -284,16 +686,6 @@ def share_document_in_room(current_user, room_id):
         if permissions not in ['read', 'write', 'admin']:
             return jsonify({'error': 'Invalid permissions'}), 400
         
-        # Check if user is a member of the room
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
-            return jsonify({'error': 'Access denied. You are not a member of this room.'}), 403
-        
         # Check if document exists and user has access
         document = Document.query.filter_by(id=document_id).first()
         if not document:
@@ -350,6 +742,7 @@ def share_document_in_room(current_user, room_id):
 
 @whiteboard_bp.route('/rooms/<int:room_id>/documents/<int:room_document_id>/unshare', methods=['DELETE'])
 @token_required
+@room_member_required()
 def unshare_document_from_room(current_user, room_id, room_document_id):
     """Remove document share from room"""
     try:
@@ -364,18 +757,9 @@ def unshare_document_from_room(current_user, room_id, room_document_id):
             return jsonify({'error': 'Shared document not found'}), 404
         
         # Check permissions - only the sharer or room owner/moderator can unshare
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
-            return jsonify({'error': 'Access denied. You are not a member of this room.'}), 403
-        
         can_unshare = (
             room_document.shared_by == current_user.id or
-            membership.role in ['owner', 'moderator']
+            g.room_role in ['owner', 'moderator']
         )
         
         if not can_unshare:
@@ -408,43 +792,224 @@ def unshare_document_from_room(current_user, room_id, room_document_id):
 
 @whiteboard_bp.route('/rooms/<int:room_id>/events', methods=['GET'])
 @token_required
+@room_member_required()
 def get_collaboration_events(current_user, room_id):
     """Get recent collaboration events for a room"""
     try:
-        # Check if user is a member of the room
-        membership = RoomMembership.query.filter_by(
-            user_id=current_user.id,
-            room_id=room_id,
-            is_active=True
-        ).first()
-        
-        if not membership:
-            return jsonify({'error': 'Access denied. You are not a member of this room.'}), 403
-        
         # Get recent events
         limit = request.args.get('limit', 20, type=int)
         limit = min(limit, 100)  # Cap at 100 records
         
-        events = db.session.query(CollaborationEvent, User)\
-                           .join(User, CollaborationEvent.user_id == User.id)\
-                           .filter(CollaborationEvent.room_id == room_id)\
-                           .order_by(CollaborationEvent.created_at.desc())\
-                           .limit(limit).all()
-        
-        events_data = []
-        for event, user in events:
-            event_data = event.to_dict()
-            event_data['user'] = {
-                'id': user.id,
-                'username': user.username,
-                'first_name': user.first_name,
-                'last_name': user.last_name
-            }
-            events_data.append(event_data)
-        
-        return jsonify({'events': events_data}), 200
+        return jsonify({'events': recent_events(room_id, limit)}), 200
         
     except Exception as e:
         current_app.logger.error(f"Error getting collaboration events: {e}")
         return jsonify({'error': 'Failed to get collaboration events'}), 500
 
+
+def _sse(event_name, data, event_id=None):
+    """Format one server-sent event"""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event_name}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+def _events_after(room_id, after_id):
+    """Persisted collaboration events after an event id, oldest first"""
+    while True:
+        events = CollaborationEvent.query.filter(
+            CollaborationEvent.room_id == room_id,
+            CollaborationEvent.id > after_id
+        ).order_by(CollaborationEvent.id).limit(STREAM_RESUME_BATCH).all()
+        for event in events:
+            after_id = event.id
+            yield event
+        if len(events) < STREAM_RESUME_BATCH:
+            return
+
+def _recent_events_upto(room_id, up_to_id):
+    """Events at or below an id created within the lookback window, oldest first.
+
+    Event ids are assigned at insert, so a transaction can commit an event
+    with a lower id than one already delivered; this finds those.
+    """
+    return CollaborationEvent.query.filter(
+        CollaborationEvent.room_id == room_id,
+        CollaborationEvent.id <= up_to_id,
+        CollaborationEvent.created_at >= datetime.utcnow() - STREAM_EVENT_LOOKBACK
+    ).order_by(CollaborationEvent.id).all()
+
+def _parse_stream_id(value):
+    """Split a stream id "<event id>:<op seq>" (older streams sent a bare event id)"""
+    event_id, _, op_seq = (value or '').partition(':')
+    try:
+        return int(event_id), int(op_seq) if op_seq else None
+    except ValueError:
+        return None, None
+
+def _ends_stream(event, user_id):
+    """Whether an event removes the streaming user from the room"""
+    data = event.get('event_data') or {}
+    return (event['event_type'] == 'member_leave' and event['user_id'] == user_id) or \
+           (event['event_type'] == 'member_kick' and data.get('kicked_user_id') == user_id)
+
+@whiteboard_bp.route('/rooms/<int:room_id>/stream', methods=['GET'])
+@token_required
+@room_member_required()
+def stream_room_events(current_user, room_id):
+    """Push room activity as server-sent events.
+
+    ``collaboration`` events carry persisted CollaborationEvents (whiteboard,
+    documents, membership changes) and ``whiteboard_op`` events carry appended
+    drawing ops. The SSE id is "<last event id>:<last op seq>", so a reconnect
+    with Last-Event-ID (or ``?last_event_id=``) only receives what was missed;
+    if the ops can't be replayed a ``whiteboard_reset`` event tells the client
+    to reload the board. ``presence`` events are online/offline deltas.
+    Broker messages are backed by the database: gaps are filled from it, and
+    every tick catches up on events and ops committed by other workers.
+    Streams end after STREAM_MAX_SECONDS and the client reconnects; each
+    worker serves at most MAX_STREAMS_PER_WORKER at once (503 beyond that).
+    """
+    release_slot = stream_slots.acquire()
+    if release_slot is None:
+        return streams_busy_response()
+    try:
+        last_event_id, last_op_seq = _parse_stream_id(
+            request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        )
+        if last_event_id is None:
+            # New clients start from now; history is available from /rooms/<id>/events
+            last_event_id = db.session.query(func.max(CollaborationEvent.id))\
+                                      .filter(CollaborationEvent.room_id == room_id).scalar() or 0
+        if last_op_seq is None:
+            last_op_seq = db.session.query(WhiteboardSession.version)\
+                                    .filter_by(room_id=room_id, is_active=True).scalar() or 1
+        
+        # Subscribe before catching up so nothing published in between is lost
+        subscription = room_broker.subscribe(room_channel(room_id))
+    except Exception as e:
+        release_slot()
+        current_app.logger.error(f"Error opening room stream: {e}")
+        return jsonify({'error': 'Failed to open room stream'}), 500
+
+    user_id = current_user.id
+    encoded = wants_encoded_strokes()
+
+    def generate():
+        cursor = last_event_id
+        op_seq = last_op_seq
+        delivered = {}  # Event id -> when it was sent, for ids within the lookback window
+
+        def stream_id():
+            return f"{cursor}:{op_seq}"
+
+        def send_events(events):
+            """Send events not yet delivered; returns True if one ends the stream"""
+            nonlocal cursor
+            for event_data in events:
+                if event_data['id'] in delivered:
+                    continue
+                delivered[event_data['id']] = time.monotonic()
+                cursor = max(cursor, event_data['id'])
+                yield _sse('collaboration', event_data, stream_id())
+                if _ends_stream(event_data, user_id):
+                    yield _sse('end', {'reason': 'removed_from_room'})
+                    return True
+            return False
+
+        def stored_events(lookback=False):
+            events = _recent_events_upto(room_id, cursor) if lookback else []
+            events.extend(_events_after(room_id, cursor))
+            return [event.to_dict() for event in events]
+
+        def send_ops(op_list):
+            nonlocal op_seq
+            for op in op_list:
+                if op['seq'] > op_seq:
+                    op_seq = op['seq']
+                    # Broker messages are shared with other subscribers; decode a copy
+                    yield _sse('whiteboard_op', op if encoded else _present_op(copy.deepcopy(op), False), stream_id())
+
+        def stored_ops():
+            """Ops after op_seq from the log, or a reset if they can't be replayed"""
+            nonlocal op_seq
+            whiteboard_session = WhiteboardSession.query.filter_by(room_id=room_id, is_active=True).first()
+            if whiteboard_session is None or (whiteboard_session.version or 1) == op_seq:
+                return
+            ops = ops_since(whiteboard_session, op_seq)
+            if ops is None:
+                op_seq = whiteboard_session.version or 1
+                yield _sse('whiteboard_reset', {'version': op_seq}, stream_id())
+                return
+            yield from send_ops([op.to_dict() for op in ops])
+
+        def catch_up(lookback=False):
+            """Fill in from the database, then release its connection for the rest of the stream"""
+            try:
+                ended = yield from send_events(stored_events(lookback))
+                if not ended:
+                    yield from stored_ops()
+                return ended
+            finally:
+                db.session.close()
+
+        try:
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            # The client already has everything up to the cursor it resumed from
+            delivered.update((event.id, time.monotonic()) for event in _recent_events_upto(room_id, cursor))
+            if (yield from catch_up()):
+                return
+
+            online = {uid: seen.timestamp() for uid, seen in presence.online_members(room_id).items()}
+            yield _sse('presence_snapshot', {'online_user_ids': sorted(online)})
+
+            started = time.monotonic()
+            next_tick = started + STREAM_TICK_SECONDS
+            while time.monotonic() - started < STREAM_MAX_SECONDS:
+                message = subscription.get(timeout=max(0.1, next_tick - time.monotonic()))
+                if message and message['type'] == 'event' and message['id'] not in delivered:
+                    if message['id'] > cursor:
+                        # Events between the cursor and this one may have come from elsewhere
+                        if (yield from catch_up()):
+                            return
+                    if (yield from send_events([message['event']])):
+                        return
+                elif message and message['type'] == 'whiteboard_op':
+                    seq = message['op']['seq']
+                    if seq == op_seq + 1:
+                        yield from send_ops([message['op']])
+                    elif seq > op_seq:
+                        if (yield from catch_up()):
+                            return
+                elif message and message['type'] == 'presence':
+                    was_online = message['user_id'] in online
+                    if message['online']:
+                        online[message['user_id']] = message['at']
+                    else:
+                        online.pop(message['user_id'], None)
+                    if was_online != message['online']:
+                        yield _sse('presence', {'user_id': message['user_id'], 'online': message['online']})
+
+                if time.monotonic() >= next_tick:
+                    next_tick = time.monotonic() + STREAM_TICK_SECONDS
+                    # Covers other workers' commits (in-process broker) and missed or late messages
+                    if (yield from catch_up(lookback=True)):
+                        return
+                    forget_before = time.monotonic() - 2 * STREAM_EVENT_LOOKBACK.total_seconds()
+                    for event_id in [i for i, sent in delivered.items() if sent < forget_before]:
+                        del delivered[event_id]
+                    expired_before = time.time() - presence.ttl
+                    for uid in [uid for uid, seen in online.items() if seen < expired_before]:
+                        del online[uid]
+                        yield _sse('presence', {'user_id': uid, 'online': False})
+                    yield ": keep-alive\n\n"
+        finally:
+            subscription.close()
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(release_slot)  # Runs even if the stream never started
+    return response
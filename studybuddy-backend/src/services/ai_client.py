@@ -0,0 +1,114 @@
+import os
+import json
+from src.services.model_router import ModelRouter, AUTO_MODEL
+
+# OpenAI integration
+try:
+    import openai
+    openai.api_key = os.environ.get('OPENAI_API_KEY')
+    openai.api_base = os.environ.get('OPENAI_API_BASE', 'https://api.openai.com/v1')
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
+# Available AI models
+AVAILABLE_MODELS = {
+    'gpt-3.5-turbo': {
+        'name': 'GPT-3.5 Turbo',
+        'description': 'Fast and efficient for most tasks',
+        'max_tokens': 4096,
+        'cost_tier': 'low'
+    },
+    'gpt-4': {
+        'name': 'GPT-4',
+        'description': 'Most capable model for complex reasoning',
+        'max_tokens': 8192,
+        'cost_tier': 'high'
+    },
+    'gpt-4-turbo': {
+        'name': 'GPT-4 Turbo',
+        'description': 'Latest GPT-4 with improved performance',
+        'max_tokens': 128000,
+        'cost_tier': 'medium'
+    }
+}
+
+# Routes 'auto' requests by prompt size, task and measured latency
+model_router = ModelRouter(AVAILABLE_MODELS)
+
+
+def is_valid_model(model):
+    """Check if a model name is selectable (a listed model or 'auto')"""
+    return model == AUTO_MODEL or model in AVAILABLE_MODELS
+
+
+def chat_completion(messages, model, task='qa', max_tokens=None, temperature=0.7):
+    """Call the chat API through the model router; returns (content, model_used)"""
+    def call(candidate, timeout):
+        response = openai.ChatCompletion.create(
+            model=candidate,
+            messages=messages,
+            max_tokens=max_tokens or AVAILABLE_MODELS.get(candidate, {}).get('max_tokens', 4096) // 2,
+            temperature=temperature,
+            request_timeout=timeout
+        )
+        return response.choices[0].message.content
+    
+    return model_router.call(model, task, messages, call)
+
+
+def parse_ai_json(ai_content):
+    """Parse a JSON payload from a model reply, stripping markdown code fences"""
+    ai_content = ai_content.strip()
+    if ai_content.startswith('```json'):
+        ai_content = ai_content[7:-3]
+    elif ai_content.startswith('```'):
+        ai_content = ai_content[3:-3]
+    return json.loads(ai_content)
+
+
+def generate_flashcards_content(text, count, model):
+    """Ask the model for flashcards; the result is shared by coalesced requests"""
+    prompt = f"""
+    Create {count} educational flashcards from the following text. Format as JSON array with objects containing 'question', 'answer', 'difficulty' (easy/medium/hard), and 'category' fields.
+    
+    Text: {text}
+    
+    Return only the JSON array, no additional text.
+    """
+    
+    content, _ = chat_completion(
+        [
+            {"role": "system", "content": "You are an educational content creator. Generate high-quality flashcards that test understanding, not just memorization."},
+            {"role": "user", "content": prompt}
+        ],
+        model,
+        task='flashcard',
+        max_tokens=2000
+    )
+    
+    return parse_ai_json(content)
+
+
+def generate_practice_test_content(text, question_count, model):
+    """Ask the model for a practice test; the result is shared by coalesced requests"""
+    prompt = f"""
+    Create a practice test with {question_count} multiple choice questions from the following text.
+    Format as JSON with 'title' and 'questions' array. Each question should have 'question', 'options' (array of 4 choices), 'correct_answer' (the correct option), and 'explanation'.
+    
+    Text: {text}
+    
+    Return only the JSON object, no additional text.
+    """
+    
+    content, _ = chat_completion(
+        [
+            {"role": "system", "content": "You are an educational assessment creator. Generate high-quality multiple choice questions that test comprehension and application."},
+            {"role": "user", "content": prompt}
+        ],
+        model,
+        task='practice_test',
+        max_tokens=3000
+    )
+    
+    return parse_ai_json(content)
@@ -0,0 +1,251 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import update, or_, and_
+from src.extensions import db
+from src.models.user import User
+from src.models.document import Document
+from src.models.ai_tutor import Flashcard, PracticeTest, AIGenerationJob, AIGenerationJobItem
+from src.services.ai_client import (
+    OPENAI_AVAILABLE, model_router, generate_flashcards_content, generate_practice_test_content
+)
+from src.services.llm_scheduler import llm_scheduler, get_user_tier, estimate_tokens, AdmissionRejected
+from src.services.single_flight import ai_single_flight, make_flight_key, normalize_text
+
+JOB_TASK_TYPES = ['flashcards', 'practice_test']
+
+# Larger than the 2,000-character limit of the interactive endpoints; 'auto' routing
+# picks a model whose context window fits, explicit models get what fits theirs.
+JOB_TEXT_LIMIT = 12000
+
+MAX_JOB_DOCUMENTS = 50
+MAX_JOB_CONCURRENCY = 4
+
+# A running item not finished within this time is assumed lost and reclaimed
+ITEM_LEASE = timedelta(minutes=5)
+
+
+class AIJobRunner:
+    """Runs batch generation jobs on a shared thread pool.
+
+    A job gets ``concurrency`` lanes. A lane claims one pending item with a
+    conditional UPDATE (so lanes in different gunicorn workers never run the same
+    item), processes it, commits its result as a checkpoint and re-queues itself at
+    the back of the pool, which round-robins pool threads across active jobs.
+    """
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-job')
+
+    def start(self, job):
+        """Start the lanes for a job"""
+        app = current_app._get_current_object()
+        for _ in range(job.concurrency):
+            self._executor.submit(self._lane, app, job.id)
+
+    def resume_incomplete(self):
+        """Restart lanes for jobs left unfinished by a previous process.
+
+        Call this from one process only (``flask run-worker``): every process that
+        resumes a job adds ``job.concurrency`` more lanes to it.
+        """
+        jobs = AIGenerationJob.query.filter(AIGenerationJob.status.in_(['queued', 'running'])).all()
+        for job in jobs:
+            self.start(job)
+        return len(jobs)
+
+    def _lane(self, app, job_id):
+        with app.app_context():
+            try:
+                item = self._claim_next(job_id)
+                if item is None:
+                    self._finalize(job_id)
+                    return
+                retry_after = self._process(item)
+                if retry_after:
+                    threading.Timer(retry_after, self._executor.submit, args=(self._lane, app, job_id)).start()
+                else:
+                    self._executor.submit(self._lane, app, job_id)
+            except Exception as e:
+                app.logger.error(f"AI job {job_id} lane error: {e}")
+            finally:
+                db.session.remove()
+
+    def _claim_next(self, job_id):
+        job = db.session.get(AIGenerationJob, job_id)
+        if job is None or job.status == 'cancelled':
+            return None
+
+        now = datetime.utcnow()
+        claimable = and_(
+            AIGenerationJobItem.job_id == job_id,
+            or_(
+                AIGenerationJobItem.status == 'pending',
+                and_(AIGenerationJobItem.status == 'running', AIGenerationJobItem.claimed_at < now - ITEM_LEASE)
+            )
+        )
+        while True:
+            candidate = db.session.query(AIGenerationJobItem.id).filter(claimable)\
+                                  .order_by(AIGenerationJobItem.id).first()
+            if candidate is None:
+                return None
+            result = db.session.execute(
+                update(AIGenerationJobItem)
+                .where(AIGenerationJobItem.id == candidate.id, claimable)
+                .values(status='running', claimed_at=now)
+            )
+            if job.status == 'queued':
+                job.status = 'running'
+            db.session.commit()
+            if result.rowcount == 1:
+                return db.session.get(AIGenerationJobItem, candidate.id)
+            # Another lane won the race for this item; try the next one
+
+    def _process(self, item):
+        """Generate one item; returns seconds to wait if it must be retried later"""
+        claim = (item.id, item.claimed_at)  # Read now; rollbacks below reload the item
+        job = item.job
+        document = db.session.get(Document, item.document_id)
+        user = db.session.get(User, job.user_id)
+        params = job.get_params()
+
+        try:
+            if not document or not document.extracted_text:
+                raise ValueError('Document has no extracted text')
+            task = 'flashcard' if item.task_type == 'flashcards' else 'practice_test'
+            text_limit = min(JOB_TEXT_LIMIT, model_router.max_prompt_chars(job.model, task))
+            text = normalize_text(document.extracted_text)[:text_limit]
+
+            with llm_scheduler.admit(user.id, get_user_tier(user), estimate_tokens(text, task)):
+                if item.task_type == 'flashcards':
+                    result = self._generate_flashcards(job, document, text, params.get('count', 5))
+                else:
+                    result = self._generate_practice_test(job, document, text, params.get('question_count', 5))
+        except AdmissionRejected as e:
+            # Over budget: put the item back and let the lane come back later
+            db.session.rollback()
+            db.session.execute(
+                update(AIGenerationJobItem)
+                .where(self._still_claimed(claim))
+                .values(status='pending', claimed_at=None)
+            )
+            db.session.commit()
+            return e.retry_after
+        except Exception as e:
+            db.session.rollback()
+            self._finish(claim, job.id, 'failed', error=str(e)[:255])
+            return None
+
+        self._finish(claim, job.id, 'completed', result=result)
+        return None
+
+    def _generate_flashcards(self, job, document, text, count):
+        if not OPENAI_AVAILABLE:
+            raise RuntimeError('AI generation is not available')
+        flight_key = make_flight_key('flashcards', job.model, text, count=count)
+        cards = ai_single_flight.do(flight_key, lambda: generate_flashcards_content(text, count, job.model))
+
+        saved = []
+        for card_data in cards[:count]:
+            flashcard = Flashcard(
+                user_id=job.user_id,
+                document_id=document.id,
+                question=card_data.get('question', ''),
+                answer=card_data.get('answer', ''),
+                difficulty=card_data.get('difficulty', 'medium'),
+                category=card_data.get('category', 'generated')
+            )
+            db.session.add(flashcard)
+            saved.append(flashcard)
+        db.session.flush()
+        return {'flashcard_ids': [f.id for f in saved], 'count': len(saved)}
+
+    def _generate_practice_test(self, job, document, text, question_count):
+        if not OPENAI_AVAILABLE:
+            raise RuntimeError('AI generation is not available')
+        flight_key = make_flight_key('practice_test', job.model, text, question_count=question_count)
+        generated = ai_single_flight.do(
+            flight_key,
+            lambda: generate_practice_test_content(text, question_count, job.model)
+        )
+
+        test = PracticeTest(
+            user_id=job.user_id,
+            document_id=document.id,
+            title=generated.get('title', f"Practice Test - {document.original_filename}")[:100],
+            questions=json.dumps(generated.get('questions', [])),
+            total_questions=len(generated.get('questions', []))
+        )
+        db.session.add(test)
+        db.session.flush()
+        return {'practice_test_id': test.id, 'total_questions': test.total_questions}
+
+    @staticmethod
+    def _still_claimed(claim):
+        """Matches an item only while the ``(item_id, claimed_at)`` claim on it stands"""
+        item_id, claimed_at = claim
+        return and_(
+            AIGenerationJobItem.id == item_id,
+            AIGenerationJobItem.status == 'running',
+            AIGenerationJobItem.claimed_at == claimed_at
+        )
+
+    def _finish(self, claim, job_id, status, result=None, error=None):
+        """Checkpoint an item result together with the job's finish counter.
+
+        Skipped (and the result discarded) if the item's lease expired and
+        another lane reclaimed it, so every item is counted once.
+        """
+        claimed = db.session.execute(
+            update(AIGenerationJobItem)
+            .where(self._still_claimed(claim))
+            .values(
+                status=status,
+                result=json.dumps(result) if result is not None else None,
+                error=error,
+                completed_at=datetime.utcnow()
+            )
+        )
+        if claimed.rowcount != 1:
+            db.session.rollback()
+            return
+        finish_seq = db.session.execute(
+            update(AIGenerationJob)
+            .where(AIGenerationJob.id == job_id)
+            .values(
+                finished_items=AIGenerationJob.finished_items + 1,
+                failed_items=AIGenerationJob.failed_items + (1 if status == 'failed' else 0)
+            )
+            .returning(AIGenerationJob.finished_items)
+        ).scalar()
+        db.session.execute(
+            update(AIGenerationJobItem)
+            .where(AIGenerationJobItem.id == claim[0])
+            .values(finish_seq=finish_seq)
+        )
+        db.session.commit()
+
+    def _finalize(self, job_id):
+        job = db.session.get(AIGenerationJob, job_id)
+        if job is None or job.is_finished():
+            return
+        open_items = AIGenerationJobItem.query.filter(
+            AIGenerationJobItem.job_id == job_id,
+            AIGenerationJobItem.status.in_(['pending', 'running'])
+        ).count()
+        if open_items:
+            return  # Other lanes are still working
+        if job.failed_items == 0:
+            job.status = 'completed'
+        elif job.failed_items < job.total_items:
+            job.status = 'partial'
+        else:
+            job.status = 'failed'
+        job.completed_at = datetime.utcnow()
+        db.session.commit()
+
+
+# Process-wide job runner
+ai_job_runner = AIJobRunner()
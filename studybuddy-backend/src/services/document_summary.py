@@ -0,0 +1,309 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import PyPDF2
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from src.extensions import db
+from src.models.user import User
+from src.models.document import Document, DocumentSummary
+from src.services.ai_client import OPENAI_AVAILABLE, chat_completion
+from src.services.llm_scheduler import llm_scheduler, get_user_tier, estimate_tokens, AdmissionRejected
+
+# Bump when SUMMARY_PROMPTS change; older cached summaries are then served as stale
+# while a fresh one is generated in the background.
+PROMPT_VERSION = 'v1'
+
+DEFAULT_SUMMARY_MODEL = 'gpt-3.5-turbo'
+
+# Used instead of an LLM when OpenAI is not available
+EXTRACTIVE_MODEL = 'extractive'
+
+# Max characters of source text per map (page range) or reduce step
+CHUNK_MAX_CHARS = 6000
+
+# A pending summary older than this is assumed abandoned and may be reclaimed
+PENDING_TIMEOUT = timedelta(minutes=10)
+
+# Summary calls are admitted under the uploader's tier; a rejected call waits
+# the Retry-After and tries again this many times before the summary fails
+MAX_ADMISSION_ATTEMPTS = 10
+
+SUMMARY_PROMPTS = {
+    'range': "Summarize the following section of a study document in 4-6 concise bullet points. Keep key terms, definitions and formulas.",
+    'reduce': "The following are summaries of consecutive sections of one study document. Combine them into a single coherent summary of at most 3 short paragraphs, keeping the key terms."
+}
+
+
+def needs_generation(row, now=None):
+    """Whether a summary row should be (re)generated: missing, failed, or pending past PENDING_TIMEOUT"""
+    if row is None or row.status == 'failed':
+        return True
+    if row.status == 'pending':
+        return not row.updated_at or row.updated_at <= (now or datetime.utcnow()) - PENDING_TIMEOUT
+    return row.status != 'completed'
+
+
+def content_hash(text):
+    """Get the cache key hash for a piece of source text"""
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+
+def extractive_summary(text, max_sentences=4):
+    """Fallback summary: the first few sentences of the text"""
+    sentences = re.split(r'(?<=[.!?])\s+', ' '.join((text or '').split()))
+    return ' '.join(sentences[:max_sentences])[:1000]
+
+
+def get_page_texts(document):
+    """Get the document text split by page (fixed-size chunks for non-PDFs)"""
+    if document.is_pdf() and os.path.exists(document.file_path):
+        try:
+            with open(document.file_path, 'rb') as file:
+                return [page.extract_text() or '' for page in PyPDF2.PdfReader(file).pages]
+        except Exception:
+            pass
+    text = document.extracted_text or ''
+    return [text[i:i + CHUNK_MAX_CHARS] for i in range(0, len(text), CHUNK_MAX_CHARS)]
+
+
+def split_text(text, max_chars=CHUNK_MAX_CHARS):
+    """Split text into pieces of at most max_chars, breaking at a newline or space where possible"""
+    pieces = []
+    while len(text) > max_chars:
+        cut = text.rfind('\n', 0, max_chars + 1)
+        if cut < max_chars // 2:
+            cut = text.rfind(' ', 0, max_chars + 1)
+        if cut < max_chars // 2:
+            cut = max_chars
+        pieces.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def group_page_ranges(pages, max_chars=CHUNK_MAX_CHARS):
+    """Group consecutive pages into (first_page, last_page, text) ranges of at most max_chars.
+
+    A page longer than max_chars is split into several ranges of its own.
+    """
+    ranges = []
+    start, texts, size = 1, [], 0
+    for number, page_text in enumerate(pages, start=1):
+        # The newlines joining pages count towards max_chars
+        if texts and size + len(texts) + len(page_text) > max_chars:
+            ranges.append((start, number - 1, '\n'.join(texts)))
+            start, texts, size = number, [], 0
+        if len(page_text) > max_chars:
+            ranges.extend((number, number, piece) for piece in split_text(page_text, max_chars))
+            start = number + 1
+            continue
+        texts.append(page_text)
+        size += len(page_text)
+    if texts:
+        ranges.append((start, len(pages), '\n'.join(texts)))
+    return ranges
+
+
+class DocumentSummarizer:
+    """Hierarchical map-reduce summaries, generated in background threads.
+
+    Map: each page range is summarized and cached as a ``range`` row keyed by the
+    hash of its own text, so unchanged sections are reused across documents and
+    re-uploads. Reduce: range summaries are combined (recursively, if they don't
+    fit one prompt) into the ``document`` row keyed by the whole text's hash.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='doc-summary')
+        self._lock = threading.Lock()
+        self._inflight = set()
+
+    def resolve_model(self, model):
+        return model if OPENAI_AVAILABLE else EXTRACTIVE_MODEL
+
+    def get_summary(self, document, model=DEFAULT_SUMMARY_MODEL):
+        """Get (current, stale) document summary rows; either may be None"""
+        model = self.resolve_model(model)
+        doc_hash = content_hash(document.extracted_text)
+        current = DocumentSummary.query.filter_by(
+            content_hash=doc_hash,
+            model=model,
+            prompt_version=PROMPT_VERSION,
+            scope='document'
+        ).first()
+        stale = None
+        if not current or current.status != 'completed':
+            stale = DocumentSummary.query.filter(
+                DocumentSummary.content_hash == doc_hash,
+                DocumentSummary.model == model,
+                DocumentSummary.scope == 'document',
+                DocumentSummary.status == 'completed',
+                DocumentSummary.prompt_version != PROMPT_VERSION
+            ).order_by(DocumentSummary.updated_at.desc()).first()
+        return current, stale
+
+    def schedule(self, document, model=DEFAULT_SUMMARY_MODEL):
+        """Summarize a document in the background (no-op if already running here)"""
+        model = self.resolve_model(model)
+        key = (document.id, model)
+        with self._lock:
+            if key in self._inflight:
+                return
+            self._inflight.add(key)
+        app = current_app._get_current_object()
+        self._executor.submit(self._run, app, document.id, model, key)
+
+    def _run(self, app, document_id, model, key):
+        with app.app_context():
+            try:
+                document = db.session.get(Document, document_id)
+                if document and document.extracted_text:
+                    self.summarize(document, model)
+            except Exception as e:
+                app.logger.error(f"Document summary failed for {document_id}: {e}")
+            finally:
+                db.session.remove()
+                with self._lock:
+                    self._inflight.discard(key)
+
+    def _claim(self, doc_hash, model):
+        """Mark the document summary as pending; None if another worker owns it or it's done"""
+        row = DocumentSummary.query.filter_by(
+            content_hash=doc_hash,
+            model=model,
+            prompt_version=PROMPT_VERSION,
+            scope='document'
+        ).first()
+        now = datetime.utcnow()
+        if row:
+            if not needs_generation(row, now):
+                return None
+            row.status = 'pending'
+            row.updated_at = now
+            db.session.commit()
+            return row
+
+        row = DocumentSummary(
+            content_hash=doc_hash,
+            model=model,
+            prompt_version=PROMPT_VERSION,
+            scope='document',
+            status='pending'
+        )
+        db.session.add(row)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+        return row
+
+    def summarize(self, document, model):
+        """Build (or reuse) the summary for a document"""
+        row = self._claim(content_hash(document.extracted_text), model)
+        if row is None:
+            return
+
+        try:
+            uploader = db.session.get(User, document.uploader_id)
+            owner = (document.uploader_id, get_user_tier(uploader) if uploader else 'free')
+            pages = get_page_texts(document)
+            sections = []
+            for page_start, page_end, text in group_page_ranges(pages):
+                if not text.strip():
+                    continue
+                # Committed with the range row, so a long (throttled) run keeps its claim
+                row.updated_at = datetime.utcnow()
+                sections.append({
+                    'page_start': page_start,
+                    'page_end': page_end,
+                    'summary': self._summarize_range(text, model, page_start, page_end, owner)
+                })
+
+            row.summary = self._reduce([s['summary'] for s in sections], model, owner)
+            row.sections = json.dumps(sections)
+            row.page_start = 1
+            row.page_end = len(pages)
+            row.status = 'completed'
+            row.error = None
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            row.status = 'failed'
+            row.error = str(e)[:255]
+            db.session.commit()
+            raise
+
+    def _summarize_range(self, text, model, page_start, page_end, owner):
+        range_hash = content_hash(text)
+        cached = DocumentSummary.query.filter_by(
+            content_hash=range_hash,
+            model=model,
+            prompt_version=PROMPT_VERSION,
+            scope='range',
+            status='completed'
+        ).first()
+        if cached:
+            return cached.summary
+
+        summary = self._summarize_text(text, model, 'range', owner)
+        db.session.add(DocumentSummary(
+            content_hash=range_hash,
+            model=model,
+            prompt_version=PROMPT_VERSION,
+            scope='range',
+            page_start=page_start,
+            page_end=page_end,
+            status='completed',
+            summary=summary
+        ))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # Another worker cached the same section first
+        return summary
+
+    def _reduce(self, summaries, model, owner):
+        """Combine section summaries level by level until one summary remains"""
+        if not summaries:
+            return ''
+        while len(summaries) > 1:
+            groups = [text for _, _, text in group_page_ranges(summaries)]
+            if len(groups) >= len(summaries):
+                # Summaries too long to group; pair them up (splitting pairs that don't
+                # fit a prompt) so each level still shrinks, as completions are capped
+                groups = [piece for i in range(0, len(summaries), 2)
+                          for piece in split_text('\n'.join(summaries[i:i + 2]))]
+            summaries = [self._summarize_text(text, model, 'reduce', owner) for text in groups]
+        return summaries[0]
+
+    def _summarize_text(self, text, model, stage, owner):
+        """Summarize at most CHUNK_MAX_CHARS of text; ``owner`` is the (user_id, tier) charged for the call"""
+        if model == EXTRACTIVE_MODEL:
+            return extractive_summary(text)
+        messages = [
+            {"role": "system", "content": "You are StudyBuddy AI, summarizing study material for students."},
+            {"role": "user", "content": f"{SUMMARY_PROMPTS[stage]}\n\n{text}"}
+        ]
+        user_id, tier = owner
+        for attempt in range(MAX_ADMISSION_ATTEMPTS):
+            try:
+                with llm_scheduler.admit(user_id, tier, estimate_tokens(messages[1]['content'], 'summary')):
+                    content, _ = chat_completion(messages, model, task='summary', max_tokens=500)
+                return content.strip()
+            except AdmissionRejected as e:
+                # Nobody is waiting on a background summary; wait for capacity instead of failing
+                if attempt == MAX_ADMISSION_ATTEMPTS - 1:
+                    raise
+                time.sleep(e.retry_after)
+
+
+# Process-wide summarizer
+document_summarizer = DocumentSummarizer()
@@ -0,0 +1,205 @@
+import time
+import threading
+from datetime import datetime
+from bisect import bisect_left, insort
+from flask import current_app
+from sqlalchemy import func
+from src.extensions import db
+from src.models.user import User
+from src.models.study_room import StudyRoom, StudySession
+from src.services.metrics import metrics
+
+LEADERBOARD_METRICS = ['study_time', 'streak']
+LEADERBOARD_SCOPES = ['global', 'room', 'subject']
+
+# Snapshots older than this are rebuilt in the background on the next read
+REFRESH_INTERVAL_SECONDS = 300
+
+
+class Leaderboard:
+    """Scores kept sorted for O(log n) rank lookups and O(k) top-k reads"""
+
+    def __init__(self, scores=None):
+        self._scores = {user_id: score for user_id, score in (scores or {}).items() if score > 0}
+        self._keys = sorted((-score, user_id) for user_id, score in self._scores.items())  # Best first
+
+    def __len__(self):
+        return len(self._keys)
+
+    def set(self, user_id, score):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, user_id))]
+        if score > 0:
+            insort(self._keys, (-score, user_id))
+            self._scores[user_id] = score
+
+    def add(self, user_id, delta):
+        self.set(user_id, self._scores.get(user_id, 0) + delta)
+
+    def rank(self, user_id):
+        """Competition rank (ties share a rank) and score, or (None, 0) if unranked"""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None, 0
+        return bisect_left(self._keys, (-score,)) + 1, score
+
+    def top(self, k):
+        """Get [(rank, user_id, score)] for the best k users"""
+        entries = []
+        rank = 0
+        previous = None
+        for index, (negative_score, user_id) in enumerate(self._keys[:k]):
+            if negative_score != previous:
+                rank, previous = index + 1, negative_score
+            entries.append((rank, user_id, -negative_score))
+        return entries
+
+
+class LeaderboardService:
+    """Global, per-room and per-subject leaderboards held in memory.
+
+    Snapshots are rebuilt from the database every REFRESH_INTERVAL_SECONDS in a
+    background thread; in between, session ends and streak updates are applied
+    incrementally. Reads only touch memory (except the very first, which builds
+    the snapshot). Each gunicorn worker keeps its own copy, so updates handled by
+    another worker appear with the next refresh.
+    """
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL_SECONDS):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._boards = None
+        self._profiles = {}
+        self._refreshed_at = None
+        self._refreshing = False
+
+    # ---------- Reads ----------
+
+    def get(self, metric, scope='global', key=None, user_id=None, limit=10):
+        """Get the top ``limit`` entries and the user's own rank"""
+        self._ensure_fresh()
+        with self._lock:
+            board = self._boards.get((metric, scope, key))
+            entries = board.top(limit) if board else []
+            my_rank, my_score = board.rank(user_id) if board else (None, 0)
+            result = {
+                'entries': [
+                    {'rank': rank, 'score': score, 'user': self._profiles.get(uid, {'id': uid})}
+                    for rank, uid, score in entries
+                ],
+                'me': {'rank': my_rank, 'score': my_score},
+                'total_ranked': len(board) if board else 0,
+                'refreshed_at': datetime.utcfromtimestamp(self._refreshed_at).isoformat()
+            }
+        metrics.inc('leaderboard_reads_total', metric=metric, scope=scope)
+        return result
+
+    # ---------- Incremental updates ----------
+
+    def record_study(self, user, room, minutes):
+        """Apply an ended session: new study total plus room and subject minutes"""
+        if self._boards is None or minutes <= 0:
+            return
+        with self._lock:
+            self._profiles.setdefault(user.id, self._profile(user))
+            self._board('study_time', 'global').set(user.id, user.total_study_time or 0)
+            self._board('study_time', 'room', room.id).add(user.id, minutes)
+            if room.subject:
+                self._board('study_time', 'subject', room.subject.lower()).add(user.id, minutes)
+
+    def record_streak(self, user):
+        """Apply a user's updated login streak"""
+        if self._boards is None:
+            return
+        with self._lock:
+            self._profiles.setdefault(user.id, self._profile(user))
+            self._board('streak', 'global').set(user.id, user.streak_count or 0)
+
+    # ---------- Snapshots ----------
+
+    def _board(self, metric, scope, key=None):
+        return self._boards.setdefault((metric, scope, key), Leaderboard())
+
+    @staticmethod
+    def _profile(user):
+        return {
+            'id': user.id,
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'avatar_url': user.avatar_url
+        }
+
+    def _ensure_fresh(self):
+        if self._boards is None:
+            self.refresh()
+            return
+        if time.time() - self._refreshed_at < self.refresh_interval:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        app = current_app._get_current_object()
+        threading.Thread(target=self._refresh_in_app, args=(app,), name='leaderboard-refresh', daemon=True).start()
+
+    def _refresh_in_app(self, app):
+        with app.app_context():
+            try:
+                self.refresh()
+            except Exception as e:
+                app.logger.error(f"Leaderboard refresh failed: {e}")
+            finally:
+                db.session.remove()
+                with self._lock:
+                    self._refreshing = False
+
+    def refresh(self):
+        """Rebuild every leaderboard from the database and swap it in"""
+        started = time.monotonic()
+        scores = {}
+
+        def scores_for(metric, scope, key=None):
+            return scores.setdefault((metric, scope, key), {})
+
+        users = db.session.query(
+            User.id, User.username, User.first_name, User.last_name, User.avatar_url,
+            User.streak_count, User.total_study_time
+        ).filter((User.streak_count > 0) | (User.total_study_time > 0)).all()
+        profiles = {}
+        for row in users:
+            profiles[row.id] = {
+                'id': row.id,
+                'username': row.username,
+                'first_name': row.first_name,
+                'last_name': row.last_name,
+                'avatar_url': row.avatar_url
+            }
+            scores_for('streak', 'global')[row.id] = row.streak_count or 0
+            scores_for('study_time', 'global')[row.id] = row.total_study_time or 0
+
+        minutes = func.sum(StudySession.duration_minutes)
+        ended = StudySession.end_time.isnot(None)
+        for room_id, user_id, total in db.session.query(StudySession.room_id, StudySession.user_id, minutes)\
+                                                 .filter(ended)\
+                                                 .group_by(StudySession.room_id, StudySession.user_id):
+            scores_for('study_time', 'room', room_id)[user_id] = int(total or 0)
+
+        subject = func.lower(StudyRoom.subject)
+        for subject_key, user_id, total in db.session.query(subject, StudySession.user_id, minutes)\
+                                                     .join(StudyRoom, StudyRoom.id == StudySession.room_id)\
+                                                     .filter(ended, StudyRoom.subject.isnot(None), StudyRoom.subject != '')\
+                                                     .group_by(subject, StudySession.user_id):
+            scores_for('study_time', 'subject', subject_key)[user_id] = int(total or 0)
+
+        boards = {key: Leaderboard(board_scores) for key, board_scores in scores.items()}
+        with self._lock:
+            self._boards = boards
+            self._profiles = profiles
+            self._refreshed_at = time.time()
+        metrics.observe('leaderboard_refresh_seconds', time.monotonic() - started)
+
+
+# Process-wide leaderboards
+leaderboards = LeaderboardService()
@@ -0,0 +1,241 @@
+import math
+import time
+import itertools
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from flask import jsonify
+from src.services.metrics import metrics
+from src.services.model_router import TASK_PROFILES
+from src.services.resilience import start_request_deadline, remaining_budget
+
+# Per-tier scheduling policy. Limits apply per gunicorn worker, like the
+# memory:// storage used by Flask-Limiter in main.py.
+TIER_POLICIES = {
+    'premium': {
+        'weight': 4,
+        'max_concurrency': 6,
+        'per_user_concurrency': 3,
+        'tokens_per_minute': 60000
+    },
+    'free': {
+        'weight': 1,
+        'max_concurrency': 4,
+        'per_user_concurrency': 1,
+        'tokens_per_minute': 10000
+    }
+}
+
+def get_user_tier(user):
+    """Get the scheduling tier for a user"""
+    if user.has_active_premium():
+        return 'premium'
+    return 'free'
+
+
+def estimate_tokens(text, task='qa'):
+    """Rough token estimate (~4 characters per token) plus the expected completion"""
+    return len(text or '') // 4 + TASK_PROFILES.get(task, TASK_PROFILES['qa'])['completion_tokens']
+
+
+class AdmissionRejected(Exception):
+    """Raised when an LLM call cannot be admitted; maps to 429/503/504 with Retry-After"""
+
+    def __init__(self, status_code, message, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class _TokenBucket:
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, amount):
+        """Take tokens, or return the seconds until enough are available"""
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0
+        return (amount - self.tokens) / self.rate
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+
+class _Waiter:
+    def __init__(self, finish_tag, seq, user_id, tier):
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.user_id = user_id
+        self.tier = tier
+
+
+class LLMScheduler:
+    """Admission control and weighted fair queuing for upstream LLM calls.
+
+    Each call is charged against the user's token bucket (429 when exhausted),
+    then queued with a WFQ finish tag of ``cost / tier weight`` so premium users
+    drain faster without starving free users. A call only starts when the global,
+    per-tier and per-user concurrency limits allow it; a full queue or a wait past
+    ``max_wait_seconds`` is rejected with 503.
+    """
+
+    def __init__(self, max_concurrency=8, max_queue_depth=32, max_wait_seconds=15, policies=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.max_wait_seconds = max_wait_seconds
+        self.policies = policies or TIER_POLICIES
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._queue = []
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        self._buckets = {}
+        self._running = 0
+        self._running_by_tier = {}
+        self._running_by_user = {}
+
+    def _can_run(self, waiter):
+        policy = self.policies[waiter.tier]
+        return (
+            self._running < self.max_concurrency and
+            self._running_by_tier.get(waiter.tier, 0) < policy['max_concurrency'] and
+            self._running_by_user.get(waiter.user_id, 0) < policy['per_user_concurrency']
+        )
+
+    def _next_runnable(self):
+        runnable = [w for w in self._queue if self._can_run(w)]
+        return min(runnable, key=lambda w: (w.finish_tag, w.seq)) if runnable else None
+
+    def _publish(self):
+        metrics.set_gauge('llm_queue_depth', len(self._queue))
+        metrics.set_gauge('llm_running', self._running)
+        for tier in self.policies:
+            metrics.set_gauge('llm_running', self._running_by_tier.get(tier, 0), tier=tier)
+
+    def _charge(self, user_id, tier, tokens):
+        bucket = self._buckets.get(user_id)
+        if bucket is None or bucket.capacity != self.policies[tier]['tokens_per_minute']:
+            bucket = self._buckets[user_id] = _TokenBucket(self.policies[tier]['tokens_per_minute'])
+        wait = bucket.try_take(tokens)
+        if wait:
+            metrics.inc('llm_rejected_total', reason='token_budget', tier=tier)
+            raise AdmissionRejected(429, 'AI token budget exceeded. Please slow down.', wait)
+        return bucket
+
+    @contextmanager
+    def admit(self, user_id, tier, tokens, max_wait_seconds=None):
+        """Hold an LLM slot for the duration of the block"""
+        policy = self.policies[tier]
+        enqueued_at = time.monotonic()
+        max_wait = min(self.max_wait_seconds, max_wait_seconds or self.max_wait_seconds)
+        deadline = enqueued_at + max_wait
+
+        with self._cond:
+            if len(self._queue) >= self.max_queue_depth:
+                metrics.inc('llm_rejected_total', reason='queue_full', tier=tier)
+                retry_after = metrics.percentile('llm_queue_wait_seconds', 95) or 1
+                raise AdmissionRejected(503, 'AI tutor is busy. Please try again shortly.', retry_after)
+
+            bucket = self._charge(user_id, tier, tokens)
+
+            start_tag = max(self._virtual_time, self._last_finish.get(user_id, 0.0))
+            waiter = _Waiter(start_tag + tokens / 1000.0 / policy['weight'], next(self._seq), user_id, tier)
+            self._last_finish[user_id] = waiter.finish_tag
+            self._queue.append(waiter)
+            self._publish()
+
+            while self._next_runnable() is not waiter:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    bucket.refund(tokens)
+                    self._queue.remove(waiter)
+                    self._publish()
+                    self._cond.notify_all()
+                    metrics.inc('llm_rejected_total', reason='wait_timeout', tier=tier)
+                    raise AdmissionRejected(503, 'AI tutor is busy. Please try again shortly.', max_wait)
+                self._cond.wait(remaining)
+
+            self._queue.remove(waiter)
+            self._virtual_time = max(self._virtual_time, start_tag)
+            self._running += 1
+            self._running_by_tier[tier] = self._running_by_tier.get(tier, 0) + 1
+            self._running_by_user[user_id] = self._running_by_user.get(user_id, 0) + 1
+            self._publish()
+            self._cond.notify_all()  # The next waiter in line may have changed
+
+        wait_seconds = time.monotonic() - enqueued_at
+        metrics.observe('llm_queue_wait_seconds', wait_seconds)
+        metrics.observe('llm_queue_wait_seconds', wait_seconds, tier=tier)
+        metrics.inc('llm_admitted_total', tier=tier)
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._running_by_tier[tier] -= 1
+                self._running_by_user[user_id] -= 1
+                if not self._running_by_user[user_id]:
+                    del self._running_by_user[user_id]
+                if not self._queue and not self._running:
+                    # Idle: reset virtual clock so finish tags don't grow unbounded
+                    self._virtual_time = 0.0
+                    self._last_finish.clear()
+                self._publish()
+                self._cond.notify_all()
+
+    def stats(self):
+        """Get current scheduler state"""
+        with self._cond:
+            return {
+                'queue_depth': len(self._queue),
+                'running': self._running,
+                'running_by_tier': dict(self._running_by_tier),
+                'max_concurrency': self.max_concurrency,
+                'max_queue_depth': self.max_queue_depth
+            }
+
+
+# Process-wide scheduler
+llm_scheduler = LLMScheduler()
+
+
+def admit_request(user, task, text):
+    """Hold an LLM slot for one upstream call made by the current request.
+
+    Take it right around the call (inside any single-flight leader), so only
+    requests that actually go upstream are charged and queued. The queue wait
+    is bounded by half of the request budget left.
+    """
+    return llm_scheduler.admit(user.id, get_user_tier(user), estimate_tokens(text, task),
+                               max_wait_seconds=remaining_budget() / 2)
+
+
+def llm_admission(f):
+    """Decorator for routes that call the LLM through ``admit_request``.
+
+    Starts the request budget shared by queue waits and upstream calls, and
+    turns AdmissionRejected into a 429/503 response with Retry-After.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        start_request_deadline()
+        try:
+            return f(*args, **kwargs)
+        except AdmissionRejected as e:
+            response = jsonify({'error': e.message, 'retry_after': e.retry_after})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, e.status_code
+    return decorated
@@ -0,0 +1,95 @@
+import time
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from src.extensions import db
+from src.models.study_room import RoomMembership
+from src.services.metrics import metrics
+
+# How long another worker may keep serving a role after a membership change
+MEMBERSHIP_CACHE_TTL_SECONDS = 30
+
+
+class MembershipCache:
+    """Per-worker cache of active room roles keyed by (room_id, user_id).
+
+    Only active memberships are cached, so a user who just joined (in any
+    worker) is authorized immediately. Changes committed through this worker's
+    ORM session invalidate their entries on commit; changes made by other
+    workers are picked up once the entry expires.
+    """
+
+    def __init__(self, ttl=MEMBERSHIP_CACHE_TTL_SECONDS, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_role(self, room_id, user_id):
+        """Get the user's role in the room, or None if not an active member"""
+        key = (room_id, user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(key)
+                metrics.inc('membership_cache_total', outcome='hit')
+                return entry[0]
+
+        metrics.inc('membership_cache_total', outcome='miss')
+        role = db.session.query(RoomMembership.role).filter_by(
+            user_id=user_id,
+            room_id=room_id,
+            is_active=True
+        ).scalar()
+
+        with self._lock:
+            if role is None:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = (role, now + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return role
+
+    def invalidate(self, room_id, user_id):
+        with self._lock:
+            self._entries.pop((room_id, user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Process-wide membership cache
+membership_cache = MembershipCache()
+
+
+# ---------- Invalidate memberships once their transaction commits ----------
+
+def queue_membership_change(session, room_id, user_id):
+    """Invalidate a membership when the session commits; for changes made with Core UPDATEs"""
+    session.info.setdefault('changed_memberships', set()).add((room_id, user_id))
+
+
+def _queue_membership_change(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        queue_membership_change(session, target.room_id, target.user_id)
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(RoomMembership, _event_name, _queue_membership_change)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_memberships(session):
+    for room_id, user_id in session.info.pop('changed_memberships', ()):
+        membership_cache.invalidate(room_id, user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_memberships(session):
+    session.info.pop('changed_memberships', None)
@@ -0,0 +1,149 @@
+import html
+from flask import current_app
+from sqlalchemy import text
+from src.extensions import db
+
+# Control characters used as highlight markers, swapped for <mark> after escaping
+_HIGHLIGHT_START = '\x02'
+_HIGHLIGHT_END = '\x03'
+
+SQLITE_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS ai_message_fts USING fts5(
+        content,
+        user_id UNINDEXED,
+        conversation_id UNINDEXED,
+        tokenize = 'porter unicode61'
+    )
+    """,
+    # Keep the index in step with ai_message inserts, edits and deletes
+    """
+    CREATE TRIGGER IF NOT EXISTS ai_message_fts_insert AFTER INSERT ON ai_message BEGIN
+        INSERT INTO ai_message_fts(rowid, content, user_id, conversation_id)
+        SELECT new.id, new.content, c.user_id, new.conversation_id
+        FROM ai_conversation c WHERE c.id = new.conversation_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ai_message_fts_update AFTER UPDATE OF content ON ai_message BEGIN
+        UPDATE ai_message_fts SET content = new.content WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ai_message_fts_delete AFTER DELETE ON ai_message BEGIN
+        DELETE FROM ai_message_fts WHERE rowid = old.id;
+    END
+    """
+]
+
+POSTGRES_FTS_DDL = [
+    # Expression index; PostgreSQL maintains it on every insert
+    """
+    CREATE INDEX IF NOT EXISTS ix_ai_message_content_fts
+    ON ai_message USING GIN (to_tsvector('english', content))
+    """
+]
+
+
+def init_message_search():
+    """Create the full-text index for AI tutor messages and backfill existing rows"""
+    dialect = db.engine.dialect.name
+    try:
+        with db.engine.begin() as conn:
+            if dialect == 'sqlite':
+                is_new = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'ai_message_fts'"
+                )).first() is None
+                for statement in SQLITE_FTS_DDL:
+                    conn.execute(text(statement))
+                if is_new:
+                    conn.execute(text("""
+                        INSERT INTO ai_message_fts(rowid, content, user_id, conversation_id)
+                        SELECT m.id, m.content, c.user_id, m.conversation_id
+                        FROM ai_message m JOIN ai_conversation c ON c.id = m.conversation_id
+                    """))
+            elif dialect == 'postgresql':
+                for statement in POSTGRES_FTS_DDL:
+                    conn.execute(text(statement))
+    except Exception as e:
+        current_app.logger.error(f"Message search index setup failed: {e}")
+
+
+def _fts5_query(query):
+    """Turn free text into an FTS5 query of quoted terms (all must match)"""
+    terms = [term.replace('"', '""') for term in query.split()]
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def _render_snippet(snippet):
+    """HTML-escape a snippet and turn highlight markers into <mark> tags"""
+    escaped = html.escape(snippet or '')
+    return escaped.replace(_HIGHLIGHT_START, '<mark>').replace(_HIGHLIGHT_END, '</mark>')
+
+
+def search_messages(user_id, query, limit=20, offset=0):
+    """Search a user's AI tutor messages, best matches first"""
+    dialect = db.engine.dialect.name
+    params = {
+        'user_id': user_id,
+        'limit': limit,
+        'offset': offset,
+        'hl_start': _HIGHLIGHT_START,
+        'hl_end': _HIGHLIGHT_END
+    }
+
+    if dialect == 'sqlite':
+        params['query'] = _fts5_query(query)
+        sql = text("""
+            SELECT f.rowid AS message_id, f.conversation_id, c.title AS conversation_title,
+                   m.role, m.created_at,
+                   snippet(ai_message_fts, 0, :hl_start, :hl_end, '...', 16) AS snippet,
+                   bm25(ai_message_fts) AS rank
+            FROM ai_message_fts f
+            JOIN ai_message m ON m.id = f.rowid
+            JOIN ai_conversation c ON c.id = f.conversation_id
+            WHERE ai_message_fts MATCH :query AND f.user_id = :user_id
+            ORDER BY rank
+            LIMIT :limit OFFSET :offset
+        """)
+    elif dialect == 'postgresql':
+        params['query'] = query
+        params['headline_options'] = f"StartSel={_HIGHLIGHT_START}, StopSel={_HIGHLIGHT_END}, MaxWords=30"
+        sql = text("""
+            SELECT m.id AS message_id, m.conversation_id, c.title AS conversation_title,
+                   m.role, m.created_at,
+                   ts_headline('english', m.content, plainto_tsquery('english', :query),
+                               :headline_options) AS snippet,
+                   -ts_rank(to_tsvector('english', m.content), plainto_tsquery('english', :query)) AS rank
+            FROM ai_message m
+            JOIN ai_conversation c ON c.id = m.conversation_id
+            WHERE c.user_id = :user_id
+              AND to_tsvector('english', m.content) @@ plainto_tsquery('english', :query)
+            ORDER BY rank
+            LIMIT :limit OFFSET :offset
+        """)
+    else:
+        params['pattern'] = f"%{query}%"
+        sql = text("""
+            SELECT m.id AS message_id, m.conversation_id, c.title AS conversation_title,
+                   m.role, m.created_at, substr(m.content, 1, 200) AS snippet, 0 AS rank
+            FROM ai_message m
+            JOIN ai_conversation c ON c.id = m.conversation_id
+            WHERE c.user_id = :user_id AND m.content LIKE :pattern
+            ORDER BY m.created_at DESC
+            LIMIT :limit OFFSET :offset
+        """)
+
+    rows = db.session.execute(sql, params).mappings().all()
+    return [
+        {
+            'message_id': row['message_id'],
+            'conversation_id': row['conversation_id'],
+            'conversation_title': row['conversation_title'],
+            'role': row['role'],
+            'snippet': _render_snippet(row['snippet']),
+            'rank': round(-float(row['rank'] or 0), 4),
+            'created_at': row['created_at'].isoformat() if hasattr(row['created_at'], 'isoformat') else row['created_at']
+        }
+        for row in rows
+    ]
@@ -0,0 +1,79 @@
+import threading
+from collections import deque
+
+
+def _metric_key(name, labels):
+    if not labels:
+        return name
+    label_str = ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+class MetricsRegistry:
+    """Minimal in-process metrics (counters, gauges, rolling histograms).
+
+    Each gunicorn worker keeps its own registry; the snapshot is exposed on
+    ``/api/metrics`` and tagged with the worker pid by the caller.
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to an absolute value"""
+        with self._lock:
+            self._gauges[_metric_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Record a sample in a rolling-window histogram"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {'samples': deque(maxlen=self.window), 'count': 0, 'sum': 0.0}
+            hist['samples'].append(value)
+            hist['count'] += 1
+            hist['sum'] += value
+
+    def percentile(self, name, q, **labels):
+        """Get the q-th percentile (0-100) of the rolling window, or None if empty"""
+        with self._lock:
+            hist = self._histograms.get(_metric_key(name, labels))
+            samples = sorted(hist['samples']) if hist else []
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(q / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def snapshot(self):
+        """Get all metrics as a JSON-serializable dictionary"""
+        with self._lock:
+            histograms = {}
+            for key, hist in self._histograms.items():
+                samples = sorted(hist['samples'])
+                histograms[key] = {
+                    'count': hist['count'],
+                    'sum': round(hist['sum'], 6),
+                    'p50': samples[len(samples) // 2] if samples else None,
+                    'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))] if samples else None,
+                    'max': samples[-1] if samples else None
+                }
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'histograms': histograms
+            }
+
+
+# Process-wide registry
+metrics = MetricsRegistry()
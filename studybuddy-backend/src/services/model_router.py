@@ -0,0 +1,144 @@
+import time
+from src.services.metrics import metrics
+from src.services.resilience import (
+    llm_breakers, llm_retry_budget, call_timeout, backoff,
+    is_timeout_error, is_retryable_error, CircuitOpenError
+)
+
+AUTO_MODEL = 'auto'
+
+COST_RANK = {'low': 0, 'medium': 1, 'high': 2}
+
+# Assumed latency (seconds) for models without measurements yet
+PRIOR_LATENCY = {'low': 2.0, 'medium': 4.0, 'high': 8.0}
+
+# How much each task cares about cost vs. latency, and how much room to leave for the reply
+TASK_PROFILES = {
+    'qa': {'cost_weight': 2.0, 'latency_weight': 1.0, 'completion_tokens': 500},
+    'summary': {'cost_weight': 1.0, 'latency_weight': 0.5, 'completion_tokens': 800},
+    'flashcard': {'cost_weight': 1.0, 'latency_weight': 0.5, 'completion_tokens': 2000},
+    'practice_test': {'cost_weight': 0.5, 'latency_weight': 0.5, 'completion_tokens': 3000}
+}
+
+
+# Tokens taken by the instructions wrapped around source text in a prompt
+PROMPT_OVERHEAD_TOKENS = 200
+
+
+def estimate_prompt_tokens(messages):
+    """Rough token count of a chat prompt (~4 characters per token)"""
+    return sum(len(m.get('content') or '') for m in messages) // 4
+
+
+class ModelRouter:
+    """Pick a model for ``auto`` requests and fail over on timeouts.
+
+    Candidates must fit the prompt plus the task's expected completion in their
+    context window; they are then ranked by cost tier and the rolling p50/p95
+    latency recorded in ``llm_latency_seconds{model=...}``; models whose circuit
+    breaker is open are moved to the back.
+    """
+
+    def __init__(self, models, timeout_seconds=20, attempts_per_model=2):
+        self.models = models
+        self.timeout_seconds = timeout_seconds
+        self.attempts_per_model = attempts_per_model
+
+    def expected_latency(self, model):
+        """Blend of rolling p50 and p95 latency, falling back to the cost-tier prior"""
+        p50 = metrics.percentile('llm_latency_seconds', 50, model=model)
+        p95 = metrics.percentile('llm_latency_seconds', 95, model=model)
+        if p50 is None:
+            return PRIOR_LATENCY.get(self.models[model].get('cost_tier'), 4.0)
+        return (p50 + p95) / 2
+
+    def rank(self, task, prompt_tokens):
+        """Get candidate models for a task, best first"""
+        profile = TASK_PROFILES.get(task, TASK_PROFILES['qa'])
+        needed = prompt_tokens + profile['completion_tokens']
+        fitting = [m for m, info in self.models.items() if info.get('max_tokens', 0) >= needed]
+        if not fitting:
+            # Nothing fits; the largest context window is the best effort
+            fitting = [max(self.models, key=lambda m: self.models[m].get('max_tokens', 0))]
+
+        def score(model):
+            cost = COST_RANK.get(self.models[model].get('cost_tier'), 1)
+            return cost * profile['cost_weight'] + self.expected_latency(model) * profile['latency_weight']
+
+        return sorted(fitting, key=lambda m: (llm_breakers.get(m).to_dict()['state'] == 'open', score(m)))
+
+    def max_prompt_chars(self, model, task):
+        """Most characters of source text a model's context fits next to the task's reply.
+
+        ``auto`` can route to the largest context window, so it is sized for that.
+        """
+        if model == AUTO_MODEL:
+            context = max(info.get('max_tokens', 0) for info in self.models.values())
+        else:
+            context = self.models.get(model, {}).get('max_tokens', 4096)
+        completion = TASK_PROFILES.get(task, TASK_PROFILES['qa'])['completion_tokens']
+        return max(0, context - completion - PROMPT_OVERHEAD_TOKENS) * 4
+
+    def record(self, model, seconds, outcome='ok'):
+        """Record a call outcome for latency-based ranking"""
+        metrics.observe('llm_latency_seconds', seconds, model=model)
+        metrics.inc('llm_calls_total', model=model, outcome=outcome)
+
+    def call(self, model, task, messages, fn):
+        """Call ``fn(model, timeout)`` with breakers, deadlines and budgeted retries.
+
+        Explicit models get up to ``attempts_per_model`` tries; ``auto`` instead fails
+        over to the next ranked candidate, skipping models whose breaker is open.
+        Returns ``(result, model_used)``.
+        """
+        if model == AUTO_MODEL:
+            candidates = self.rank(task, estimate_prompt_tokens(messages))
+            attempts_per_model = 1
+        else:
+            candidates = [model]
+            attempts_per_model = self.attempts_per_model
+
+        llm_retry_budget.record_request()
+        attempts = 0
+        last_error = None
+
+        for index, candidate in enumerate(candidates):
+            breaker = llm_breakers.get(candidate)
+            for _ in range(attempts_per_model):
+                if attempts:
+                    if not llm_retry_budget.try_spend():
+                        raise last_error
+                    backoff(attempts)
+                timeout = call_timeout(self.timeout_seconds)
+                if not breaker.allow():
+                    last_error = CircuitOpenError(f"Circuit open for {candidate}")
+                    break
+                attempts += 1
+
+                started = time.monotonic()
+                try:
+                    result = fn(candidate, timeout)
+                except Exception as e:
+                    elapsed = time.monotonic() - started
+                    if not is_retryable_error(e):
+                        # The provider answered; this request itself is bad
+                        breaker.record_success()
+                        metrics.inc('llm_calls_total', model=candidate, outcome='error')
+                        raise
+                    breaker.record_failure()
+                    if is_timeout_error(e):
+                        # Count the full timeout so slow models drop in the ranking
+                        self.record(candidate, max(elapsed, timeout), 'timeout')
+                    else:
+                        metrics.inc('llm_calls_total', model=candidate, outcome='error')
+                    last_error = e
+                    continue
+
+                breaker.record_success()
+                self.record(candidate, time.monotonic() - started)
+                return result, candidate
+
+            if index < len(candidates) - 1:
+                metrics.inc('llm_failover_total', model=candidate)
+
+        raise last_error
@@ -0,0 +1,212 @@
+import time
+import atexit
+import threading
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import update, bindparam
+from src.extensions import db
+from src.models.study_room import RoomMembership
+from src.services.metrics import metrics
+from src.services.redis_client import get_redis
+from src.services.room_events import publish_room_message
+
+# A member counts as online for this long after their last heartbeat
+PRESENCE_TTL_SECONDS = 300
+
+# How often buffered heartbeats are written to RoomMembership.last_seen
+FLUSH_INTERVAL_SECONDS = 30
+
+
+class LocalPresenceBackend:
+    """In-process heartbeat store; each gunicorn worker only sees its own heartbeats"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}  # room_id -> {user_id: timestamp}
+        self._dirty = {}  # (room_id, user_id) -> timestamp not yet flushed
+
+    def heartbeat(self, room_id, user_id, timestamp):
+        with self._lock:
+            self._rooms.setdefault(room_id, {})[user_id] = timestamp
+            self._dirty[(room_id, user_id)] = timestamp
+
+    def online(self, room_id, since):
+        with self._lock:
+            room = self._rooms.get(room_id, {})
+            expired = [user_id for user_id, ts in room.items() if ts < since]
+            for user_id in expired:
+                del room[user_id]
+            return dict(room)
+
+    def remove(self, room_id, user_id):
+        with self._lock:
+            self._rooms.get(room_id, {}).pop(user_id, None)
+
+    def drain_dirty(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            return dirty
+
+    def restore_dirty(self, entries):
+        with self._lock:
+            for key, ts in entries.items():
+                self._dirty[key] = max(ts, self._dirty.get(key, 0))
+
+
+class RedisPresenceBackend:
+    """Heartbeats in Redis sorted sets, shared by all workers"""
+
+    DIRTY_KEY = 'presence:dirty'
+
+    def __init__(self, client, ttl=PRESENCE_TTL_SECONDS):
+        self.client = client
+        self.ttl = ttl
+
+    def _room_key(self, room_id):
+        return f'presence:room:{room_id}'
+
+    def heartbeat(self, room_id, user_id, timestamp):
+        pipe = self.client.pipeline()
+        pipe.zadd(self._room_key(room_id), {user_id: timestamp})
+        pipe.expire(self._room_key(room_id), self.ttl * 2)
+        pipe.hset(self.DIRTY_KEY, f'{room_id}:{user_id}', timestamp)
+        pipe.execute()
+
+    def online(self, room_id, since):
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self._room_key(room_id), '-inf', f'({since}')
+        pipe.zrangebyscore(self._room_key(room_id), since, '+inf', withscores=True)
+        _, members = pipe.execute()
+        return {int(user_id): ts for user_id, ts in members}
+
+    def remove(self, room_id, user_id):
+        self.client.zrem(self._room_key(room_id), user_id)
+
+    def drain_dirty(self):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(self.DIRTY_KEY)
+        pipe.delete(self.DIRTY_KEY)
+        entries, _ = pipe.execute()
+        dirty = {}
+        for key, ts in entries.items():
+            room_id, user_id = key.split(':')
+            dirty[(int(room_id), int(user_id))] = float(ts)
+        return dirty
+
+    def restore_dirty(self, entries):
+        if entries:
+            self.client.hset(self.DIRTY_KEY, mapping={
+                f'{room_id}:{user_id}': ts for (room_id, user_id), ts in entries.items()
+            })
+
+
+class PresenceService:
+    """Room presence answered from memory, with last_seen written in batches.
+
+    Heartbeats only touch the backend; a background thread flushes the latest
+    heartbeat per membership to ``RoomMembership.last_seen`` every
+    ``flush_interval`` seconds in one executemany UPDATE. With the local backend a
+    worker that hasn't seen a user's heartbeat falls back to the flushed
+    ``last_seen``, which lags by at most one flush interval.
+    """
+
+    def __init__(self, backend, ttl=PRESENCE_TTL_SECONDS, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._app = None
+        self._flusher = None
+        self._lock = threading.Lock()
+
+    def heartbeat(self, room_id, user_id):
+        """Record that a member is active in a room"""
+        timestamp = time.time()
+        self.backend.heartbeat(room_id, user_id, timestamp)
+        metrics.inc('presence_heartbeats_total')
+        # Room streams turn these into online/offline deltas for their clients
+        publish_room_message(room_id, {'type': 'presence', 'user_id': user_id, 'online': True, 'at': timestamp})
+        self._ensure_flusher()
+
+    def remove(self, room_id, user_id):
+        """Forget a member's presence (left or kicked)"""
+        self.backend.remove(room_id, user_id)
+        publish_room_message(room_id, {'type': 'presence', 'user_id': user_id, 'online': False, 'at': time.time()})
+
+    def online_members(self, room_id):
+        """Get {user_id: last heartbeat datetime} for members online in a room"""
+        since = time.time() - self.ttl
+        return {
+            user_id: datetime.utcfromtimestamp(ts)
+            for user_id, ts in self.backend.online(room_id, since).items()
+        }
+
+    def member_status(self, membership, online=None):
+        """Get (last_seen, is_online) for a membership, preferring in-memory heartbeats"""
+        if online is None:
+            online = self.online_members(membership.room_id)
+        last_seen = online.get(membership.user_id)
+        if membership.last_seen and (last_seen is None or membership.last_seen > last_seen):
+            last_seen = membership.last_seen
+        is_online = last_seen is not None and (datetime.utcnow() - last_seen).total_seconds() < self.ttl
+        return last_seen, is_online
+
+    def flush(self):
+        """Write buffered heartbeats to RoomMembership.last_seen unless newer; returns heartbeats flushed"""
+        dirty = self.backend.drain_dirty()
+        if not dirty:
+            return 0
+        params = [
+            {'b_room_id': room_id, 'b_user_id': user_id, 'b_last_seen': datetime.utcfromtimestamp(ts)}
+            for (room_id, user_id), ts in dirty.items()
+        ]
+        table = RoomMembership.__table__
+        try:
+            db.session.execute(
+                update(table)
+                .where(table.c.room_id == bindparam('b_room_id'), table.c.user_id == bindparam('b_user_id'),
+                       # Another worker may already have written a newer heartbeat
+                       table.c.last_seen.is_(None) | (table.c.last_seen < bindparam('b_last_seen')))
+                .values(last_seen=bindparam('b_last_seen')),
+                params
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.backend.restore_dirty(dirty)
+            raise
+        metrics.inc('presence_flushed_rows_total', len(params))
+        return len(params)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._app = current_app._get_current_object()
+            self._flusher = threading.Thread(target=self._flush_loop, name='presence-flush', daemon=True)
+            self._flusher.start()
+            atexit.register(self._flush_in_app)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self._flush_in_app()
+
+    def _flush_in_app(self):
+        with self._app.app_context():
+            try:
+                self.flush()
+            except Exception as e:
+                self._app.logger.error(f"Presence flush failed: {e}")
+            finally:
+                db.session.remove()
+
+
+def _create_backend():
+    client = get_redis()
+    return RedisPresenceBackend(client) if client is not None else LocalPresenceBackend()
+
+
+# Process-wide presence service
+presence = PresenceService(_create_backend())
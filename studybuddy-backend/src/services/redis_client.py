@@ -0,0 +1,25 @@
+import os
+import threading
+
+# Optional Redis for state shared across gunicorn workers; in-process stand-ins are used without it
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_redis():
+    """Get the shared Redis client, or None when Redis is not configured"""
+    global _client
+    if not (REDIS_AVAILABLE and REDIS_URL):
+        return None
+    with _client_lock:
+        if _client is None:
+            _client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+        return _client
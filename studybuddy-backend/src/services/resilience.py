@@ -0,0 +1,201 @@
+import os
+import time
+import random
+import threading
+from flask import g, has_request_context
+from src.services.metrics import metrics
+
+# Total time an LLM-backed request may spend upstream; kept under gunicorn's 30s worker timeout
+REQUEST_BUDGET_SECONDS = float(os.environ.get('LLM_REQUEST_BUDGET_SECONDS', 25))
+
+# Don't start an upstream call with less time than this left
+MIN_CALL_SECONDS = 1.0
+
+RETRYABLE_ERROR_NAMES = {
+    'RateLimitError', 'ServiceUnavailableError', 'APIConnectionError',
+    'InternalServerError', 'TryAgain'
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while a circuit breaker is open"""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request budget has no room left for another upstream call"""
+
+
+def is_timeout_error(error):
+    """Check whether an upstream error was a timeout"""
+    return isinstance(error, TimeoutError) or 'timeout' in type(error).__name__.lower()
+
+
+def is_retryable_error(error):
+    """Check whether an upstream error is transient (timeouts, rate limits, 5xx, connection)"""
+    return is_timeout_error(error) or type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+# ---------- Deadlines ----------
+
+def start_request_deadline(budget_seconds=None):
+    """Start the upstream budget for the current request"""
+    g.llm_deadline = time.monotonic() + (budget_seconds or REQUEST_BUDGET_SECONDS)
+
+
+def remaining_budget():
+    """Get the seconds left in the current request's budget (full budget outside requests)"""
+    if has_request_context() and 'llm_deadline' in g:
+        return g.llm_deadline - time.monotonic()
+    return REQUEST_BUDGET_SECONDS
+
+
+def call_timeout(default_timeout):
+    """Get the timeout for the next upstream call, bounded by the remaining budget"""
+    remaining = remaining_budget()
+    if remaining < MIN_CALL_SECONDS:
+        metrics.inc('llm_deadline_exceeded_total')
+        raise DeadlineExceeded('Request budget exhausted')
+    return min(default_timeout, remaining)
+
+
+def backoff(attempt, base=0.25, cap=2.0):
+    """Sleep with full jitter before a retry, never past the request budget"""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    delay = min(delay, max(0, remaining_budget() - MIN_CALL_SECONDS))
+    if delay > 0:
+        time.sleep(delay)
+
+
+# ---------- Circuit breaker ----------
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    closed -> open after ``failure_threshold`` consecutive failures; open fails fast
+    for ``reset_timeout`` seconds, then half_open lets a single probe through whose
+    outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def allow(self):
+        """Check whether a call may go upstream now"""
+        with self._lock:
+            if self._state == 'open':
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    metrics.inc('llm_circuit_rejected_total', breaker=self.name)
+                    return False
+                self._state = 'half_open'
+                self._probe_in_flight = False
+            if self._state == 'half_open':
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = 'closed'
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == 'half_open' or self._failures >= self.failure_threshold:
+                if self._state != 'open':
+                    metrics.inc('llm_circuit_opened_total', breaker=self.name)
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def to_dict(self):
+        with self._lock:
+            retry_in = None
+            if self._state == 'open':
+                retry_in = max(0, round(self.reset_timeout - (time.monotonic() - self._opened_at), 1))
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'retry_in_seconds': retry_in
+            }
+
+
+class CircuitBreakerRegistry:
+    """Lazily created breakers, one per upstream model"""
+
+    def __init__(self, **breaker_options):
+        self.breaker_options = breaker_options
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(name, **self.breaker_options)
+            return self._breakers[name]
+
+    def snapshot(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {b.name: b.to_dict() for b in breakers}
+
+
+# ---------- Retry budget ----------
+
+class RetryBudget:
+    """Cap retries to a fraction of recent requests.
+
+    Every first attempt deposits ``ratio`` tokens and every retry withdraws one, so
+    retries can add at most ~``ratio`` extra load during an outage.
+    At low traffic a trickle of ``min_per_second`` refills the budget, but only up
+    to a small burst of ``min_tokens``; beyond that retries must be earned by requests.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=0.05, min_tokens=2, max_tokens=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._tokens = float(min_tokens)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self._tokens < self.min_tokens:
+            self._tokens = min(self.min_tokens, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_request(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self):
+        """Take one retry token if available"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+        metrics.inc('llm_retry_budget_exhausted_total')
+        return False
+
+    def to_dict(self):
+        with self._lock:
+            self._refill()
+            return {'available_retries': round(self._tokens, 2), 'ratio': self.ratio}
+
+
+# Process-wide state for the LLM provider
+llm_breakers = CircuitBreakerRegistry(failure_threshold=5, reset_timeout=30)
+llm_retry_budget = RetryBudget()
@@ -0,0 +1,97 @@
+from flask import current_app
+from sqlalchemy import inspect, text, update, select, func
+from sqlalchemy.orm.attributes import set_committed_value
+from src.extensions import db
+from src.models.study_room import StudyRoom, RoomMembership
+from src.services.membership_cache import queue_membership_change
+
+
+def ensure_member_count_column():
+    """Add study_room.active_member_count to databases created before it existed"""
+    columns = {column['name'] for column in inspect(db.engine).get_columns('study_room')}
+    if 'active_member_count' in columns:
+        return
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "ALTER TABLE study_room ADD COLUMN active_member_count INTEGER NOT NULL DEFAULT 0"
+        ))
+    repaired = reconcile_member_counts()
+    current_app.logger.info(f"Added study_room.active_member_count; backfilled {len(repaired)} rooms")
+
+
+def claim_seat(room_id):
+    """Take a seat in a room; False if the room is full or inactive.
+
+    The conditional UPDATE is the admission gate: it is atomic, so concurrent
+    joins can never push the count past max_participants. Call inside the
+    transaction that activates the membership.
+    """
+    result = db.session.execute(
+        update(StudyRoom)
+        .where(
+            StudyRoom.id == room_id,
+            StudyRoom.is_active == True,
+            StudyRoom.active_member_count < StudyRoom.max_participants
+        )
+        .values(active_member_count=StudyRoom.active_member_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def release_seat(room_id):
+    """Give back a seat when a membership is deactivated"""
+    db.session.execute(
+        update(StudyRoom)
+        .where(StudyRoom.id == room_id, StudyRoom.active_member_count > 0)
+        .values(active_member_count=StudyRoom.active_member_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def set_membership_active(membership, active, **values):
+    """Activate or deactivate a membership; False if it already was.
+
+    The UPDATE is conditional on the old state, so of two racing joins,
+    leaves or kicks only one changes the row; claim or release the seat only
+    when this returns True. ``values`` are written along with it.
+    """
+    result = db.session.execute(
+        update(RoomMembership)
+        .where(RoomMembership.id == membership.id, RoomMembership.is_active == (not active))
+        .values(is_active=active, **values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    for key, value in dict(values, is_active=active).items():
+        set_committed_value(membership, key, value)
+    queue_membership_change(db.session, membership.room_id, membership.user_id)
+    return True
+
+
+def reconcile_member_counts(room_id=None):
+    """Reset active_member_count from the memberships table where it drifted.
+
+    Returns a list of (room_id, old_count, new_count) for the rooms repaired.
+    """
+    actual = select(func.count(RoomMembership.id)).where(
+        RoomMembership.room_id == StudyRoom.id,
+        RoomMembership.is_active == True
+    ).scalar_subquery()
+
+    query = db.session.query(StudyRoom.id, StudyRoom.active_member_count, actual)\
+                      .filter(StudyRoom.active_member_count.is_distinct_from(actual))
+    if room_id is not None:
+        query = query.filter(StudyRoom.id == room_id)
+    drifted = query.all()
+
+    for drifted_id, _, count in drifted:
+        db.session.execute(
+            update(StudyRoom)
+            .where(StudyRoom.id == drifted_id)
+            .values(active_member_count=count)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return [(drifted_id, old, new) for drifted_id, old, new in drifted]
@@ -0,0 +1,258 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from sqlalchemy import event, func, or_, and_, select, update, null
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from src.extensions import db
+from src.models.cache import CacheVersion
+from src.models.study_room import StudyRoom, RoomMembership
+from src.services.metrics import metrics
+from src.utils.signed_urls import url_epoch
+
+DIRECTORY_SCOPES = ['all', 'public', 'owned', 'member']
+
+# CacheVersion row bumped by every change that can alter the directory
+DIRECTORY_CACHE_NAME = 'room_directory'
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+def query_room_directory(user_id, scope='all', subject=None, has_free_seats=False,
+                         limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """Get one page of the room directory in a single query.
+
+    Rooms are returned newest first; ``cursor`` is the id of the last room on the
+    previous page and ``limit=None`` returns every matching room. Returns ``(rooms, next_cursor)`` where each room is a dict from
+    ``StudyRoom.to_dict`` plus ``my_role``. With ``user_id=None`` only public rooms
+    are returned, without ``my_role``, so the result can be shared between users.
+    """
+    mine = aliased(RoomMembership)
+
+    if user_id is None:
+        scope = 'public'
+        query = db.session.query(StudyRoom, null())
+    else:
+        query = db.session.query(StudyRoom, mine.role)\
+            .outerjoin(mine, and_(
+                mine.room_id == StudyRoom.id,
+                mine.user_id == user_id,
+                mine.is_active == True
+            ))
+    query = query.filter(StudyRoom.is_active == True)
+
+    if scope == 'public':
+        query = query.filter(StudyRoom.is_private == False)
+    elif scope == 'owned':
+        query = query.filter(StudyRoom.owner_id == user_id)
+    elif scope == 'member':
+        query = query.filter(mine.id.isnot(None))
+    elif scope == 'personal':
+        query = query.filter(or_(StudyRoom.owner_id == user_id, mine.id.isnot(None)))
+    else:
+        query = query.filter(or_(
+            StudyRoom.is_private == False,
+            StudyRoom.owner_id == user_id,
+            mine.id.isnot(None)
+        ))
+
+    if subject:
+        query = query.filter(func.lower(StudyRoom.subject) == subject.lower())
+    if has_free_seats:
+        query = query.filter(StudyRoom.active_member_count < StudyRoom.max_participants)
+    if cursor:
+        query = query.filter(StudyRoom.id < cursor)
+
+    query = query.order_by(StudyRoom.id.desc())
+    if limit is None:
+        rows, has_more = query.all(), False
+    else:
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+    rooms = []
+    for room, my_role in rows:
+        room_data = room.to_dict()
+        if user_id is not None:
+            room_data['my_role'] = my_role
+        rooms.append(room_data)
+    next_cursor = rows[-1][0].id if has_more else None
+    return rooms, next_cursor
+
+
+# ---------- Public directory cache ----------
+
+def get_directory_version():
+    """Read the current directory version (one primary-key lookup)"""
+    version = db.session.execute(
+        select(CacheVersion.version).where(CacheVersion.name == DIRECTORY_CACHE_NAME)
+    ).scalar()
+    if version is not None:
+        return version
+    db.session.add(CacheVersion(name=DIRECTORY_CACHE_NAME, version=1))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # Another worker created it first
+    return get_directory_version()
+
+
+def bump_directory_version():
+    """Invalidate cached directory pages; call before committing the room change"""
+    result = db.session.execute(
+        update(CacheVersion)
+        .where(CacheVersion.name == DIRECTORY_CACHE_NAME)
+        .values(version=CacheVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        db.session.add(CacheVersion(name=DIRECTORY_CACHE_NAME, version=2))
+
+
+def directory_etag(version, user_id, *params):
+    """ETag for a user's directory response at a directory version (and thumbnail URL signing day)"""
+    raw = ':'.join(str(p) for p in (version, url_epoch(), user_id) + params)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class PublicDirectoryCache:
+    """Per-worker cache of public directory pages as pre-serialized JSON.
+
+    Entries are keyed by the shared directory version, so a bump in any worker
+    makes every worker miss and rebuild; older versions are dropped as soon as a
+    newer one is seen.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries = OrderedDict()
+
+    def get_page(self, version, subject=None, has_free_seats=False, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """Get ``(rooms_json, next_cursor)``; rooms_json is the comma-joined room objects"""
+        # Pages embed signed thumbnail URLs, so they turn over with the signing day
+        key = ((subject or '').lower(), bool(has_free_seats), limit, cursor, url_epoch())
+        with self._lock:
+            if self._version == version and key in self._entries:
+                self._entries.move_to_end(key)
+                metrics.inc('room_directory_cache_total', outcome='hit')
+                return self._entries[key]
+
+        metrics.inc('room_directory_cache_total', outcome='miss')
+        rooms, next_cursor = query_room_directory(
+            None, subject=subject, has_free_seats=has_free_seats, limit=limit, cursor=cursor
+        )
+        page = (b','.join(json.dumps(room).encode('utf-8') for room in rooms), next_cursor)
+
+        with self._lock:
+            if self._version is None or version > self._version:
+                self._version = version
+                self._entries.clear()
+            if version == self._version:
+                self._entries[key] = page
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return page
+
+
+# Process-wide public directory cache
+public_directory_cache = PublicDirectoryCache()
+
+
+# ---------- Benchmark ----------
+
+class QueryCounter:
+    """Count SQL statements executed on an engine while active"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def _legacy_directory(user_id):
+    """The previous three-query implementation, kept only for comparison"""
+    public_rooms = StudyRoom.query.filter_by(is_private=False, is_active=True).all()
+    owned_rooms = StudyRoom.query.filter_by(owner_id=user_id, is_active=True).all()
+    member_rooms = db.session.query(StudyRoom).join(RoomMembership).filter(
+        RoomMembership.user_id == user_id,
+        RoomMembership.is_active == True,
+        StudyRoom.is_active == True
+    ).all()
+    all_rooms = list({room.id: room for room in (public_rooms + owned_rooms + member_rooms)}.values())
+    rooms = []
+    for room in all_rooms:
+        room_data = room.to_dict()
+        # Counted by loading memberships, as before active_member_count existed
+        room_data['member_count'] = len([m for m in room.memberships if m.is_active])
+        rooms.append(room_data)
+    return rooms
+
+
+def benchmark_directory(sizes=(10, 100, 1000), members_per_room=3):
+    """Seed rooms inside a transaction that is rolled back, and compare query counts.
+
+    Returns one result dict per size with the statement count and time of the
+    legacy and single-query directory. Nothing is committed.
+    """
+    from src.models.user import User
+
+    results = []
+    for size in sizes:
+        try:
+            users = [
+                User(username=f'bench_{size}_{i}', email=f'bench_{size}_{i}@example.invalid',
+                     password_hash='x', first_name='Bench', last_name=str(i))
+                for i in range(members_per_room + 1)
+            ]
+            db.session.add_all(users)
+            db.session.flush()
+            viewer_id = users[0].id
+
+            for i in range(size):
+                room = StudyRoom(name=f'Bench room {i}', subject='benchmark',
+                                 owner_id=users[i % len(users)].id, is_private=(i % 5 == 0),
+                                 active_member_count=members_per_room)
+                db.session.add(room)
+                db.session.flush()
+                for user in users[1:]:
+                    db.session.add(RoomMembership(user_id=user.id, room_id=room.id))
+            db.session.flush()
+            db.session.expire_all()
+
+            with QueryCounter(db.engine) as legacy:
+                started = time.perf_counter()
+                legacy_rooms = _legacy_directory(viewer_id)
+                legacy_seconds = time.perf_counter() - started
+            db.session.expire_all()
+
+            with QueryCounter(db.engine) as single:
+                started = time.perf_counter()
+                rooms, _ = query_room_directory(viewer_id, limit=size)
+                single_seconds = time.perf_counter() - started
+
+            results.append({
+                'rooms': size,
+                'legacy_queries': legacy.count,
+                'legacy_ms': round(legacy_seconds * 1000, 1),
+                'legacy_results': len(legacy_rooms),
+                'directory_queries': single.count,
+                'directory_ms': round(single_seconds * 1000, 1),
+                'directory_results': len(rooms)
+            })
+        finally:
+            db.session.rollback()
+    return results
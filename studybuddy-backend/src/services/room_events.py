@@ -0,0 +1,137 @@
+import json
+import queue
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from src.models.whiteboard import CollaborationEvent
+from src.services.metrics import metrics
+from src.services.redis_client import get_redis
+
+# Bound per-subscriber buffers so a stalled client can't grow memory without limit
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+def room_channel(room_id):
+    return f'room:{room_id}'
+
+
+class LocalBroker:
+    """In-process pub/sub stand-in; only reaches subscribers in the same worker"""
+
+    is_shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # channel -> set of queues
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                metrics.inc('room_events_dropped_total')
+
+    def subscribe(self, channel):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(q)
+        return LocalSubscription(self, channel, q)
+
+    def _unsubscribe(self, channel, q):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+
+class LocalSubscription:
+    def __init__(self, broker, channel, q):
+        self.broker = broker
+        self.channel = channel
+        self._queue = q
+
+    def get(self, timeout):
+        """Next message, or None if nothing arrived within timeout seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self.channel, self._queue)
+
+
+class RedisBroker:
+    """Redis pub/sub, fanning out to subscribers in every worker"""
+
+    is_shared = True
+
+    def __init__(self, client):
+        self.client = client
+
+    def publish(self, channel, message):
+        self.client.publish(channel, json.dumps(message))
+
+    def subscribe(self, channel):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(channel)
+        return RedisSubscription(pubsub)
+
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+
+    def get(self, timeout):
+        message = self._pubsub.get_message(timeout=timeout)
+        return json.loads(message['data']) if message else None
+
+    def close(self):
+        self._pubsub.close()
+
+
+def _create_broker():
+    client = get_redis()
+    return RedisBroker(client) if client is not None else LocalBroker()
+
+
+# Process-wide broker for room channels
+room_broker = _create_broker()
+
+
+def publish_room_message(room_id, message):
+    """Publish to a room channel; delivery is best effort and never fails the caller"""
+    try:
+        room_broker.publish(room_channel(room_id), message)
+        metrics.inc('room_events_published_total', type=message.get('type'))
+    except Exception:
+        metrics.inc('room_events_publish_errors_total')
+
+
+def event_message(collaboration_event):
+    """Broker/SSE payload for a persisted CollaborationEvent"""
+    return {'id': collaboration_event.id, 'type': 'event', 'event': collaboration_event.to_dict()}
+
+
+# ---------- Publish CollaborationEvents once their transaction commits ----------
+
+@event.listens_for(CollaborationEvent, 'after_insert')
+def _queue_collaboration_event(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('pending_room_events', []).append((target.room_id, event_message(target)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_committed_events(session):
+    for room_id, message in session.info.pop('pending_room_events', []):
+        publish_room_message(room_id, message)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_events(session):
+    session.info.pop('pending_room_events', None)
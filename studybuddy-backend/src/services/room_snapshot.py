@@ -0,0 +1,151 @@
+import hashlib
+from sqlalchemy import func, select
+from src.extensions import db
+from src.models.user import User
+from src.models.document import Document
+from src.models.study_room import StudyRoom, RoomMembership
+from src.models.whiteboard import WhiteboardSession, RoomDocument, CollaborationEvent
+from src.services.presence import presence
+from src.utils.stroke_codec import decode_board
+from src.utils.signed_urls import url_epoch
+
+SNAPSHOT_SECTIONS = ['room', 'members', 'whiteboard', 'documents', 'events']
+
+DEFAULT_EVENT_LIMIT = 20
+MAX_EVENT_LIMIT = 100
+
+
+def _user_summary(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name
+    }
+
+
+def room_members(room_id, online):
+    """Active members with their role and presence, in join order (one query)"""
+    members = db.session.query(RoomMembership, User)\
+                        .join(User, RoomMembership.user_id == User.id)\
+                        .filter(RoomMembership.room_id == room_id, RoomMembership.is_active == True)\
+                        .order_by(RoomMembership.joined_at).all()
+
+    members_data = []
+    for membership, user in members:
+        last_seen, is_online = presence.member_status(membership, online)
+        members_data.append({
+            'id': user.id,
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'avatar_url': user.avatar_url,
+            'role': membership.role,
+            'joined_at': membership.joined_at.isoformat() if membership.joined_at else None,
+            'last_seen': last_seen.isoformat() if last_seen else None,
+            'is_online': is_online
+        })
+    return members_data
+
+
+def room_documents(room_id):
+    """Documents shared in the room, newest first (one query)"""
+    room_documents = db.session.query(RoomDocument, Document, User)\
+                              .join(Document, RoomDocument.document_id == Document.id)\
+                              .join(User, RoomDocument.shared_by == User.id)\
+                              .filter(RoomDocument.room_id == room_id, RoomDocument.is_active == True)\
+                              .order_by(RoomDocument.shared_at.desc()).all()
+
+    documents_data = []
+    for room_doc, document, sharer in room_documents:
+        doc_data = document.to_dict()
+        doc_data.update({
+            'room_document_id': room_doc.id,
+            'shared_by': _user_summary(sharer),
+            'permissions': room_doc.permissions,
+            'shared_at': room_doc.shared_at.isoformat() if room_doc.shared_at else None,
+            'can_read': room_doc.can_read(),
+            'can_write': room_doc.can_write(),
+            'can_admin': room_doc.can_admin()
+        })
+        documents_data.append(doc_data)
+    return documents_data
+
+
+def recent_events(room_id, limit=DEFAULT_EVENT_LIMIT):
+    """The room's latest collaboration events, newest first (one query)"""
+    events = db.session.query(CollaborationEvent, User)\
+                       .join(User, CollaborationEvent.user_id == User.id)\
+                       .filter(CollaborationEvent.room_id == room_id)\
+                       .order_by(CollaborationEvent.created_at.desc())\
+                       .limit(limit).all()
+
+    events_data = []
+    for event, user in events:
+        event_data = event.to_dict()
+        event_data['user'] = _user_summary(user)
+        events_data.append(event_data)
+    return events_data
+
+
+def snapshot_state(room_id):
+    """Load the room with the markers that change whenever a snapshot section does.
+
+    Every membership, document and whiteboard change logs a CollaborationEvent,
+    so the room's latest event id covers those sections; the whiteboard version
+    and the room's updated_at cover the rest. One query; returns
+    ``(room, markers)`` or ``(None, None)``.
+    """
+    last_event_id = select(func.max(CollaborationEvent.id))\
+        .where(CollaborationEvent.room_id == room_id).scalar_subquery()
+    whiteboard_version = select(func.max(WhiteboardSession.version))\
+        .where(WhiteboardSession.room_id == room_id, WhiteboardSession.is_active == True).scalar_subquery()
+    whiteboard_updated_at = select(func.max(WhiteboardSession.updated_at))\
+        .where(WhiteboardSession.room_id == room_id, WhiteboardSession.is_active == True).scalar_subquery()
+
+    row = db.session.query(StudyRoom, last_event_id, whiteboard_version, whiteboard_updated_at)\
+                    .filter(StudyRoom.id == room_id).first()
+    if row is None:
+        return None, None
+    room, *markers = row
+    return room, (room.updated_at, room.active_member_count, *markers)
+
+
+def snapshot_etag(user_id, role, sections, events_limit, markers, online, encoded=False):
+    """ETag for one user's snapshot of the selected sections (the room's thumbnail URL changes daily)"""
+    online_ids = sorted(online) if 'members' in sections else ()
+    epoch = url_epoch() if 'room' in sections else None
+    raw = ':'.join(str(p) for p in (user_id, role, ','.join(sections), events_limit, markers, online_ids, encoded, epoch))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def build_snapshot(room, role, sections, events_limit, online, encoded=False):
+    """Build the selected sections; one query per section at most.
+
+    Whiteboard strokes stay in the compact codec only if ``encoded``.
+    """
+    snapshot = {'room_id': room.id}
+    if 'room' in sections:
+        room_data = room.to_dict()
+        room_data['my_role'] = role
+        snapshot['room'] = room_data
+    if 'members' in sections:
+        snapshot['members'] = room_members(room.id, online)
+    if 'whiteboard' in sections:
+        whiteboard_session = WhiteboardSession.query.filter_by(room_id=room.id, is_active=True).first()
+        session_dict = whiteboard_session.to_dict(include_data=True) if whiteboard_session else None
+        if session_dict and not encoded:
+            decode_board(session_dict['session_data'])
+        snapshot['whiteboard'] = {
+            'whiteboard_session': session_dict,
+            'user_permissions': {
+                'can_draw': True,
+                'can_clear': role in ['owner', 'moderator'],
+                'can_save': True
+            }
+        }
+    if 'documents' in sections:
+        snapshot['documents'] = room_documents(room.id)
+    if 'events' in sections:
+        snapshot['events'] = recent_events(room.id, events_limit)
+    return snapshot
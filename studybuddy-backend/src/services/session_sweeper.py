@@ -0,0 +1,141 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import update, bindparam, and_, func
+from src.extensions import db
+from src.models.user import User
+from src.models.study_room import StudySession, RoomMembership
+from src.services.metrics import metrics
+from src.services.presence import presence
+from src.services.study_rollups import rollup_sessions
+
+# A session is abandoned once its member has sent no heartbeat for this long
+STALE_AFTER = timedelta(minutes=10)
+
+SWEEP_CHUNK_SIZE = 500
+
+# 0 disables the sweeper in `flask run-worker` (e.g. when `flask sweep-stale-sessions` runs from cron)
+SWEEP_INTERVAL_SECONDS = int(os.environ.get('SESSION_SWEEP_INTERVAL_SECONDS', 300))
+
+
+def ensure_open_session_index():
+    """Create the open-session index on databases created before it existed"""
+    for index in StudySession.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+
+def _stale_session_ids(cutoff, after_id, limit):
+    return [row.id for row in db.session.query(StudySession.id)
+            .outerjoin(RoomMembership, and_(
+                RoomMembership.room_id == StudySession.room_id,
+                RoomMembership.user_id == StudySession.user_id
+            ))
+            .filter(
+                StudySession.end_time.is_(None),
+                StudySession.start_time < cutoff,
+                StudySession.id > after_id,
+                (RoomMembership.last_seen.is_(None)) | (RoomMembership.last_seen < cutoff)
+            )
+            .order_by(StudySession.id)
+            .limit(limit)]
+
+
+def _close_chunk(session_ids):
+    """Close one chunk of sessions in a single transaction; returns sessions closed"""
+    session_table = StudySession.__table__
+    user_table = User.__table__
+
+    # No-op write that locks the rows first (SQLite: the database), so an explicit
+    # /end racing the sweep either finishes before this or waits for the commit
+    db.session.execute(
+        update(session_table)
+        .where(session_table.c.id.in_(session_ids), session_table.c.end_time.is_(None))
+        .values(end_time=session_table.c.end_time)
+    )
+    rows = db.session.query(StudySession.id, StudySession.user_id, StudySession.start_time, RoomMembership.last_seen)\
+        .outerjoin(RoomMembership, and_(
+            RoomMembership.room_id == StudySession.room_id,
+            RoomMembership.user_id == StudySession.user_id
+        ))\
+        .filter(StudySession.id.in_(session_ids), StudySession.end_time.is_(None)).all()
+    if not rows:
+        db.session.rollback()
+        return 0
+
+    closed = []
+    credit = {}
+    for session_id, user_id, start_time, last_seen in rows:
+        # The last heartbeat is the best guess for when the user stopped studying
+        end_time = last_seen if last_seen and last_seen > start_time else start_time
+        minutes = int((end_time - start_time).total_seconds() / 60)
+        closed.append({'b_id': session_id, 'b_end_time': end_time, 'b_minutes': minutes})
+        credit[user_id] = credit.get(user_id, 0) + minutes
+
+    db.session.execute(
+        update(session_table)
+        .where(session_table.c.id == bindparam('b_id'))
+        .values(end_time=bindparam('b_end_time'), duration_minutes=bindparam('b_minutes')),
+        closed
+    )
+    credited = [{'b_user_id': user_id, 'b_minutes': minutes} for user_id, minutes in credit.items() if minutes]
+    if credited:
+        db.session.execute(
+            update(user_table)
+            .where(user_table.c.id == bindparam('b_user_id'))
+            .values(total_study_time=func.coalesce(user_table.c.total_study_time, 0) + bindparam('b_minutes')),
+            credited
+        )
+    rollup_sessions([row['b_id'] for row in closed])
+    db.session.commit()
+    return len(closed)
+
+
+def sweep_stale_sessions(chunk_size=SWEEP_CHUNK_SIZE):
+    """Close every abandoned session, one committed chunk at a time; returns sessions closed"""
+    presence.flush()  # Make this worker's recent heartbeats visible in last_seen
+    cutoff = datetime.utcnow() - STALE_AFTER
+    after_id, total = 0, 0
+    while True:
+        session_ids = _stale_session_ids(cutoff, after_id, chunk_size)
+        if not session_ids:
+            break
+        total += _close_chunk(session_ids)
+        after_id = session_ids[-1]
+    metrics.inc('study_sessions_swept_total', total)
+    return total
+
+
+class SessionSweeper:
+    """Runs sweep_stale_sessions periodically in a background thread.
+
+    Start it in one process only (``flask run-worker``), not in every web worker.
+    """
+
+    def __init__(self, interval=SWEEP_INTERVAL_SECONDS):
+        self.interval = interval
+        self._thread = None
+
+    def start(self, app):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='session-sweeper', daemon=True)
+        self._thread.start()
+
+    def _run(self, app):
+        while True:
+            time.sleep(self.interval)
+            with app.app_context():
+                try:
+                    closed = sweep_stale_sessions()
+                    if closed:
+                        app.logger.info(f"Closed {closed} abandoned study sessions")
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Session sweep failed: {e}")
+                finally:
+                    db.session.remove()
+
+
+# Process-wide sweeper
+session_sweeper = SessionSweeper()
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
+from src.extensions import db
+from src.models.ai_tutor import AIGenerationFlight
+from src.services.resilience import REQUEST_BUDGET_SECONDS, MIN_CALL_SECONDS, remaining_budget
+from src.services.llm_scheduler import AdmissionRejected
+
+# A leader can't run past the request budget; the lease ends just after it,
+# still under gunicorn's 30s worker timeout, so followers never outwait a worker
+FLIGHT_LEASE_SECONDS = REQUEST_BUDGET_SECONDS + 2
+
+# Expired flight rows are deleted this often (per worker), not only when their key recurs
+PURGE_INTERVAL_SECONDS = 300
+
+# Retry-After for a follower that ran out of budget; by then the leader has usually
+# finished and the retry is served from the kept result
+FOLLOWER_RETRY_SECONDS = 2
+
+
+def normalize_text(text):
+    """Normalize input text so trivially different copies share one flight key"""
+    return ' '.join((text or '').split())
+
+
+def make_flight_key(task, model, text, **params):
+    """Build a stable key from (task, model, normalized input, params)"""
+    payload = json.dumps({
+        'task': task,
+        'model': model,
+        'input': normalize_text(text),
+        'params': params
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls so only one reaches the upstream provider.
+
+    Callers in the same process wait on the leader's thread event. Callers in other
+    gunicorn workers see the leader's row in ``ai_generation_flights`` (unique key)
+    and poll it until the shared result is written. Completed results are kept for
+    ``result_ttl`` seconds so a burst arriving just after completion is served too.
+    """
+
+    def __init__(self, lease_seconds=FLIGHT_LEASE_SECONDS, result_ttl=30, poll_interval=0.25,
+                 purge_interval=PURGE_INTERVAL_SECONDS):
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._next_purge = 0.0
+
+    def do(self, key, fn):
+        """Run ``fn`` once per key across all concurrent callers and return its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.event.wait(min(self.lease_seconds, max(0.0, remaining_budget())))
+            if call.error is not None:
+                raise call.error
+            if call.event.is_set():
+                return call.result
+            return self._call_directly(fn)
+
+        try:
+            call.result = self._do_shared(key, fn)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result
+
+    # ---------- Cross-worker coordination ----------
+
+    def _do_shared(self, key, fn):
+        table = AIGenerationFlight.__table__
+        deadline = time.monotonic() + min(self.lease_seconds, max(0.0, remaining_budget()))
+
+        while True:
+            if self._acquire(table, key):
+                return self._lead(table, key, fn)
+
+            row = self._load(table, key)
+            if row is None:
+                continue  # Previous flight expired between insert and read, try again
+            if row.status == 'completed':
+                return json.loads(row.result)
+            if row.status == 'failed':
+                raise RuntimeError('Shared AI generation failed')
+            if time.monotonic() > deadline:
+                # Leader is stuck, don't hold this request hostage
+                return self._call_directly(fn)
+            time.sleep(self.poll_interval)
+
+    def _call_directly(self, fn):
+        """Call upstream without the leader, unless the request budget is already spent"""
+        if remaining_budget() < MIN_CALL_SECONDS:
+            raise AdmissionRejected(504, 'AI generation is taking longer than usual. Please retry shortly.',
+                                    FOLLOWER_RETRY_SECONDS)
+        return fn()
+
+    def purge_expired(self):
+        """Delete every expired flight row; returns the number deleted"""
+        table = AIGenerationFlight.__table__
+        with db.engine.begin() as conn:
+            return conn.execute(delete(table).where(table.c.expires_at < datetime.utcnow())).rowcount
+
+    def _maybe_purge(self):
+        with self._lock:
+            if time.monotonic() < self._next_purge:
+                return
+            self._next_purge = time.monotonic() + self.purge_interval
+        self.purge_expired()
+
+    def _acquire(self, table, key):
+        self._maybe_purge()
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.flight_key == key, table.c.expires_at < now))
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.insert().values(
+                    flight_key=key,
+                    status='pending',
+                    owner=f"{os.getpid()}:{threading.get_ident()}",
+                    created_at=now,
+                    expires_at=now + timedelta(seconds=self.lease_seconds)
+                ))
+            return True
+        except IntegrityError:
+            return False
+
+    def _load(self, table, key):
+        with db.engine.connect() as conn:
+            return conn.execute(select(table).where(table.c.flight_key == key)).first()
+
+    def _lead(self, table, key, fn):
+        try:
+            result = fn()
+        except Exception:
+            # Let waiting followers fail fast; the short expiry allows a fresh retry
+            with db.engine.begin() as conn:
+                conn.execute(update(table).where(table.c.flight_key == key).values(
+                    status='failed',
+                    expires_at=datetime.utcnow() + timedelta(seconds=self.poll_interval * 4)
+                ))
+            raise
+
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.flight_key == key).values(
+                status='completed',
+                result=json.dumps(result),
+                expires_at=datetime.utcnow() + timedelta(seconds=self.result_ttl)
+            ))
+        return result
+
+
+# Shared instance used by the AI generation endpoints
+ai_single_flight = SingleFlight()
@@ -0,0 +1,53 @@
+import os
+import threading
+from flask import jsonify
+from src.services.metrics import metrics
+
+# Every open SSE stream holds a gthread worker thread (16 per worker in the
+# Procfile) for minutes; the rest are kept free for ordinary API requests
+MAX_STREAMS_PER_WORKER = int(os.environ.get('MAX_STREAMS_PER_WORKER', 8))
+
+# How long a client turned away should wait before reconnecting
+STREAM_BUSY_RETRY_SECONDS = 15
+
+
+class StreamSlots:
+    """Per-worker cap on concurrently open event streams (room and job streams share it)"""
+
+    def __init__(self, limit=MAX_STREAMS_PER_WORKER):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._open = 0
+
+    def acquire(self):
+        """Take a slot; returns an idempotent release function, or None if all are taken"""
+        with self._lock:
+            if self._open >= self.limit:
+                metrics.inc('sse_streams_rejected_total')
+                return None
+            self._open += 1
+            metrics.set_gauge('sse_streams_open', self._open)
+
+        held = [True]
+
+        def release():
+            with self._lock:
+                if held[0]:
+                    held[0] = False
+                    self._open -= 1
+                    metrics.set_gauge('sse_streams_open', self._open)
+        return release
+
+
+# Process-wide stream slots
+stream_slots = StreamSlots()
+
+
+def streams_busy_response():
+    """503 telling the client when to try opening the stream again"""
+    response = jsonify({
+        'error': 'Too many open live streams on this server. Please retry shortly.',
+        'retry_after': STREAM_BUSY_RETRY_SECONDS
+    })
+    response.headers['Retry-After'] = str(STREAM_BUSY_RETRY_SECONDS)
+    return response, 503
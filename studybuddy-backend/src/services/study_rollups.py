@@ -0,0 +1,118 @@
+from datetime import date, datetime
+from sqlalchemy import update, func
+from sqlalchemy.exc import IntegrityError
+from src.extensions import db
+from src.models.study_room import StudySession
+from src.models.analytics import UserStudyDaily, RoomStudyDaily, RoomStudyDailyUser
+
+
+def _as_date(value):
+    """func.date() returns a string on SQLite and a date on PostgreSQL"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _increment(model, keys, **deltas):
+    """Add deltas to the rollup row for keys, creating the row if needed"""
+    statement = update(model)\
+        .where(*[getattr(model, name) == value for name, value in keys.items()])\
+        .values(**{name: getattr(model, name) + value for name, value in deltas.items()})\
+        .execution_options(synchronize_session=False)
+    if db.session.execute(statement).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**keys, **deltas))
+    except IntegrityError:
+        # Another transaction created the row first
+        db.session.execute(statement)
+
+
+def _add_room_day_user(room_id, day, user_id):
+    """Remember a user for a room/day; False if they were already counted"""
+    if db.session.get(RoomStudyDailyUser, (room_id, day, user_id)):
+        return False
+    try:
+        with db.session.begin_nested():
+            db.session.add(RoomStudyDailyUser(room_id=room_id, day=day, user_id=user_id))
+    except IntegrityError:
+        return False
+    return True
+
+
+def rollup_sessions(session_ids):
+    """Add ended sessions to the daily rollups, aggregated set-wise.
+
+    Sessions are attributed to the UTC day they started. Runs in the caller's
+    transaction; the caller commits. Each session must be rolled up exactly once.
+    """
+    if not session_ids:
+        return
+    day = func.date(StudySession.start_time)
+    minutes = func.sum(func.coalesce(StudySession.duration_minutes, 0))
+    ended = [StudySession.id.in_(session_ids), StudySession.end_time.isnot(None)]
+
+    user_days = db.session.query(StudySession.user_id, day, minutes, func.count(StudySession.id))\
+                          .filter(*ended).group_by(StudySession.user_id, day).all()
+    for user_id, session_day, total, count in user_days:
+        _increment(UserStudyDaily, {'user_id': user_id, 'day': _as_date(session_day)},
+                   minutes=int(total or 0), sessions=count)
+
+    room_days = db.session.query(StudySession.room_id, day, minutes, func.count(StudySession.id))\
+                          .filter(*ended).group_by(StudySession.room_id, day).all()
+    new_users = {}
+    room_day_users = db.session.query(StudySession.room_id, day, StudySession.user_id)\
+                               .filter(*ended).distinct().all()
+    for room_id, session_day, user_id in room_day_users:
+        key = (room_id, _as_date(session_day))
+        if _add_room_day_user(key[0], key[1], user_id):
+            new_users[key] = new_users.get(key, 0) + 1
+    for room_id, session_day, total, count in room_days:
+        key = (room_id, _as_date(session_day))
+        _increment(RoomStudyDaily, {'room_id': room_id, 'day': key[1]},
+                   minutes=int(total or 0), sessions=count, distinct_users=new_users.get(key, 0))
+
+
+def backfill_rollups(batch_size=500):
+    """Rebuild all rollups from StudySession, committing one batch at a time.
+
+    Sessions that end after the rebuild starts are left to the live path, so
+    nothing is counted twice. Returns the number of sessions rolled up.
+    """
+    RoomStudyDailyUser.query.delete()
+    RoomStudyDaily.query.delete()
+    UserStudyDaily.query.delete()
+    db.session.commit()
+
+    started_at = datetime.utcnow()
+    last_id, processed = 0, 0
+    while True:
+        ids = [row.id for row in db.session.query(StudySession.id).filter(
+            StudySession.id > last_id,
+            StudySession.end_time.isnot(None),
+            StudySession.end_time <= started_at
+        ).order_by(StudySession.id).limit(batch_size)]
+        if not ids:
+            return processed
+        rollup_sessions(ids)
+        db.session.commit()
+        last_id = ids[-1]
+        processed += len(ids)
+
+
+def _series(model, key_column, key, since):
+    rows = model.query.filter(key_column == key, model.day >= since).order_by(model.day).all()
+    return [row.to_dict() for row in rows]
+
+
+def user_study_series(user_id, since):
+    """Daily study stats for a user from a date on"""
+    return _series(UserStudyDaily, UserStudyDaily.user_id, user_id, since)
+
+
+def room_study_series(room_id, since):
+    """Daily study stats for a room from a date on"""
+    return _series(RoomStudyDaily, RoomStudyDaily.room_id, room_id, since)
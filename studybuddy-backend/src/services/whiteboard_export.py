@@ -0,0 +1,244 @@
+import re
+import threading
+from collections import OrderedDict
+from xml.sax.saxutils import escape, quoteattr
+from src.extensions import db
+from src.models.whiteboard import WhiteboardSession, empty_board
+from src.services.metrics import metrics
+from src.utils.spatial_index import element_bounds, line_width, stroke_coords
+from src.utils.stroke_simplify import rdp_mask
+
+# Optional PNG rasterizer; SVG export works without it
+try:
+    import cairosvg
+    PNG_AVAILABLE = True
+except ImportError:
+    PNG_AVAILABLE = False
+
+EXPORT_FORMATS = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+# Output width in px; None renders at board scale
+THUMBNAIL_SIZE = 320
+MAX_EXPORT_SIZE = 4096
+
+# Downscaled renders drop detail finer than this many output px
+RENDER_TOLERANCE_PX = 0.5
+
+# Boards saved by the canvas client are one raster image of the canvas
+_IMAGE_DATA = re.compile(r'^data:image/(png|jpeg);base64,[A-Za-z0-9+/=\s]+$')
+
+_COLOR = re.compile(r'^(#[0-9a-fA-F]{3,8}|[a-zA-Z]{1,20}|(rgb|hsl)a?\([\d\s.,%]{1,40}\))$')
+
+
+def _color(value, default):
+    """A CSS color from element data, or the default if it isn't plainly one"""
+    return value if isinstance(value, str) and _COLOR.match(value) else default
+
+
+def _num(value):
+    text = f"{value:.1f}"
+    return text[:-2] if text.endswith('.0') else text
+
+
+def _paint(element, fill_default='none'):
+    stroke = _color(element.get('color', element.get('stroke', element.get('strokeStyle'))), '#000000')
+    attrs = f' stroke={quoteattr(stroke)} fill={quoteattr(_color(element.get("fill"), fill_default))}'
+    if isinstance(element.get('opacity'), (int, float)):
+        attrs += f' opacity="{_num(min(max(element["opacity"], 0), 1))}"'
+    return attrs
+
+
+def _points(coords):
+    return ' '.join(f"{_num(x)},{_num(y)}" for x, y in coords)
+
+
+def _stroke_svg(stroke, tolerance):
+    coords = stroke_coords(stroke)
+    if coords is None:
+        return ''
+    if tolerance and len(coords) > 2:
+        coords = coords[rdp_mask(coords, tolerance)]
+    if len(coords) == 1:
+        coords = coords.repeat(2, axis=0)  # A dot still gets round caps
+    return (f'<polyline points="{_points(coords)}"{_paint(stroke)}'
+            f' stroke-width="{_num(line_width("strokes", stroke))}"'
+            f' stroke-linecap="round" stroke-linejoin="round"/>')
+
+
+def _shape_svg(shape):
+    kind = str(shape.get('type') or shape.get('shape') or shape.get('kind') or 'rect').lower()
+    paint = _paint(shape) + f' stroke-width="{_num(line_width("shapes", shape))}"'
+    if shape.get('points') is not None:
+        coords = stroke_coords(shape)
+        if coords is None:
+            return ''
+        tag = 'polygon' if kind in ('polygon', 'triangle') else 'polyline'
+        return f'<{tag} points="{_points(coords)}"{paint}/>'
+
+    number = lambda key: shape.get(key) if isinstance(shape.get(key), (int, float)) else None
+    if all(number(key) is not None for key in ('x1', 'y1', 'x2', 'y2')):
+        return (f'<line x1="{_num(shape["x1"])}" y1="{_num(shape["y1"])}"'
+                f' x2="{_num(shape["x2"])}" y2="{_num(shape["y2"])}"{paint}/>')
+    if number('x') is None or number('y') is None:
+        return ''
+    x, y = shape['x'], shape['y']
+    if number('radius') is not None:
+        return f'<circle cx="{_num(x)}" cy="{_num(y)}" r="{_num(abs(shape["radius"]))}"{paint}/>'
+    w, h = number('width') or 0, number('height') or 0
+    x, y, w, h = min(x, x + w), min(y, y + h), abs(w), abs(h)
+    if kind in ('circle', 'ellipse', 'oval'):
+        return (f'<ellipse cx="{_num(x + w / 2)}" cy="{_num(y + h / 2)}"'
+                f' rx="{_num(w / 2)}" ry="{_num(h / 2)}"{paint}/>')
+    return f'<rect x="{_num(x)}" y="{_num(y)}" width="{_num(w)}" height="{_num(h)}"{paint}/>'
+
+
+def _text_svg(text):
+    if not all(isinstance(text.get(key), (int, float)) for key in ('x', 'y')):
+        return ''
+    font_size = text.get('fontSize', text.get('font_size'))
+    font_size = font_size if isinstance(font_size, (int, float)) and font_size > 0 else 16
+    color = _color(text.get('color', text.get('fill')), '#000000')
+    lines = ''.join(
+        f'<tspan x="{_num(text["x"])}" dy="{"0" if i == 0 else _num(font_size * 1.2)}">{escape(line)}</tspan>'
+        for i, line in enumerate(str(text.get('text') or '').split('\n'))
+    )
+    return (f'<text x="{_num(text["x"])}" y="{_num(text["y"])}" font-size="{_num(font_size)}"'
+            f' font-family="sans-serif" dominant-baseline="hanging" fill={quoteattr(color)}>{lines}</text>')
+
+
+def _image_svg(board):
+    """The board's ``image_data`` snapshot drawn over the canvas area, if it is a PNG/JPEG data URL"""
+    image = board.get('image_data')
+    if not isinstance(image, str) or not _IMAGE_DATA.match(image):
+        return ''
+    _, _, width, height = board_extent({'canvas_size': board.get('canvas_size')})
+    return (f'<image x="0" y="0" width="{_num(width)}" height="{_num(height)}"'
+            f' preserveAspectRatio="xMinYMin meet" href={quoteattr(image)}/>')
+
+
+def board_extent(board):
+    """(x0, y0, x1, y1) covering the canvas and every element on it"""
+    canvas = board.get('canvas_size') if isinstance(board.get('canvas_size'), dict) else {}
+    width = canvas.get('width') if isinstance(canvas.get('width'), (int, float)) and canvas['width'] > 0 else 800
+    height = canvas.get('height') if isinstance(canvas.get('height'), (int, float)) and canvas['height'] > 0 else 600
+    x0, y0, x1, y1 = 0.0, 0.0, float(width), float(height)
+    for collection in ('strokes', 'shapes', 'text_elements'):
+        for element in board.get(collection) or ():
+            bounds = element_bounds(collection, element) if isinstance(element, dict) else None
+            if bounds:
+                x0, y0 = min(x0, bounds[0]), min(y0, bounds[1])
+                x1, y1 = max(x1, bounds[2]), max(y1, bounds[3])
+    return x0, y0, x1, y1
+
+
+def render_svg(board, size=None):
+    """Render a board to an SVG document; ``size`` is the output width in px.
+
+    Output is scaled down further if either dimension would exceed MAX_EXPORT_SIZE.
+    """
+    x0, y0, x1, y1 = board_extent(board)
+    width, height = x1 - x0, y1 - y0
+    scale = min(size / width if size else 1.0, MAX_EXPORT_SIZE / width, MAX_EXPORT_SIZE / height)
+    tolerance = RENDER_TOLERANCE_PX / scale if scale < 1 else 0
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{_num(width * scale)}" height="{_num(height * scale)}"'
+        f' viewBox="{_num(x0)} {_num(y0)} {_num(width)} {_num(height)}">',
+        f'<rect x="{_num(x0)}" y="{_num(y0)}" width="{_num(width)}" height="{_num(height)}"'
+        f' fill={quoteattr(_color(board.get("background_color"), "#ffffff"))}/>',
+        _image_svg(board)
+    ]
+    for stroke in board.get('strokes') or ():
+        if isinstance(stroke, dict):
+            parts.append(_stroke_svg(stroke, tolerance))
+    for shape in board.get('shapes') or ():
+        if isinstance(shape, dict):
+            parts.append(_shape_svg(shape))
+    for text in board.get('text_elements') or ():
+        if isinstance(text, dict):
+            parts.append(_text_svg(text))
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def render_board(board, fmt, size=None):
+    """Render a board to bytes in an EXPORT_FORMATS format"""
+    svg = render_svg(board, size).encode('utf-8')
+    if fmt == 'png':
+        return cairosvg.svg2png(bytestring=svg)
+    return svg
+
+
+class RenderCache:
+    """Per-worker LRU of rendered boards keyed by (session_id, version, format, size).
+
+    Board versions only move forward, so a cached render never goes stale;
+    storing a newer version of a board drops its older renders.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        session_id, version = key[:2]
+        with self._lock:
+            for old_key in [k for k in self._entries if k[0] == session_id and k[1] < version]:
+                self._bytes -= len(self._entries.pop(old_key))
+            if key not in self._entries:
+                self._entries[key] = body
+                self._bytes += len(body)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._bytes -= len(self._entries.popitem(last=False)[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+# Process-wide render cache
+render_cache = RenderCache()
+
+
+def export_state(room_id):
+    """``(session_id, version)`` of the room's active board, or ``(None, None)`` (one query)"""
+    row = db.session.query(WhiteboardSession.id, WhiteboardSession.version)\
+                    .filter_by(room_id=room_id, is_active=True).first()
+    return (row.id, row.version or 1) if row else (None, None)
+
+
+def export_etag(session_id, version, fmt, size):
+    return f"wb-{session_id or 0}-{version or 0}-{fmt}-{size or 'full'}"
+
+
+def export_board(session_id, fmt, size=None):
+    """Render a board through the cache; returns ``(body, version)``.
+
+    The cache is checked against the version read when loading the board, so
+    a board is only re-rendered after it changes.
+    """
+    whiteboard_session = db.session.get(WhiteboardSession, session_id) if session_id else None
+    if whiteboard_session is None:
+        return render_board(empty_board(), fmt, size), None
+
+    version = whiteboard_session.version or 1
+    key = (session_id, version, fmt, size)
+    body = render_cache.get(key)
+    if body is not None:
+        metrics.inc('whiteboard_export_cache_total', outcome='hit')
+        return body, version
+
+    metrics.inc('whiteboard_export_cache_total', outcome='miss')
+    body = render_board(whiteboard_session.get_session_data(), fmt, size)
+    render_cache.put(key, body)
+    return body, version
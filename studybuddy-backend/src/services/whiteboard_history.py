@@ -0,0 +1,222 @@
+import os
+import copy
+import json
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import delete
+from src.extensions import db
+from src.models.whiteboard import WhiteboardHistory
+from src.services.metrics import metrics
+
+# Every Nth history entry stores the full board; the rest store deltas
+KEYFRAME_INTERVAL = 20
+
+# Retention tiers as "<max age>:<keep>": "all" keeps every entry, a duration keeps
+# the newest entry per bucket of that size; "*" is any age. Default: everything
+# from the last hour, hourly for a week, daily after that.
+HISTORY_RETENTION = os.environ.get('WHITEBOARD_HISTORY_RETENTION', '1h:all,7d:1h,*:1d')
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def _parse_duration(value):
+    return timedelta(seconds=int(value[:-1]) * _UNITS[value[-1]])
+
+
+def parse_retention(spec=HISTORY_RETENTION):
+    """Parse a retention spec into [(max_age or None, bucket or None)], youngest tier first"""
+    tiers = []
+    for tier in spec.split(','):
+        max_age, keep = (part.strip() for part in tier.split(':'))
+        tiers.append((
+            None if max_age == '*' else _parse_duration(max_age),
+            None if keep == 'all' else _parse_duration(keep)
+        ))
+    return tiers
+
+
+# ---------- Deltas ----------
+
+def board_delta(old, new):
+    """Describe ``new`` relative to ``old``; lists that only grew are stored as appends"""
+    delta = {}
+    for key, value in new.items():
+        if key in old and old[key] == value:
+            continue
+        previous = old.get(key)
+        if isinstance(value, list) and isinstance(previous, list) and \
+                len(value) >= len(previous) and value[:len(previous)] == previous:
+            delta.setdefault('append', {})[key] = value[len(previous):]
+        else:
+            delta.setdefault('set', {})[key] = value
+    removed = [key for key in old if key not in new]
+    if removed:
+        delta['remove'] = removed
+    return delta
+
+
+def apply_delta(board, delta):
+    """Apply a board_delta to a board in place"""
+    for key in delta.get('remove', ()):
+        board.pop(key, None)
+    for key, value in delta.get('set', {}).items():
+        board[key] = value
+    for key, items in delta.get('append', {}).items():
+        board.setdefault(key, []).extend(items)
+    return board
+
+
+def _encode(entry, board, previous_board, chain_length):
+    """Store a board on a history entry, as a delta unless the chain is full.
+
+    ``chain_length`` counts the keyframe and deltas the entry would follow.
+    """
+    if previous_board is None or chain_length >= KEYFRAME_INTERVAL:
+        entry.is_keyframe = True
+        entry.session_data = json.dumps(board)
+        entry.delta_data = None
+    else:
+        entry.is_keyframe = False
+        entry.session_data = None
+        entry.delta_data = zlib.compress(json.dumps(board_delta(previous_board, board)).encode('utf-8'))
+
+
+def _next_board(entry, board):
+    """The board at ``entry`` given the board at the entry before it"""
+    if entry.is_keyframe or board is None:
+        return entry.get_session_data()
+    return apply_delta(board, json.loads(zlib.decompress(entry.delta_data)))
+
+
+def _chain(session_id, from_id=None, to_id=None):
+    """Entries from the last keyframe at or before ``from_id`` through ``to_id``, oldest first"""
+    keyframe = WhiteboardHistory.query.filter(
+        WhiteboardHistory.whiteboard_session_id == session_id,
+        WhiteboardHistory.is_keyframe == True
+    )
+    if from_id is not None:
+        keyframe = keyframe.filter(WhiteboardHistory.id <= from_id)
+    keyframe = keyframe.order_by(WhiteboardHistory.id.desc()).first()
+    if keyframe is None:
+        return []
+
+    query = WhiteboardHistory.query.filter(
+        WhiteboardHistory.whiteboard_session_id == session_id,
+        WhiteboardHistory.id >= keyframe.id
+    )
+    if to_id is not None:
+        query = query.filter(WhiteboardHistory.id <= to_id)
+    return query.order_by(WhiteboardHistory.id).all()
+
+
+# ---------- Recording and rebuilding ----------
+
+def record_history(whiteboard_session, board, modified_by, description):
+    """Add a history entry for a board at the session's current version"""
+    chain = _chain(whiteboard_session.id)
+    previous_board = None
+    for entry in chain:
+        previous_board = _next_board(entry, previous_board)
+
+    history = WhiteboardHistory(
+        whiteboard_session_id=whiteboard_session.id,
+        version=whiteboard_session.version,
+        modified_by=modified_by,
+        change_description=description
+    )
+    _encode(history, board, previous_board, len(chain))
+    db.session.add(history)
+    metrics.inc('whiteboard_history_entries_total', kind='keyframe' if history.is_keyframe else 'delta')
+    return history
+
+
+def history_boards(session_id, entries):
+    """Rebuild the boards for some history entries in one pass; returns {entry id: board}"""
+    if not entries:
+        return {}
+    wanted = {entry.id for entry in entries}
+    boards = {}
+    board = None
+    for entry in _chain(session_id, min(wanted), max(wanted)):
+        board = _next_board(entry, board)
+        if entry.id in wanted:
+            boards[entry.id] = copy.deepcopy(board)  # Later deltas mutate board
+    return boards
+
+
+def board_at_version(session_id, version):
+    """Get (entry, board) for the newest history entry at a version, or (None, None)"""
+    entry = WhiteboardHistory.query.filter_by(whiteboard_session_id=session_id, version=version)\
+                                   .order_by(WhiteboardHistory.id.desc()).first()
+    if entry is None:
+        return None, None
+    return entry, history_boards(session_id, [entry])[entry.id]
+
+
+# ---------- Retention ----------
+
+def _kept_ids(entries, tiers, now):
+    """Ids to keep: each tier keeps all entries or the newest per time bucket"""
+    kept = {entries[-1].id}  # Always keep the newest entry
+    newest_in_bucket = {}
+    for entry in entries:
+        age = now - entry.created_at
+        for index, (max_age, bucket) in enumerate(tiers):
+            if max_age is None or age <= max_age:
+                if bucket is None:
+                    kept.add(entry.id)
+                else:
+                    # Entries are oldest first, so later ones replace earlier ones
+                    newest_in_bucket[(index, int(entry.created_at.timestamp() // bucket.total_seconds()))] = entry.id
+                break
+    kept.update(newest_in_bucket.values())
+    return kept
+
+
+def thin_session_history(session_id, tiers=None, now=None):
+    """Apply the retention tiers to one board's history; returns entries deleted.
+
+    Dropping entries breaks the delta chain, so the first kept entry after each
+    dropped run is re-encoded against the previous kept board (or as a keyframe).
+    """
+    tiers = tiers or parse_retention()
+    now = now or datetime.utcnow()
+    entries = WhiteboardHistory.query.filter_by(whiteboard_session_id=session_id)\
+                                     .order_by(WhiteboardHistory.id).all()
+    if not entries:
+        return 0
+    kept = _kept_ids(entries, tiers, now)
+    if len(kept) == len(entries):
+        return 0
+
+    board = None
+    kept_board = None
+    chain_length = 0
+    chain_broken = False
+    for entry in entries:
+        board = _next_board(entry, board)
+        if entry.id not in kept:
+            chain_broken = True
+            continue
+        if chain_broken:
+            _encode(entry, board, kept_board, chain_length)
+            chain_broken = False
+        chain_length = 1 if entry.is_keyframe else chain_length + 1
+        kept_board = copy.deepcopy(board)
+
+    dropped = [entry.id for entry in entries if entry.id not in kept]
+    db.session.execute(
+        delete(WhiteboardHistory)
+        .where(WhiteboardHistory.id.in_(dropped))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    metrics.inc('whiteboard_history_thinned_total', len(dropped))
+    return len(dropped)
+
+
+def thin_history(spec=HISTORY_RETENTION):
+    """Apply the retention policy to every board's history; returns entries deleted"""
+    tiers = parse_retention(spec)
+    session_ids = [row[0] for row in db.session.query(WhiteboardHistory.whiteboard_session_id).distinct()]
+    return sum(thin_session_history(session_id, tiers) for session_id in session_ids)
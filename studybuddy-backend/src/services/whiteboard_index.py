@@ -0,0 +1,146 @@
+import threading
+from collections import OrderedDict
+from src.models.whiteboard import OP_COLLECTIONS, ERASE_OP
+from src.services.metrics import metrics
+from src.services.whiteboard_ops import ops_since
+from src.utils.spatial_index import QuadTree, element_bounds, line_width, polyline_hits, stroke_coords
+
+
+class BoardIndex:
+    """One board's elements by id in draw order, with a quadtree over their bounds.
+
+    Elements without an id or usable geometry are kept (viewports always
+    include them) but can't be hit.
+    """
+
+    def __init__(self, board, version, reset_version):
+        self.version = version
+        self.reset_version = reset_version
+        self.settings = {key: value for key, value in board.items() if key not in OP_COLLECTIONS.values()}
+        self._elements = {}  # key -> (collection, element), in draw order
+        self._coords = {}  # Stroke key -> point array, for exact hit-tests
+        self._unbounded = set()
+        self._tree = QuadTree()
+        self._next_key = 0
+        for collection in OP_COLLECTIONS.values():
+            for element in board.get(collection) or ():
+                self._add(collection, element)
+
+    @property
+    def element_count(self):
+        return len(self._elements)
+
+    def _add(self, collection, element):
+        key = element.get('id') if isinstance(element, dict) else None
+        if not isinstance(key, (str, int)) or key in self._elements:
+            key = ('_', self._next_key)  # Never collides with a client-visible id
+            self._next_key += 1
+        self._elements[key] = (collection, element)
+        coords = stroke_coords(element) if collection == 'strokes' and isinstance(element, dict) else None
+        bounds = element_bounds(collection, element, coords) if isinstance(element, dict) else None
+        if bounds is None or isinstance(key, tuple) or not self._tree.insert(key, bounds):
+            self._unbounded.add(key)
+        elif coords is not None:
+            self._coords[key] = coords
+
+    def apply(self, op_type, payload):
+        if op_type == ERASE_OP:
+            for key in payload.get('ids') or ():
+                if self._elements.pop(key, None) is not None:
+                    self._tree.remove(key)
+                    self._coords.pop(key, None)
+                    self._unbounded.discard(key)
+        else:
+            self._add(OP_COLLECTIONS[op_type], payload)
+
+    def viewport(self, bbox):
+        """The board with only the elements that may be visible in bbox, in draw order"""
+        keys = set(self._tree.query(bbox)) | self._unbounded
+        board = dict(self.settings)
+        for collection in OP_COLLECTIONS.values():
+            board[collection] = []
+        for key, (collection, element) in self._elements.items():
+            if key in keys:
+                board[collection].append(element)
+        return board
+
+    def hit_test(self, bbox):
+        """Ids of elements touching bbox, topmost first; strokes are tested segment by segment"""
+        hits = []
+        for key in self._tree.query(bbox):
+            coords = self._coords.get(key)
+            if coords is not None:
+                collection, element = self._elements[key]
+                if not polyline_hits(coords, bbox, line_width(collection, element) / 2):
+                    continue
+            hits.append(key)
+        order = {key: position for position, key in enumerate(self._elements)}
+        return sorted(hits, key=order.__getitem__, reverse=True)
+
+
+class WhiteboardIndexCache:
+    """Per-worker spatial indexes for recently used boards, keyed by session id.
+
+    An index is caught up from the op log when its board has moved on, and
+    rebuilt from the full board if the board was replaced or the ops needed
+    are gone.
+    """
+
+    def __init__(self, max_boards=64):
+        self.max_boards = max_boards
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def viewport(self, whiteboard_session, bbox):
+        """``(board limited to bbox, total element count)``; elements are shared, copy before mutating"""
+        index = self._index(whiteboard_session)
+        with self._lock:
+            return index.viewport(bbox), index.element_count
+
+    def hit_test(self, whiteboard_session, bbox):
+        index = self._index(whiteboard_session)
+        with self._lock:
+            return index.hit_test(bbox)
+
+    def _index(self, whiteboard_session):
+        """Index for a board at least at the session's version (call with the session freshly loaded)"""
+        session_id = whiteboard_session.id
+        version = whiteboard_session.version or 1
+        reset_version = whiteboard_session.reset_version or 1
+        with self._lock:
+            index = self._entries.get(session_id)
+            if index is not None:
+                self._entries.move_to_end(session_id)
+        if index is not None and index.reset_version == reset_version and index.version >= version:
+            metrics.inc('whiteboard_index_total', outcome='hit')
+            return index
+
+        ops = None
+        if index is not None and index.reset_version == reset_version and index.version < version:
+            ops = ops_since(whiteboard_session, index.version)
+        if ops is not None:
+            metrics.inc('whiteboard_index_total', outcome='caught_up')
+            with self._lock:
+                # Another request may have caught up meanwhile; skip ops it applied
+                for op in ops:
+                    if op.seq > index.version:
+                        index.apply(op.op_type, op.get_payload())
+                        index.version = op.seq
+            return index
+
+        metrics.inc('whiteboard_index_total', outcome='rebuilt')
+        index = BoardIndex(whiteboard_session.get_session_data(), version, reset_version)
+        with self._lock:
+            self._entries[session_id] = index
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_boards:
+                self._entries.popitem(last=False)
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Process-wide board indexes
+whiteboard_indexes = WhiteboardIndexCache()
@@ -0,0 +1,75 @@
+import json
+import threading
+from collections import OrderedDict
+from src.models.whiteboard import WhiteboardSession
+from src.services.metrics import metrics
+from src.utils.stroke_codec import decode_board
+
+
+class BoardJsonCache:
+    """Per-worker LRU of serialized boards keyed by (session_id, version, encoded).
+
+    Versions only move forward, so entries never go stale; storing a newer
+    version of a board drops its older entries.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        session_id, version = key[:2]
+        with self._lock:
+            for old_key in [k for k in self._entries if k[0] == session_id and k[1] < version]:
+                self._bytes -= len(self._entries.pop(old_key)[0])
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._bytes += len(entry[0])
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._bytes -= len(self._entries.popitem(last=False)[1][0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+# Process-wide serialized board cache
+board_json_cache = BoardJsonCache()
+
+
+def board_json(whiteboard_session, encoded):
+    """The current board as JSON bytes plus its element count.
+
+    When nothing is pending on the snapshot and the client takes encoded
+    strokes, the stored JSON is the response as-is and is passed through
+    without parsing. Otherwise the board is materialized once per version and
+    the serialized result is cached for every reader of that version.
+    """
+    if encoded and whiteboard_session.session_data and \
+            whiteboard_session.snapshot_element_count is not None and not whiteboard_session.has_pending_ops():
+        metrics.inc('whiteboard_json_reads_total', path='passthrough')
+        return whiteboard_session.session_data.encode('utf-8'), whiteboard_session.snapshot_element_count
+
+    key = (whiteboard_session.id, whiteboard_session.version or 1, encoded)
+    entry = board_json_cache.get(key)
+    if entry is not None:
+        metrics.inc('whiteboard_json_reads_total', path='cached')
+        return entry
+
+    metrics.inc('whiteboard_json_reads_total', path='serialized')
+    data = whiteboard_session.get_session_data()
+    if not encoded:
+        decode_board(data)
+    entry = (json.dumps(data).encode('utf-8'), WhiteboardSession.count_elements(data))
+    board_json_cache.put(key, entry)
+    return entry
@@ -0,0 +1,200 @@
+import json
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import inspect, text, update, delete, select
+from src.extensions import db
+from src.models.study_room import StudyRoom
+from src.models.whiteboard import WhiteboardSession, WhiteboardOp, apply_op, OP_COLLECTIONS, ERASE_OP
+from src.services.metrics import metrics
+from src.utils.stroke_simplify import DEFAULT_STROKE_TOLERANCE, simplify_stroke
+
+WHITEBOARD_OP_TYPES = list(OP_COLLECTIONS) + [ERASE_OP]
+
+# Fold the op tail into the snapshot once it is this long, so reads stay bounded
+COMPACT_AFTER_OPS = 200
+
+# Folded ops are kept this long for clients catching up on recent changes
+FOLDED_OP_RETENTION = timedelta(minutes=10)
+
+# Clients further behind than this get the full board instead of a delta
+MAX_DELTA_OPS = 1000
+
+
+def ensure_whiteboard_columns():
+    """Add whiteboard columns to databases created before they existed"""
+    binary = db.LargeBinary().compile(dialect=db.engine.dialect)
+    # (table, column, definition, backfill); existing boards are fully materialized
+    # in session_data and existing history rows are full snapshots (keyframes)
+    added_columns = [
+        ('whiteboard_sessions', 'snapshot_version', "INTEGER NOT NULL DEFAULT 1",
+         "UPDATE whiteboard_sessions SET snapshot_version = COALESCE(version, 1)"),
+        ('whiteboard_sessions', 'reset_version', "INTEGER NOT NULL DEFAULT 1",
+         "UPDATE whiteboard_sessions SET reset_version = COALESCE(version, 1)"),
+        ('whiteboard_history', 'is_keyframe', "BOOLEAN NOT NULL DEFAULT '1'", None),
+        ('whiteboard_history', 'delta_data', binary, None),
+        ('whiteboard_sessions', 'snapshot_element_count', "INTEGER", None),
+        ('study_room', 'stroke_tolerance', "FLOAT", None),
+    ]
+    inspector = inspect(db.engine)
+    columns = {table: {column['name'] for column in inspector.get_columns(table)}
+               for table in ('whiteboard_sessions', 'whiteboard_history', 'study_room')}
+    with db.engine.begin() as conn:
+        for table, column, definition, backfill in added_columns:
+            if column in columns[table]:
+                continue
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+            if backfill:
+                conn.execute(text(backfill))
+            current_app.logger.info(f"Added {table}.{column}")
+
+
+def ops_since(whiteboard_session, since_version, limit=MAX_DELTA_OPS):
+    """Ops that take a client from ``since_version`` to the current version.
+
+    Returns None when ops alone can't: the board was replaced (PUT or clear)
+    after since_version, the ops were pruned, or the gap exceeds ``limit``.
+    Seqs are the versions ops produced, so a complete tail has exactly
+    ``version - since_version`` ops.
+    """
+    version = whiteboard_session.version or 1
+    if since_version > version or since_version < (whiteboard_session.reset_version or 1):
+        return None
+    if since_version == version:
+        return []
+    if version - since_version > limit:
+        return None
+    ops = WhiteboardOp.query.filter(
+        WhiteboardOp.session_id == whiteboard_session.id,
+        WhiteboardOp.seq > since_version,
+        WhiteboardOp.seq <= version
+    ).order_by(WhiteboardOp.seq).all()
+    return ops if len(ops) == version - since_version else None
+
+
+def lock_version(whiteboard_session, base_version):
+    """Check that a board is still at ``base_version`` and hold it there until commit.
+
+    A no-op UPDATE conditional on the version takes the row lock (SQLite: the
+    database lock), so no op can land between this check and the caller's
+    write. Refreshes the session on success; False if the version moved on.
+    """
+    table = WhiteboardSession.__table__
+    result = db.session.execute(
+        update(table)
+        .where(table.c.id == whiteboard_session.id, table.c.version == base_version)
+        .values(version=table.c.version)
+    )
+    if result.rowcount != 1:
+        return False
+    db.session.refresh(whiteboard_session)
+    return True
+
+
+def lock_board(whiteboard_session):
+    """Hold a board's row lock until commit and refresh the session.
+
+    Take it before reading anything a write depends on (e.g. the history
+    chain a new delta is computed against), so no concurrent writer can
+    change it in between.
+    """
+    table = WhiteboardSession.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.id == whiteboard_session.id)
+        .values(version=table.c.version)
+    )
+    db.session.refresh(whiteboard_session)
+
+
+def room_stroke_tolerance(room_id):
+    tolerance = db.session.query(StudyRoom.stroke_tolerance).filter_by(id=room_id).scalar()
+    return DEFAULT_STROKE_TOLERANCE if tolerance is None else tolerance
+
+
+def simplify_stroke_ops(room_id, ops):
+    """Simplify incoming stroke ops in place with the room's tolerance.
+
+    Ops with ``keep_original`` set are stored as sent.
+    """
+    strokes = []
+    for op in ops:
+        if op['type'] != 'stroke':
+            continue
+        if op.get('keep_original'):
+            metrics.inc('whiteboard_strokes_ingested_total', outcome='kept_original')
+        else:
+            strokes.append(op['data'])
+    if not strokes:
+        return
+    tolerance = room_stroke_tolerance(room_id)
+    for stroke in strokes:
+        result = simplify_stroke(stroke, tolerance)
+        if result is None:
+            metrics.inc('whiteboard_strokes_ingested_total', outcome='unchanged')
+            continue
+        before, after = result
+        metrics.inc('whiteboard_strokes_ingested_total', outcome='simplified')
+        metrics.inc('whiteboard_stroke_points_total', before, stage='received')
+        metrics.inc('whiteboard_stroke_points_total', after, stage='stored')
+        metrics.observe('whiteboard_stroke_reduction_ratio', 1 - after / before)
+
+
+def needs_compaction(whiteboard_session):
+    return (whiteboard_session.version or 1) - whiteboard_session.snapshot_version >= COMPACT_AFTER_OPS
+
+
+def compact_session(session_id):
+    """Fold a board's op tail into its snapshot and prune old folded ops.
+
+    The snapshot is only written if nobody replaced it meanwhile (the UPDATE is
+    conditional on the snapshot_version that was read); ops appended during
+    compaction stay in the tail. Commits; returns the number of ops folded.
+    """
+    whiteboard_session = db.session.get(WhiteboardSession, session_id)
+    if whiteboard_session is None:
+        return 0
+    base_version = whiteboard_session.snapshot_version
+    ops = whiteboard_session.pending_ops()
+
+    folded = 0
+    if ops:
+        data = whiteboard_session.get_snapshot_data()
+        for op in ops:
+            apply_op(data, op.op_type, op.get_payload())
+        table = WhiteboardSession.__table__
+        result = db.session.execute(
+            update(table)
+            .where(table.c.id == session_id, table.c.snapshot_version == base_version)
+            .values(
+                session_data=json.dumps(data),
+                snapshot_version=ops[-1].seq,
+                snapshot_element_count=WhiteboardSession.count_elements(data)
+            )
+        )
+        if result.rowcount == 1:
+            folded = len(ops)
+
+    snapshot_version = db.session.execute(
+        select(WhiteboardSession.snapshot_version).where(WhiteboardSession.id == session_id)
+    ).scalar()
+    db.session.execute(
+        delete(WhiteboardOp)
+        .where(
+            WhiteboardOp.session_id == session_id,
+            WhiteboardOp.seq <= snapshot_version,
+            WhiteboardOp.created_at < datetime.utcnow() - FOLDED_OP_RETENTION
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    metrics.inc('whiteboard_ops_compacted_total', folded)
+    return folded
+
+
+def compact_whiteboards(min_ops=1):
+    """Compact every active board with at least ``min_ops`` pending ops; returns ops folded"""
+    session_ids = [row.id for row in db.session.query(WhiteboardSession.id).filter(
+        WhiteboardSession.is_active == True,
+        WhiteboardSession.version - WhiteboardSession.snapshot_version >= min_ops
+    )]
+    return sum(compact_session(session_id) for session_id in session_ids)
@@ -0,0 +1,38 @@
+"""
+Signed URLs for resources loaded where no Authorization header is sent (<img> tags)
+"""
+import hashlib
+import hmac
+import time
+from flask import current_app
+
+# A signed URL stays valid for this many whole days after the day it was issued
+SIGNED_URL_DAYS = 7
+
+
+def url_epoch():
+    """The current signing day; URLs issued within a day are identical, so responses holding them cache well"""
+    return int(time.time() // 86400)
+
+
+def _signature(purpose, resource_id, epoch):
+    key = current_app.config['SECRET_KEY'].encode('utf-8')
+    message = f"{purpose}:{resource_id}:{epoch}".encode('utf-8')
+    return hmac.new(key, message, hashlib.sha256).hexdigest()[:32]
+
+
+def sign_url(path, purpose, resource_id):
+    """``path`` with ``e`` (epoch) and ``sig`` query params granting access to one resource"""
+    epoch = url_epoch()
+    return f"{path}?e={epoch}&sig={_signature(purpose, resource_id, epoch)}"
+
+
+def verify_signature(purpose, resource_id, epoch, signature):
+    """Whether ``e``/``sig`` query values are a current signature for the resource"""
+    try:
+        epoch = int(epoch)
+    except (TypeError, ValueError):
+        return False
+    if not 0 <= url_epoch() - epoch <= SIGNED_URL_DAYS or not isinstance(signature, str):
+        return False
+    return hmac.compare_digest(signature, _signature(purpose, resource_id, epoch))
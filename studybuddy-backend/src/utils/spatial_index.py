@@ -0,0 +1,260 @@
+"""
+Quadtree over axis-aligned bounding boxes, and bounds for whiteboard elements
+"""
+import numpy as np
+from src.utils.stroke_codec import is_encoded, decode_points
+
+# Bounds are (min_x, min_y, max_x, max_y)
+
+# Elements further out than this (px) are treated as having no bounds
+MAX_COORDINATE = 1e9
+
+def parse_bbox(value):
+    """Parse "x0,y0,x1,y1" (or a list of four numbers) into normalized bounds"""
+    parts = value.split(',') if isinstance(value, str) else value
+    try:
+        x0, y0, x1, y1 = (float(part) for part in parts)
+    except (TypeError, ValueError):
+        raise ValueError("bbox must be four numbers: x0,y0,x1,y1")
+    if not all(np.isfinite((x0, y0, x1, y1))):
+        raise ValueError("bbox must be four numbers: x0,y0,x1,y1")
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+
+class _Node:
+    __slots__ = ('bounds', 'depth', 'items', 'children')
+
+    def __init__(self, bounds, depth):
+        self.bounds = bounds
+        self.depth = depth
+        self.items = {}
+        self.children = None
+
+    def child_for(self, bbox):
+        """The child quadrant wholly containing bbox, or None if it straddles"""
+        for child in self.children or ():
+            if _contains(child.bounds, bbox):
+                return child
+        return None
+
+    def split(self):
+        x0, y0, x1, y1 = self.bounds
+        mx, my = (x0 + x1) / 2, (y0 + y1) / 2
+        self.children = [
+            _Node(bounds, self.depth + 1)
+            for bounds in ((x0, y0, mx, my), (mx, y0, x1, my), (x0, my, mx, y1), (mx, my, x1, y1))
+        ]
+
+
+class QuadTree:
+    """Quadtree of (key, bbox) items; grows its root to fit items anywhere on the plane.
+
+    Items that straddle a quadrant boundary stay on the parent node, so every
+    item lives on exactly one node and removal is O(1) via ``_where``.
+    """
+
+    MAX_ITEMS = 16
+    MAX_DEPTH = 16
+    MIN_ROOT_SIZE = 1024.0
+    MAX_GROW_STEPS = 64  # Root up to ~1e22 px across
+
+    def __init__(self):
+        self._root = None
+        self._where = {}
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def insert(self, key, bbox):
+        """Add an item; False (nothing stored) if bbox isn't finite or is too far out to fit"""
+        if key in self._where:
+            self.remove(key)
+        if not all(np.isfinite(bbox)):
+            return False
+        if self._root is None:
+            self._root = _Node((0.0, 0.0, self.MIN_ROOT_SIZE, self.MIN_ROOT_SIZE), 0)
+        for _ in range(self.MAX_GROW_STEPS):
+            if _contains(self._root.bounds, bbox):
+                break
+            self._grow(bbox)
+        else:
+            if not _contains(self._root.bounds, bbox):
+                return False
+        self._insert(self._root, key, bbox)
+        return True
+
+    def remove(self, key):
+        node = self._where.pop(key, None)
+        if node is not None:
+            del node.items[key]
+
+    def query(self, bbox):
+        """Keys of items whose bounds intersect bbox"""
+        found = []
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            if not intersects(node.bounds, bbox):
+                continue
+            found.extend(key for key, item_bbox in node.items.items() if intersects(item_bbox, bbox))
+            stack.extend(node.children or ())
+        return found
+
+    def _insert(self, node, key, bbox):
+        while True:
+            child = node.child_for(bbox)
+            if child is None:
+                break
+            node = child
+        node.items[key] = bbox
+        self._where[key] = node
+        if node.children is None and len(node.items) > self.MAX_ITEMS and node.depth < self.MAX_DEPTH:
+            node.split()
+            for item_key, item_bbox in list(node.items.items()):
+                child = node.child_for(item_bbox)
+                if child is not None:
+                    del node.items[item_key]
+                    self._insert(child, item_key, item_bbox)
+
+    def _grow(self, bbox):
+        """Double the root toward bbox; the old root becomes one quadrant of the new one"""
+        old = self._root
+        x0, y0, x1, y1 = old.bounds
+        width, height = x1 - x0, y1 - y0
+        grow_left = bbox[0] < x0
+        grow_up = bbox[1] < y0
+        nx0 = x0 - width if grow_left else x0
+        ny0 = y0 - height if grow_up else y0
+        root = _Node((nx0, ny0, nx0 + 2 * width, ny0 + 2 * height), 0)
+        root.split()
+        root.children[(2 if grow_up else 0) + (1 if grow_left else 0)] = old
+        self._root = root
+        self._reset_depths(root, 0)
+
+    def _reset_depths(self, node, depth):
+        stack = [(node, depth)]
+        while stack:
+            node, depth = stack.pop()
+            node.depth = depth
+            stack.extend((child, depth + 1) for child in node.children or ())
+
+
+# ---------- Whiteboard element bounds ----------
+
+def _number(value, default=0.0):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else default
+
+
+# Line width keys; a shape's "width" is its extent, not its line
+_LINE_WIDTH_KEYS = {
+    'strokes': ('width', 'size', 'strokeWidth', 'lineWidth', 'brush_size'),
+    'shapes': ('strokeWidth', 'lineWidth', 'stroke_width'),
+}
+
+
+def line_width(collection, element):
+    for key in _LINE_WIDTH_KEYS.get(collection, ()):
+        if isinstance(element.get(key), (int, float)):
+            return float(element[key])
+    return 1.0 if collection in _LINE_WIDTH_KEYS else 0.0
+
+
+def stroke_coords(stroke):
+    """The stroke's points as an (n, 2) array, or None"""
+    points = stroke.get('points')
+    try:
+        if is_encoded(points):
+            points = decode_points(points)
+        if not isinstance(points, list) or not points:
+            return None
+        coords = np.array([(p['x'], p['y']) for p in points], dtype=np.float64)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return coords if np.isfinite(coords).all() else None
+
+
+def _coords_bounds(coords, pad):
+    low = coords.min(axis=0) - pad
+    high = coords.max(axis=0) + pad
+    return float(low[0]), float(low[1]), float(high[0]), float(high[1])
+
+
+def element_bounds(collection, element, coords=None):
+    """Bounding box of a board element, or None if it has no usable (finite) geometry.
+
+    Strokes use their points; shapes their points, x/y/width/height, x1/y1/x2/y2
+    or x/y/radius; text its x/y and width/height, estimated from the font size
+    and text length if not given. Strokes and shapes are padded by half their
+    line width.
+    """
+    bounds = _element_bounds(collection, element, coords)
+    if bounds is None or not all(np.isfinite(bounds)) or max(abs(v) for v in bounds) > MAX_COORDINATE:
+        return None
+    return bounds
+
+
+def _element_bounds(collection, element, coords):
+    pad = line_width(collection, element) / 2
+    if collection == 'strokes':
+        coords = stroke_coords(element) if coords is None else coords
+        return _coords_bounds(coords, pad) if coords is not None else None
+
+    if collection == 'shapes':
+        if element.get('points') is not None:
+            coords = stroke_coords(element)
+            return _coords_bounds(coords, pad) if coords is not None else None
+        if all(isinstance(element.get(key), (int, float)) for key in ('x1', 'y1', 'x2', 'y2')):
+            corners = np.array([(element['x1'], element['y1']), (element['x2'], element['y2'])], dtype=np.float64)
+            return _coords_bounds(corners, pad)
+        if not all(isinstance(element.get(key), (int, float)) for key in ('x', 'y')):
+            return None
+        x, y = float(element['x']), float(element['y'])
+        if isinstance(element.get('radius'), (int, float)):
+            r = abs(float(element['radius'])) + pad
+            return x - r, y - r, x + r, y + r
+        w, h = _number(element.get('width')), _number(element.get('height'))
+        return min(x, x + w) - pad, min(y, y + h) - pad, max(x, x + w) + pad, max(y, y + h) + pad
+
+    if collection == 'text_elements':
+        if not all(isinstance(element.get(key), (int, float)) for key in ('x', 'y')):
+            return None
+        x, y = float(element['x']), float(element['y'])
+        font_size = _number(element.get('fontSize', element.get('font_size')), 16.0)
+        lines = str(element.get('text') or '').split('\n')
+        w = _number(element.get('width'), max(len(line) for line in lines) * font_size * 0.6)
+        h = _number(element.get('height'), len(lines) * font_size * 1.2)
+        return x, y, x + w, y + h
+    return None
+
+
+def polyline_hits(coords, bbox, pad=0.0):
+    """Whether a polyline passes through bbox grown by ``pad`` (vectorized Liang-Barsky clip)"""
+    x_min, y_min, x_max, y_max = bbox[0] - pad, bbox[1] - pad, bbox[2] + pad, bbox[3] + pad
+    if len(coords) == 1:
+        x, y = coords[0]
+        return bool(x_min <= x <= x_max and y_min <= y <= y_max)
+
+    start, delta = coords[:-1], np.diff(coords, axis=0)
+    t0 = np.zeros(len(delta))
+    t1 = np.ones(len(delta))
+    hit = np.ones(len(delta), dtype=bool)
+    for p, q in ((-delta[:, 0], start[:, 0] - x_min), (delta[:, 0], x_max - start[:, 0]),
+                 (-delta[:, 1], start[:, 1] - y_min), (delta[:, 1], y_max - start[:, 1])):
+        parallel = p == 0
+        hit &= ~(parallel & (q < 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.where(parallel, 0.0, q / np.where(parallel, 1.0, p))
+        t0 = np.where(~parallel & (p < 0), np.maximum(t0, r), t0)
+        t1 = np.where(~parallel & (p > 0), np.minimum(t1, r), t1)
+    return bool((hit & (t0 <= t1)).any())
@@ -0,0 +1,114 @@
+"""
+Compact encoding for whiteboard stroke points
+"""
+import base64
+import binascii
+import numpy as np
+from flask import request
+
+# Codec name; also the value clients send in X-Stroke-Encoding to receive encoded strokes
+STROKE_CODEC = 'q16d'
+
+# Coordinates are quantized to 1/STROKE_SCALE px
+STROKE_SCALE = 10
+
+_INT16_MIN, _INT16_MAX = -32768, 32767
+
+
+class StrokeCodecError(ValueError):
+    """Raised for malformed encoded points"""
+
+
+def is_encoded(points):
+    return isinstance(points, dict) and points.get('codec') == STROKE_CODEC
+
+
+def encode_points(points, scale=STROKE_SCALE):
+    """Encode [{x, y}, ...] as quantized int16 deltas (packed little-endian, base64).
+
+    Returns the encoded dict, or None when the points can't be encoded
+    losslessly apart from quantization (extra keys, non-numbers, or a jump too
+    large for int16); callers then keep the plain list.
+    """
+    if not points or not all(isinstance(p, dict) and p.keys() == {'x', 'y'} for p in points):
+        return None
+    try:
+        coords = np.array([(p['x'], p['y']) for p in points], dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    if not np.isfinite(coords).all():
+        return None
+
+    quantized = np.rint(coords * scale).astype(np.int64)
+    deltas = np.diff(quantized, axis=0)
+    if deltas.size and (deltas.min() < _INT16_MIN or deltas.max() > _INT16_MAX):
+        return None
+    return {
+        'codec': STROKE_CODEC,
+        'scale': scale,
+        'count': len(points),
+        'origin': quantized[0].tolist(),
+        'data': base64.b64encode(deltas.astype('<i2').tobytes()).decode('ascii')
+    }
+
+
+def decode_points(encoded):
+    """Decode an encode_points dict back to [{x, y}, ...]"""
+    try:
+        scale = encoded['scale']
+        count = encoded['count']
+        deltas = np.frombuffer(base64.b64decode(encoded['data'], validate=True), dtype='<i2')
+        origin = np.asarray(encoded['origin'], dtype=np.int64)
+    except (KeyError, TypeError, ValueError, OverflowError, binascii.Error) as e:
+        raise StrokeCodecError(f"Invalid encoded points: {e}")
+    if not isinstance(scale, (int, float)) or isinstance(scale, bool) or not np.isfinite(scale) or scale <= 0:
+        raise StrokeCodecError("Invalid encoded points: scale must be a positive number")
+    if not isinstance(count, int) or isinstance(count, bool) or count < 1 \
+            or deltas.size != (count - 1) * 2 or origin.shape != (2,):
+        raise StrokeCodecError("Invalid encoded points: size mismatch")
+
+    quantized = np.empty((count, 2), dtype=np.int64)
+    quantized[0] = origin
+    quantized[1:] = deltas.reshape(-1, 2)
+    coords = np.cumsum(quantized, axis=0) / scale
+    return [{'x': x, 'y': y} for x, y in coords.tolist()]
+
+
+def encode_stroke(stroke):
+    """Encode a stroke's points in place if possible; validates already encoded points"""
+    points = stroke.get('points')
+    if is_encoded(points):
+        decode_points(points)  # Reject malformed input before it is stored
+    elif isinstance(points, list):
+        encoded = encode_points(points)
+        if encoded is not None:
+            stroke['points'] = encoded
+    return stroke
+
+
+def decode_stroke(stroke):
+    """Decode a stroke's points in place if they are encoded"""
+    if is_encoded(stroke.get('points')):
+        stroke['points'] = decode_points(stroke['points'])
+    return stroke
+
+
+def encode_board(board):
+    """Encode every stroke on a board in place"""
+    for stroke in board.get('strokes') or []:
+        if isinstance(stroke, dict):
+            encode_stroke(stroke)
+    return board
+
+
+def decode_board(board):
+    """Decode every stroke on a board in place"""
+    for stroke in board.get('strokes') or []:
+        if isinstance(stroke, dict):
+            decode_stroke(stroke)
+    return board
+
+
+def wants_encoded_strokes():
+    """Whether the current request negotiated encoded strokes (header, or query for EventSource)"""
+    return STROKE_CODEC in (request.headers.get('X-Stroke-Encoding'), request.args.get('stroke_encoding'))
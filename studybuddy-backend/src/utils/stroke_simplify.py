@@ -0,0 +1,74 @@
+"""
+Ramer-Douglas-Peucker simplification for whiteboard strokes
+"""
+import numpy as np
+from src.utils.stroke_codec import is_encoded, decode_points
+
+# Default tolerance in px for rooms that haven't set one; 0 disables simplification
+DEFAULT_STROKE_TOLERANCE = 0.5
+MAX_STROKE_TOLERANCE = 20.0
+
+
+def parse_tolerance(value):
+    """Validate a room stroke tolerance (px); None means the default"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or \
+            not 0 <= value <= MAX_STROKE_TOLERANCE:
+        raise ValueError(f"stroke_tolerance must be a number between 0 and {MAX_STROKE_TOLERANCE}")
+    return float(value)
+
+
+def rdp_mask(coords, tolerance):
+    """Boolean mask of the points RDP keeps for an (n, 2) array.
+
+    Iterative rather than recursive; each segment's point distances are
+    computed in one vectorized pass.
+    """
+    n = len(coords)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        inner = coords[start + 1:end]
+        chord = coords[end] - coords[start]
+        offsets = inner - coords[start]
+        length = np.hypot(*chord)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def simplify_stroke(stroke, tolerance):
+    """Simplify a stroke's points in place; returns (points before, points after).
+
+    Accepts plain or encoded points (encoded ones come back plain and are
+    re-encoded on storage). Extra per-point keys such as pressure are kept on
+    the surviving points. Returns None if the stroke has nothing to simplify.
+    """
+    points = stroke.get('points')
+    if is_encoded(points):
+        points = decode_points(points)
+    if not isinstance(points, list) or len(points) < 3 or not tolerance:
+        return None
+    try:
+        coords = np.array([(p['x'], p['y']) for p in points], dtype=np.float64)
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not np.isfinite(coords).all():
+        return None
+
+    keep = rdp_mask(coords, tolerance)
+    stroke['points'] = [point for point, kept in zip(points, keep) if kept]
+    return len(points), len(stroke['points'])